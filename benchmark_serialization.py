@@ -0,0 +1,132 @@
+"""
+Benchmarks the JSON serialization backends on real collected messages.
+
+Reads messages from output files of previous collections (in any output format), then
+times serializing them with each installed backend (see helper/serialization.py), as
+compact lines and as indented JSON, and deserializing them back. The canonical encoding
+used for hashing is timed separately, as it always uses the standard library.
+
+Example usage:
+```
+python benchmark_serialization.py
+python benchmark_serialization.py --input output/2024-03-18T04-21-06Z/public_group_2016527483/messages_2016527483.json --repeat 5
+```
+"""
+
+import argparse
+import glob
+import logging
+import os
+import time
+
+from helper import logger, output_format, serialization
+from helper.logger import configure_logging
+
+###########################################################################################
+# Create the ArgumentParser object to parse command line arguments
+parser = argparse.ArgumentParser(
+    description=f"Benchmarks the JSON serialization backends on collected messages."
+)
+parser.add_argument(
+    "--input",
+    nargs="*",
+    default=None,
+    help="Messages files to benchmark with (default: every messages file in 'output')",
+)
+parser.add_argument(
+    "--max-messages",
+    type=int,
+    default=100000,
+    help="Maximum number of messages to load (default 100000)",
+)
+parser.add_argument(
+    "--repeat",
+    type=int,
+    default=3,
+    help="Number of times each benchmark is repeated, the best time is kept (default 3)",
+)
+
+###########################################################################################
+
+
+def load_messages(paths: list[str], max_messages: int) -> list[dict]:
+    """
+    Loads messages from output files, in any output format.
+
+    Args:
+        paths: paths of messages files
+        max_messages: maximum number of messages to load
+
+    Returns:
+        The list of messages.
+    """
+    messages: list[dict] = []
+    for path in paths:
+        for message in output_format.read(path):
+            messages.append(message)
+            if len(messages) >= max_messages:
+                return messages
+    return messages
+
+
+def benchmark(func, messages: list, repeat: int) -> float:
+    """
+    Times a function called on every message, keeping the best of several runs.
+
+    Args:
+        func: function to call on each message
+        messages: messages, or serialized messages
+        repeat: number of runs
+
+    Returns:
+        The best time, in seconds.
+    """
+    best: float = float("inf")
+    for _ in range(repeat):
+        start_time: float = time.perf_counter()
+        for message in messages:
+            func(message)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    os.makedirs(logger.OUTPUT_DIR, exist_ok=True)
+    configure_logging(False)
+
+    paths: list[str] = args.input or sorted(
+        path
+        for extension in output_format.FORMATS.values()
+        for path in glob.glob(f"output/**/messages_*{extension}", recursive=True)
+        if not path.endswith(output_format.SEGMENT_INDEX_EXTENSION)
+    )
+    messages: list[dict] = load_messages(paths, args.max_messages)
+    if len(messages) == 0:
+        logging.error(f"[-] No messages found. Run a collection first, or set --input")
+        raise SystemExit(1)
+
+    logging.info(f"[+] Benchmarking {len(messages)} messages from {len(paths)} file(s)")
+    logging.info(f"Installed backends: {', '.join(serialization.available_backends())}")
+    for backend in serialization.available_backends():
+        serialization.set_backend(backend)
+        lines: list[str] = [serialization.dumps(message) for message in messages]
+        size: int = sum(len(line) for line in lines)
+
+        for name, func, items in [
+            ("dumps (compact)", serialization.dumps, messages),
+            ("dumps (indent)", lambda m: serialization.dumps(m, indent=True), messages),
+            ("loads", serialization.loads, lines),
+        ]:
+            seconds: float = benchmark(func, items, args.repeat)
+            logging.info(
+                f"{backend:<7} {name:<16}: {'{:.3f}'.format(seconds)} s, "
+                f"{'{:.0f}'.format(len(items) / seconds)} messages/s, "
+                f"{'{:.1f}'.format(size / seconds / 1024 / 1024)} MB/s"
+            )
+
+    seconds = benchmark(serialization.dumps_canonical, messages, args.repeat)
+    logging.info(
+        f"{'json':<7} {'dumps_canonical':<16}: {'{:.3f}'.format(seconds)} s, "
+        f"{'{:.0f}'.format(len(messages) / seconds)} messages/s"
+    )
@@ -0,0 +1,179 @@
+"""
+Converts whole output folders into newline-delimited JSON, using every core of the machine.
+
+Walks the output folders of previous collections for data files in any output format
+(i.e.: `output/<timestamp>/<entity>/messages_<id>.json`) and converts each of them into
+a newline-delimited JSON file (see helper/es.transform_to_ndjson), optionally compressed,
+with the same layout in the NDJSON output folder. Files are converted in parallel by a
+pool of worker processes, one file per worker, and each file is streamed so that memory
+usage does not depend on its size.
+
+Files that were already converted, and have not changed since, are skipped, so an
+interrupted conversion can simply be restarted. The log files of each run are written to
+`<output folder>/logs/<timestamp>/`.
+
+Example usage:
+```
+python convert_ndjson.py
+python convert_ndjson.py --input-dir output/2024-03-18T04-21-06Z --compression zstd
+```
+"""
+
+import argparse
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from helper import logger, output_format
+from helper.es import transform_to_ndjson
+from helper.logger import configure_logging
+
+LOGS_DIR: str = "logs"  # Folder of the log files of each run, in the output folder
+
+###########################################################################################
+# Create the ArgumentParser object to parse command line arguments
+parser = argparse.ArgumentParser(
+    description=f"Converts output folders of previous collections into newline-delimited JSON."
+)
+parser.add_argument(
+    "--input-dir",
+    default="output",
+    help="Folder of previous collections to convert (default 'output')",
+)
+parser.add_argument(
+    "--output-dir",
+    default="output_ndjson",
+    help="Folder to write the newline-delimited JSON files to (default 'output_ndjson')",
+)
+parser.add_argument(
+    "--compression",
+    choices=["none", "gzip", "zstd"],
+    default="none",
+    help="Compression of the newline-delimited JSON files, zstd requires `pip install zstandard` (default none)",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=os.cpu_count(),
+    help=f"Number of worker processes (default {os.cpu_count()}, the number of CPUs)",
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    default=False,
+    help="Convert every file, even if it was already converted (default False)",
+)
+parser.add_argument(
+    "--debug",
+    action="store_true",
+    default=False,
+    help="Enable debug mode (default False)",
+)
+
+###########################################################################################
+
+
+def find_data_files(input_dir: str, output_dir: str) -> list[str]:
+    """
+    Finds every data file in the input folder, in any output format.
+
+    Args:
+        input_dir: folder of previous collections
+        output_dir: folder of the converted files, which is never used as input
+
+    Returns:
+        The list of paths of data files, sorted.
+    """
+    output_dir = os.path.abspath(output_dir)
+    return sorted(
+        path
+        for extension in output_format.FORMATS.values()
+        for path in glob.glob(f"{input_dir}/**/*{extension}", recursive=True)
+        if not path.endswith(output_format.SEGMENT_INDEX_EXTENSION)
+        and not os.path.abspath(path).startswith(output_dir + os.sep)
+    )
+
+
+def _convert_file(task: tuple) -> tuple:
+    """
+    Converts a data file into newline-delimited JSON. Function to be executed in parallel.
+
+    Args:
+        task: tuple of (input path, output path without extension, compression)
+
+    Returns:
+        A tuple of (input path, output path).
+    """
+    input_path, output_path, compression = task
+    transform_to_ndjson(input_path, output_path, compression)
+    return input_path, output_path
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    start_time = time.time()
+    # Logs are written with the converted files, never into the folders read as input
+    logger.set_output_dir(
+        f"{args.output_dir}/{LOGS_DIR}/{logger.DATETIME_CODE_EXECUTED}"
+    )
+    os.makedirs(logger.OUTPUT_DIR, exist_ok=True)
+    configure_logging(args.debug)
+
+    if args.compression == "zstd" and not output_format.zstd_available():
+        parser.error(
+            "Error: --compression zstd requires zstandard. Install it with `pip install zstandard`."
+        )
+    compression: str | None = None if args.compression == "none" else args.compression
+    extension: str = output_format.FORMATS[
+        f"ndjson-{compression}" if compression else "ndjson"
+    ]
+    logging.info(f"Set input folder               : {args.input_dir}")
+    logging.info(f"Set output folder              : {args.output_dir}")
+    logging.info(f"Set compression                : {args.compression}")
+    logging.info(f"Set number of worker processes : {args.workers}")
+
+    tasks: list[tuple] = []
+    files_skipped: int = 0
+    for input_path in find_data_files(args.input_dir, args.output_dir):
+        output_path: str = output_format.strip_extension(
+            os.path.join(args.output_dir, os.path.relpath(input_path, args.input_dir))
+        )
+
+        # Skip files converted after their last change
+        if (
+            not args.force
+            and os.path.exists(output_path + extension)
+            and os.path.getmtime(output_path + extension) >= os.path.getmtime(input_path)
+        ):
+            files_skipped += 1
+            continue
+        tasks.append((input_path, output_path, compression))
+    logging.info(f"[+] Converting {len(tasks)} files ({files_skipped} already converted)")
+
+    files_converted: int = 0
+    files_failed: int = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=logger.configure_worker_logging,
+        initargs=logger.get_worker_initargs(),
+    ) as executor:
+        futures = {executor.submit(_convert_file, task): task[0] for task in tasks}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                files_converted += 1
+            except Exception as e:
+                logging.error(f"[-] Failed to convert {futures[future]}: {e}")
+                files_failed += 1
+
+    logging.info(
+        f"=========================================================================="
+    )
+    logging.info(f"Conversion completed!")
+    logging.info(
+        f"Files converted: {files_converted}, skipped: {files_skipped}, failed: {files_failed}"
+    )
+    logging.info(f"Total elapsed time: {'{:.6f}'.format(time.time() - start_time)} seconds")
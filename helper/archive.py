@@ -0,0 +1,159 @@
+"""
+Local archive of the raw Telegram API responses, for offline re-processing.
+
+When recording is enabled (see `--record`), every chunk of messages or users returned by
+the Telegram API is serialized in Telegram's own binary format (TL), compressed, and
+stored in a content-addressed archive: each object is a file named after the SHA256 of
+its content, so identical responses are only stored once. The responses are indexed in
+the local database (see Raw_responses), along with the entity they were collected from.
+
+In replay mode (see `--replay`), the recorded responses are read back into the same
+Telethon objects and fed to the same processing pipeline (translation, IOCs extraction,
+download, Elasticsearch export) without any network access. This allows re-enriching
+old data, i.e. with improved IOC patterns, even for entities that no longer exist.
+
+Archive layout:
+```
+archive/
+    <first 2 characters of hash>/<SHA256 hash>.gz
+```
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import struct
+import time
+
+from telethon.extensions import BinaryReader
+from telethon.tl.tlobject import TLObject
+from telethon.types import *
+
+from helper.db import raw_responses_get, raw_responses_insert
+
+ARCHIVE_DIR: str = "archive"
+VECTOR_CONSTRUCTOR_ID: int = 0x1CB5C415  # Constructor id of a TL vector
+
+
+def record(
+    entity: Channel | Chat | User,
+    collection_name: str,
+    objects: list[TLObject],
+    related: list[TLObject] = None,
+):
+    """
+    Records a chunk of objects returned by the Telegram API in the archive.
+
+    Args:
+        entity: entity of type Channel, Chat or User the objects were collected from
+        collection_name: type of the objects ("messages", "participants")
+        objects: objects returned by the API (i.e.: Message or User objects)
+        related (optional): users and chats referenced by the objects (i.e.: senders)
+    """
+    if len(objects) == 0:
+        return
+
+    ids: list[int] = [o.id for o in objects]
+    entity_hash: str = _write(bytes(entity))
+    content_hash: str = _write(_pack(objects) + _pack(related or []))
+    raw_responses_insert(
+        entity.id,
+        collection_name,
+        entity_hash,
+        content_hash,
+        min(ids),
+        max(ids),
+        int(time.time()),
+    )
+    logging.debug(
+        f"Recorded {len(objects)} {collection_name} of {entity.id} in archive as {content_hash}"
+    )
+
+
+def replay(collection_name: str, entity_ids: set[int] | None = None):
+    """
+    Reads the recorded objects back from the archive, one entity at a time.
+
+    Objects recorded more than once (i.e.: edited messages, users collected by several
+    runs) are returned once, as last recorded.
+
+    Args:
+        collection_name: type of the objects ("messages", "participants")
+        entity_ids (optional): ids of the entities to replay, None for all entities
+
+    Returns:
+        A generator of (entity, objects ordered by id) tuples.
+    """
+    rows: list[tuple] = [
+        row
+        for row in raw_responses_get(collection_name)
+        if entity_ids is None or row[0] in entity_ids
+    ]
+
+    i: int = 0
+    while i < len(rows):
+        entity_id: int = rows[i][0]
+        objects: dict[int, TLObject] = {}
+        entity_hash: str = None
+        while i < len(rows) and rows[i][0] == entity_id:
+            _, entity_hash, content_hash = rows[i]
+            reader = BinaryReader(_read(content_hash))
+            for o in reader.tgread_vector():  # Related objects are not needed to replay
+                objects[o.id] = o
+            i += 1
+
+        entity = BinaryReader(_read(entity_hash)).tgread_object()  # As last recorded
+        logging.info(f"Replaying {len(objects)} {collection_name} of {entity_id}")
+        yield entity, [objects[object_id] for object_id in sorted(objects)]
+
+
+def _pack(objects: list[TLObject]) -> bytes:
+    """
+    Serializes objects as a TL vector.
+    """
+    return struct.pack("<ii", VECTOR_CONSTRUCTOR_ID, len(objects)) + b"".join(
+        bytes(o) for o in objects
+    )
+
+
+def _get_path(content_hash: str) -> str:
+    return f"{ARCHIVE_DIR}/{content_hash[:2]}/{content_hash}.gz"
+
+
+def _write(data: bytes) -> str:
+    """
+    Stores data in the archive, unless identical data is already stored.
+
+    Args:
+        data: the data to store
+
+    Returns:
+        The content hash of the data.
+    """
+    content_hash: str = hashlib.sha256(data).hexdigest()
+    path: str = _get_path(content_hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then rename, so that an interrupted write never leaves a corrupted object
+        temp_path: str = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(gzip.compress(data))
+        os.replace(temp_path, path)
+
+    return content_hash
+
+
+def _read(content_hash: str) -> bytes:
+    """
+    Reads data from the archive.
+
+    Args:
+        content_hash: the content hash of the data
+
+    Returns:
+        The stored data.
+    """
+    with open(_get_path(content_hash), "rb") as file:
+        return gzip.decompress(file.read())
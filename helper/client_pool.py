@@ -0,0 +1,196 @@
+"""
+Pool of Telegram clients used to make API calls in parallel, one client per configured proxy.
+
+Every client in the pool is started from the authorization of the main client (via a
+StringSession), so no additional login is needed. Each client lives in its own thread
+with its own asyncio event loop and stays connected through its proxy for the lifetime
+of the pool, which removes the need to rotate proxies between API calls.
+
+Example usage:
+```
+with ClientPool(client) as pool:
+    for key, users in pool.imap(_search_participants, ["a", "b", "c"]):
+        ...
+```
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from telethon.sessions import StringSession
+from telethon.sync import TelegramClient
+
+from configs import API_HASH, API_ID, PROXIES
+from helper import rate_limiter
+
+CONNECT_TIMEOUT: float = 60  # Seconds to wait for the clients of the pool to connect
+
+
+class ClientPool:
+    """
+    Runs tasks on a pool of connected Telegram clients, one client per proxy.
+
+    Tasks are functions of the form `func(client, item)`. Idle clients pick up the next
+    pending item, so faster proxies naturally take on more of the work. Any throttling
+    done inside a task only delays the client (connection) that is running it, as each
+    proxy has its own rate limiter (see rate_limiter.py).
+    """
+
+    def __init__(self, client: TelegramClient, proxies: list[dict] = None):
+        """
+        Args:
+            client: the main, authorized Telegram client whose session is shared
+            proxies: proxies to connect through, one client per proxy (default PROXIES)
+        """
+        self._session_string: str = StringSession.save(client.session)
+        self._proxies: list[dict] = proxies if proxies is not None else PROXIES
+        self._tasks: queue.Queue = queue.Queue()
+        self._results: queue.Queue = queue.Queue()
+        self._threads: list[threading.Thread] = []
+        self._ready: queue.Queue = queue.Queue()
+        self._ready_lock: threading.Lock = threading.Lock()
+        self._connecting: bool = False  # True while __enter__ waits for the clients
+
+    @staticmethod
+    def available() -> bool:
+        """
+        Returns True if proxies are configured, which a ClientPool requires.
+        """
+        return PROXIES is not None and len(PROXIES) > 0
+
+    @property
+    def size(self) -> int:
+        """
+        Number of connected clients in the pool.
+        """
+        return len(self._threads)
+
+    def __enter__(self) -> "ClientPool":
+        logging.info(f"[+] Connecting a pool of {len(self._proxies)} Telegram clients")
+        self._connecting = True
+        for proxy in self._proxies:
+            thread = threading.Thread(target=self._run_worker, args=(proxy,), daemon=True)
+            thread.start()
+
+        # Wait for each client to report whether it connected, up to CONNECT_TIMEOUT
+        deadline: float = time.monotonic() + CONNECT_TIMEOUT
+        reported: int = 0
+        while reported < len(self._proxies):
+            try:
+                thread_connected: tuple[threading.Thread, bool] = self._ready.get(
+                    timeout=max(deadline - time.monotonic(), 0)
+                )
+            except queue.Empty:
+                logging.warning(
+                    f"[-] {len(self._proxies) - reported} pool clients did not connect within {CONNECT_TIMEOUT} seconds"
+                )
+                break
+            reported += 1
+            if thread_connected[1]:
+                self._threads.append(thread_connected[0])
+
+        # Clients connecting from now on disconnect rather than joining the pool
+        with self._ready_lock:
+            self._connecting = False
+        while not self._ready.empty():
+            thread_connected = self._ready.get_nowait()
+            if thread_connected[1]:
+                self._threads.append(thread_connected[0])
+
+        if len(self._threads) == 0:
+            raise Exception("None of the clients in the pool could connect to Telegram")
+        logging.info(f"{len(self._threads)} clients connected and ready")
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Drop pending tasks (i.e.: after a failed task), then signal every worker to stop
+        while not self._tasks.empty():
+            try:
+                self._tasks.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def imap(self, func, items: list):
+        """
+        Runs `func(client, item)` for every item across the clients in the pool.
+
+        Args:
+            func: function to execute, called with a connected client and an item
+            items: list of items to process
+
+        Returns:
+            A generator of (item, result) tuples in order of completion. If a task raised
+            an exception, the exception is re-raised when its result is reached.
+        """
+        for item in items:
+            self._tasks.put((func, item))
+
+        for _ in range(len(items)):
+            item, result = self._results.get()
+            if isinstance(result, Exception):
+                raise result
+            yield item, result
+
+    def _run_worker(self, proxy: dict):
+        """
+        Connects a Telegram client through the given proxy and processes tasks until stopped.
+
+        Args:
+            proxy: the proxy this worker's client connects through
+        """
+        # telethon.sync runs each call on the current thread's event loop
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        proxy_name: str = f"{proxy['proxy_type']} proxy '{proxy['addr']}:{proxy['port']}'"
+
+        # Any failure must be reported, as __enter__ waits for every client
+        try:
+            client = TelegramClient(
+                StringSession(self._session_string),
+                API_ID,
+                API_HASH,
+                proxy=proxy,
+            )
+            rate_limiter.set_connection(proxy)
+            client.connect()
+        except Exception as e:
+            logging.error(f"[-] Pool client failed to connect via {proxy_name}: {e}")
+            self._ready.put((threading.current_thread(), False))
+            loop.close()
+            return
+
+        with self._ready_lock:
+            joined: bool = self._connecting
+            if joined:
+                self._ready.put((threading.current_thread(), True))
+        if not joined:
+            logging.warning(
+                f"[-] Pool client connected via {proxy_name} after the pool started. Disconnecting..."
+            )
+            client.disconnect()
+            loop.close()
+            return
+        logging.info(f"[+] Pool client connected via {proxy_name}")
+
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            func, item = task
+            try:
+                self._results.put((item, func(client, item)))
+            except Exception as e:
+                logging.error(f"[-] Pool task failed via {proxy_name}: {e}")
+                self._results.put((item, e))
+
+        client.disconnect()
+        loop.close()
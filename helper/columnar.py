@@ -0,0 +1,287 @@
+"""
+Columnar export of the collected messages, IOCs and participants, for analytics.
+
+The JSON output keeps every field of the Telegram API objects, deeply nested, which
+analysts have to parse and flatten each time they load it into pandas or DuckDB. When
+enabled (see `--export-parquet`), collected records are also flattened into a stable
+schema and appended to Parquet files, one row group per chunk of records, as they are
+processed. Files are partitioned by entity (and by month for messages), Hive-style, so
+that queries only scan the partitions they need. Requires `pip install pyarrow`.
+
+Files are only readable once closed: writers are closed after each entity's collection,
+after each micro-batch of live messages (see `--live`), and at the end of the run.
+
+Export layout:
+```
+parquet/
+    messages/entity_id=<entity id>/month=<YYYY-MM>/<run id>_<process id>_<sequence number>.parquet
+    iocs/entity_id=<entity id>/<run id>_<process id>_<sequence number>.parquet
+    participants/entity_id=<entity id>/<run id>_<process id>_<sequence number>.parquet
+```
+
+Example usage (DuckDB):
+```
+SELECT entity_id, count(*) FROM read_parquet('parquet/messages/**/*.parquet', hive_partitioning = true)
+GROUP BY entity_id
+```
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime
+
+from telethon.types import *
+
+from helper import logger
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+PARQUET_DIR: str = "parquet"
+ROW_GROUP_SIZE: int = 50000  # Maximum number of rows per row group
+
+# Columns of each data type. Partition columns (entity_id, month) are not stored in files
+SCHEMAS: dict[str, dict[str, str]] = {
+    "messages": {
+        "id": "int64",
+        "date": "timestamp",
+        "edit_date": "timestamp",
+        "sender_id": "int64",
+        "sender_type": "string",
+        "text": "string",
+        "text_translated": "string",
+        "forward_from_id": "int64",
+        "forward_from_type": "string",
+        "forward_from_name": "string",
+        "forward_date": "timestamp",
+        "reply_to_msg_id": "int64",
+        "reply_to_top_id": "int64",
+        "media_type": "string",
+        "views": "int64",
+        "forwards": "int64",
+        "grouped_id": "int64",
+        "run_id": "string",
+    },
+    "iocs": {
+        "message_id": "int64",
+        "sender_id": "int64",
+        "sender_type": "string",
+        "ioc_type": "string",
+        "ioc_value": "string",
+        "run_id": "string",
+    },
+    "participants": {
+        "id": "int64",
+        "username": "string",
+        "first_name": "string",
+        "last_name": "string",
+        "phone": "string",
+        "lang_code": "string",
+        "bot": "bool",
+        "verified": "bool",
+        "scam": "bool",
+        "fake": "bool",
+        "premium": "bool",
+        "deleted": "bool",
+        "status": "string",
+        "was_online": "timestamp",
+        "run_id": "string",
+    },
+}
+
+# Open writers by file path, and the number of files opened by this process
+_writers: dict[str, object] = {}
+_sequence: int = 0
+_lock = threading.Lock()
+
+
+def available() -> bool:
+    """
+    Returns True if the pyarrow library is installed.
+    """
+    return pyarrow is not None
+
+
+def export(entity: Channel | Chat | User, data_type: str, records):
+    """
+    Flattens records and appends them to the entity's Parquet files, as new row groups.
+
+    Args:
+        entity: entity of type Channel, Chat or User the records were collected from
+        data_type: type of the records ("messages", "iocs", "participants")
+        records: list or generator of collected records, converted to dictionaries
+    """
+    flatten = {
+        "messages": _flatten_message,
+        "iocs": _flatten_ioc,
+        "participants": _flatten_participant,
+    }[data_type]
+
+    # Group rows by partition
+    partitions: dict[str, list[dict]] = {}
+    for record in records:
+        row: dict = flatten(record)
+        partition: str = f"{PARQUET_DIR}/{data_type}/entity_id={entity.id}"
+        if data_type == "messages":
+            month: str = row["date"].strftime("%Y-%m") if row["date"] else "unknown"
+            partition += f"/month={month}"
+        partitions.setdefault(partition, []).append(row)
+
+    rows_count: int = 0
+    with _lock:
+        for partition, rows in partitions.items():
+            table = pyarrow.Table.from_pylist(rows, schema=_get_schema(data_type))
+            _get_writer(partition, data_type).write_table(
+                table, row_group_size=ROW_GROUP_SIZE
+            )
+            rows_count += len(rows)
+    logging.info(
+        f"Exported {rows_count} {data_type} of {entity.id} to Parquet ({len(partitions)} partitions)"
+    )
+
+
+def close():
+    """
+    Closes every open Parquet writer, which makes their files readable.
+    """
+    with _lock:
+        for path, writer in _writers.items():
+            writer.close()
+            os.replace(f"{path}.tmp", path)
+            logging.debug(f"Closed Parquet file {path}")
+        _writers.clear()
+
+
+def _get_writer(partition: str, data_type: str):
+    """
+    Gets the open writer of a partition, opening a new file if necessary.
+
+    Files are written under a temporary name until closed, so that readers never see an
+    incomplete file.
+    """
+    global _sequence
+    for path, writer in _writers.items():
+        if os.path.dirname(path) == partition:
+            return writer
+
+    _sequence += 1
+    path: str = (
+        f"{partition}/{logger.DATETIME_CODE_EXECUTED}_{os.getpid()}_{_sequence}.parquet"
+    )
+    os.makedirs(partition, exist_ok=True)
+    _writers[path] = pyarrow.parquet.ParquetWriter(
+        f"{path}.tmp", _get_schema(data_type), compression="zstd"
+    )
+    return _writers[path]
+
+
+def _get_schema(data_type: str):
+    """
+    Builds the Arrow schema of a data type.
+    """
+    types: dict = {
+        "int64": pyarrow.int64(),
+        "string": pyarrow.string(),
+        "bool": pyarrow.bool_(),
+        "timestamp": pyarrow.timestamp("s", tz="UTC"),
+    }
+    return pyarrow.schema(
+        [(name, types[type_name]) for name, type_name in SCHEMAS[data_type].items()]
+    )
+
+
+def _flatten_message(message: dict) -> dict:
+    """
+    Flattens a message into the columns of the messages schema.
+    """
+    sender_type, sender_id = _get_peer(message.get("from_id") or message.get("peer_id"))
+    forward: dict = message.get("fwd_from") or {}
+    forward_from_type, forward_from_id = _get_peer(forward.get("from_id"))
+    reply_to: dict = message.get("reply_to") or {}
+    return {
+        "id": message.get("id"),
+        "date": _get_datetime(message.get("date")),
+        "edit_date": _get_datetime(message.get("edit_date")),
+        "sender_id": sender_id,
+        "sender_type": sender_type,
+        "text": message.get("message"),
+        "text_translated": message.get("message_translated"),
+        "forward_from_id": forward_from_id,
+        "forward_from_type": forward_from_type,
+        "forward_from_name": forward.get("from_name"),
+        "forward_date": _get_datetime(forward.get("date")),
+        "reply_to_msg_id": reply_to.get("reply_to_msg_id"),
+        "reply_to_top_id": reply_to.get("reply_to_top_id"),
+        "media_type": (message.get("media") or {}).get("_"),
+        "views": message.get("views"),
+        "forwards": message.get("forwards"),
+        "grouped_id": message.get("grouped_id"),
+        "run_id": logger.DATETIME_CODE_EXECUTED,
+    }
+
+
+def _flatten_ioc(ioc: dict) -> dict:
+    """
+    Flattens an IOC into the columns of the IOCs schema. The message texts are not
+    exported, as they can be joined from the messages.
+    """
+    from_id: dict = ioc.get("from_id") or {}
+    sender_type: str | None = (
+        "user" if from_id.get("user_id") else "channel" if from_id.get("channel_id") else None
+    )
+    return {
+        "message_id": ioc.get("message_id"),
+        "sender_id": from_id.get("user_id") or from_id.get("channel_id"),
+        "sender_type": sender_type,
+        "ioc_type": ioc.get("ioc_type"),
+        "ioc_value": ioc.get("ioc_value"),
+        "run_id": logger.DATETIME_CODE_EXECUTED,
+    }
+
+
+def _flatten_participant(participant: dict) -> dict:
+    """
+    Flattens a participant (user) into the columns of the participants schema.
+    """
+    status: dict = participant.get("status") or {}
+    return {
+        "id": participant.get("id"),
+        "username": participant.get("username"),
+        "first_name": participant.get("first_name"),
+        "last_name": participant.get("last_name"),
+        "phone": participant.get("phone"),
+        "lang_code": participant.get("lang_code"),
+        "bot": participant.get("bot"),
+        "verified": participant.get("verified"),
+        "scam": participant.get("scam"),
+        "fake": participant.get("fake"),
+        "premium": participant.get("premium"),
+        "deleted": participant.get("deleted"),
+        "status": status.get("_"),
+        "was_online": _get_datetime(status.get("was_online")),
+        "run_id": logger.DATETIME_CODE_EXECUTED,
+    }
+
+
+def _get_peer(peer: dict | None) -> tuple[str | None, int | None]:
+    """
+    Gets the type ("user", "chat", "channel") and id of a peer (i.e.: PeerUser).
+    """
+    for peer_type in ("user", "chat", "channel"):
+        if peer and peer.get(f"{peer_type}_id"):
+            return peer_type, peer[f"{peer_type}_id"]
+    return None, None
+
+
+def _get_datetime(value) -> datetime | None:
+    """
+    Gets a datetime from a datetime object (as collected) or an ISO string (as read back
+    from the JSON output).
+    """
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
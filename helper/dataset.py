@@ -0,0 +1,360 @@
+"""
+Consolidated, per-entity dataset of the messages and IOCs collected across all runs.
+
+Every run writes its output into a new timestamped folder (see logger.OUTPUT_DIR), so the
+history of an entity is spread over many, possibly overlapping, files. In addition, each
+batch of processed messages is appended to the entity's dataset as a segment, and every
+segment is listed in the entity's manifest along with its range of message ids, the run
+that wrote it and its checksum.
+
+Segments are compacted by size tier: once `COMPACT_THRESHOLD` consecutive segments are of
+a similar size (within a factor of `TIER_FACTOR`), they are merged into a single segment
+ordered by message id, and duplicates (i.e.: messages re-collected after a failed run, or
+edited messages) are dropped, keeping the most recent copy. Small segments are merged often
+and large segments rarely, so each record is only rewritten a logarithmic number of times
+as the history of an entity grows.
+
+Segments whose checksum does not match their manifest entry are marked as corrupted in the
+manifest, and are no longer compacted nor read.
+
+Dataset layout:
+```
+dataset/
+    <entity type>_<entity id>/
+        <data type>/
+            manifest.json
+            <data type>_<first id>_<last id>_<run id>_<sequence number>.json
+```
+"""
+
+import hashlib
+import heapq
+import json
+import logging
+import os
+import time
+
+import ijson
+from telethon.types import *
+
+from helper import logger, serialization
+from helper.helper import get_entity_type_name
+
+DATASET_DIR: str = "dataset"
+MANIFEST_FILE_NAME: str = "manifest.json"
+COMPACT_THRESHOLD: int = 4  # Number of consecutive segments of a size tier that are compacted
+TIER_FACTOR: int = 4  # Ratio between the number of records of consecutive size tiers
+
+# Field ordering the records of each data type, and fields identifying a unique record
+_ORDER_FIELDS: dict[str, str] = {"messages": "id", "iocs": "message_id"}
+_UNIQUE_FIELDS: dict[str, tuple] = {
+    "messages": ("id",),
+    "iocs": ("message_id", "ioc_type", "ioc_value"),
+}
+
+
+def add_segment(entity: Channel | Chat | User, data_type: str, records: list[dict]):
+    """
+    Appends records to the entity's dataset as a new segment, then compacts the entity's
+    segments of a similar size if there are too many of them (see `compact`).
+
+    Args:
+        entity: entity of type Channel, Chat or User the records were collected from
+        data_type: type of the records ("messages", "iocs")
+        records: collected records, converted to dictionaries
+    """
+    if len(records) == 0:
+        return
+
+    data_dir: str = get_data_dir(entity, data_type)
+    order_field: str = _ORDER_FIELDS[data_type]
+    records = sorted(records, key=lambda record: record[order_field])
+    first_id: int = records[0][order_field]
+    last_id: int = records[-1][order_field]
+    run_id: str = f"{logger.DATETIME_CODE_EXECUTED}_{os.getpid()}"
+
+    manifest: dict = read_manifest(data_dir)
+    segment: dict = _write_segment(
+        data_dir,
+        f"{data_type}_{first_id}_{last_id}_{run_id}_{_next_sequence(manifest)}.json",
+        records,
+    )
+    segment.update({"first_id": first_id, "last_id": last_id, "run_id": run_id})
+    manifest["segments"].append(segment)
+    _write_manifest(data_dir, manifest)
+    logging.info(
+        f"Added {len(records)} {data_type} to the dataset of {entity.id} ({len(manifest['segments'])} segments)"
+    )
+
+    compact(data_dir, data_type)
+
+
+def compact(data_dir: str, data_type: str) -> int:
+    """
+    Merges the consecutive segments of an entity's dataset that are in the same size tier
+    into one segment, dropping duplicates, as long as a tier has `COMPACT_THRESHOLD`
+    consecutive segments. Only consecutive segments are merged, so that the most recent
+    copy of a record stays in the most recent segment.
+
+    Args:
+        data_dir: folder of the entity's records of the given data type
+        data_type: type of the records ("messages", "iocs")
+
+    Returns:
+        The number of compactions done.
+    """
+    compactions: int = 0
+    while True:
+        manifest: dict = read_manifest(data_dir)
+        segments: list[dict] = manifest["segments"]
+        start: int | None = _find_compaction(segments)
+        if start is None:
+            return compactions
+        merged: list[dict] = segments[start : start + COMPACT_THRESHOLD]
+
+        corrupted: list[dict] = [
+            segment
+            for segment in merged
+            if _hash_file(os.path.join(data_dir, segment["file"])) != segment["sha256"]
+        ]
+        if len(corrupted) > 0:
+            for segment in corrupted:
+                logging.error(
+                    f"[-] Segment {segment['file']} of {data_dir} is corrupted. It is no longer compacted nor read"
+                )
+                segment["corrupted"] = True
+            _write_manifest(data_dir, manifest)
+            continue
+
+        _compact_segments(data_dir, data_type, manifest, start)
+        compactions += 1
+
+
+def _find_compaction(segments: list[dict]) -> int | None:
+    """
+    Finds the first run of `COMPACT_THRESHOLD` consecutive segments in the same size tier,
+    without corrupted segments.
+
+    Returns:
+        The position of the first segment of the run, or None if no run was found.
+    """
+    run_start: int = 0
+    for position, segment in enumerate(segments):
+        if segment.get("corrupted"):
+            run_start = position + 1
+            continue
+        if _tier(segment) != _tier(segments[run_start]):
+            run_start = position
+        if position - run_start + 1 >= COMPACT_THRESHOLD:
+            return run_start
+    return None
+
+
+def _tier(segment: dict) -> int:
+    """
+    Gets the size tier of a segment: segments of fewer than `TIER_FACTOR` records are in
+    tier 0, and each tier holds segments `TIER_FACTOR` times larger than the previous tier.
+    """
+    tier: int = 0
+    count: int = segment["count"]
+    while count >= TIER_FACTOR:
+        count //= TIER_FACTOR
+        tier += 1
+    return tier
+
+
+def _compact_segments(data_dir: str, data_type: str, manifest: dict, start: int):
+    """
+    Merges `COMPACT_THRESHOLD` consecutive segments into one segment, at their position in
+    the manifest.
+
+    Args:
+        data_dir: folder of the entity's records of the given data type
+        data_type: type of the records ("messages", "iocs")
+        manifest: manifest of the entity's records of the given data type
+        start: position of the first segment to merge
+    """
+    segments: list[dict] = manifest["segments"][start : start + COMPACT_THRESHOLD]
+    logging.info(f"[+] Compacting {len(segments)} segments of {data_dir}")
+    run_id: str = f"{logger.DATETIME_CODE_EXECUTED}_{os.getpid()}"
+    first_id: int = min(segment["first_id"] for segment in segments)
+    last_id: int = max(segment["last_id"] for segment in segments)
+    compacted: dict = _write_segment(
+        data_dir,
+        f"{data_type}_{first_id}_{last_id}_{run_id}_{_next_sequence(manifest)}_compacted.json",
+        _merge(data_dir, data_type, segments),
+    )
+    compacted.update(
+        {
+            "first_id": first_id,
+            "last_id": last_id,
+            "run_id": run_id,
+            "compacted_runs": sorted(
+                {
+                    run
+                    for segment in segments
+                    for run in segment.get("compacted_runs", [segment["run_id"]])
+                }
+            ),
+        }
+    )
+
+    # Switch the manifest to the compacted segment before deleting the merged segments
+    manifest["segments"][start : start + COMPACT_THRESHOLD] = [compacted]
+    _write_manifest(data_dir, manifest)
+    for segment in segments:
+        os.remove(os.path.join(data_dir, segment["file"]))
+    logging.info(
+        f"Compacted {len(segments)} segments of {data_dir} into {compacted['count']} {data_type}"
+    )
+
+
+def read(data_dir: str, data_type: str):
+    """
+    Reads an entity's records of a data type, in order, without duplicates.
+
+    Segments are streamed and merged, so that memory usage does not grow with the size of
+    the history. When a record is in several segments, the most recent copy is kept.
+    Corrupted segments are left out.
+
+    Args:
+        data_dir: folder of the entity's records of the given data type
+        data_type: type of the records ("messages", "iocs")
+
+    Returns:
+        A generator of records, ordered by message id.
+    """
+    segments: list[dict] = read_manifest(data_dir)["segments"]
+    for segment in segments:
+        if segment.get("corrupted"):
+            logging.warning(f"[-] Skipping corrupted segment {segment['file']} of {data_dir}")
+    yield from _merge(
+        data_dir,
+        data_type,
+        [segment for segment in segments if not segment.get("corrupted")],
+    )
+
+
+def _merge(data_dir: str, data_type: str, segments: list[dict]):
+    """
+    Merges segments into one stream of records ordered by message id, without duplicates.
+
+    Args:
+        data_dir: folder of the entity's records of the given data type
+        data_type: type of the records ("messages", "iocs")
+        segments: segments to merge, from the oldest to the most recent
+
+    Returns:
+        A generator of records, ordered by message id.
+    """
+    order_field: str = _ORDER_FIELDS[data_type]
+    unique_fields: tuple = _UNIQUE_FIELDS[data_type]
+
+    def _stream(position: int, segment: dict):
+        with open(os.path.join(data_dir, segment["file"]), "rb") as file:
+            for record in ijson.items(file, "item", use_float=True):
+                yield record[order_field], position, record
+
+    # Merge segments by order field. Records with the same order field are grouped, and
+    # the copy from the most recent segment (highest position) wins
+    group_id = None
+    group: dict[tuple, tuple[int, dict]] = {}
+    for order_id, position, record in heapq.merge(
+        *[_stream(position, segment) for position, segment in enumerate(segments)],
+        key=lambda item: (item[0], item[1]),
+    ):
+        if order_id != group_id:
+            yield from (record for _, record in sorted(group.values(), key=lambda g: g[0]))
+            group_id, group = order_id, {}
+        unique_key: tuple = tuple(record.get(field) for field in unique_fields)
+        first_position: int = group[unique_key][0] if unique_key in group else len(group)
+        group[unique_key] = (first_position, record)
+    yield from (record for _, record in sorted(group.values(), key=lambda g: g[0]))
+
+
+def read_manifest(data_dir: str) -> dict:
+    """
+    Reads the manifest of an entity's records of a data type.
+
+    Args:
+        data_dir: folder of the entity's records of the given data type
+
+    Returns:
+        The manifest, with an empty list of segments if the folder has no manifest yet.
+    """
+    manifest_path: str = os.path.join(data_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {"segments": [], "sequence": 0}
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _next_sequence(manifest: dict) -> int:
+    """
+    Increments the manifest's sequence number, which makes segment file names unique.
+    """
+    manifest["sequence"] = manifest.get("sequence", 0) + 1
+    return manifest["sequence"]
+
+
+def get_data_dir(entity: Channel | Chat | User, data_type: str) -> str:
+    """
+    Gets the folder of an entity's records of a data type.
+    """
+    return f"{DATASET_DIR}/{get_entity_type_name(entity)}_{entity.id}/{data_type}"
+
+
+def _write_segment(data_dir: str, file_name: str, records) -> dict:
+    """
+    Writes records into a segment file, one record per line.
+
+    Args:
+        data_dir: folder of the entity's records of the given data type
+        file_name: name of the segment file
+        records: list or generator of records
+
+    Returns:
+        The manifest entry of the segment, without its range of ids and run id.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path: str = os.path.join(data_dir, file_name)
+    sha256 = hashlib.sha256()
+    count: int = 0
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        for record in records:
+            line: str = f"{'[' if count == 0 else ','}\n{serialization.dumps(record)}"
+            file.write(line)
+            sha256.update(line.encode("utf-8"))
+            count += 1
+        line = "[]\n" if count == 0 else "\n]\n"
+        file.write(line)
+        sha256.update(line.encode("utf-8"))
+    os.replace(f"{path}.tmp", path)
+
+    return {
+        "file": file_name,
+        "count": count,
+        "sha256": sha256.hexdigest(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def _write_manifest(data_dir: str, manifest: dict):
+    """
+    Replaces the manifest of an entity's records of a data type.
+    """
+    manifest_path: str = os.path.join(data_dir, MANIFEST_FILE_NAME)
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def _hash_file(path: str) -> str:
+    """
+    Computes the SHA256 hash of a file, reading it in blocks.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
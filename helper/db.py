@@ -7,8 +7,10 @@ the Telegram API. This database does not store the actual collected data.
 """
 
 import sqlite3
+import time
 
 sqlite_db_name: str = "app.db"
+sqlite_timeout: float = 30.0  # seconds to wait for a lock held by another worker process
 
 
 def start_database():
@@ -17,11 +19,14 @@ def start_database():
     """
     try:
         # Create or connect to the SQLite3 database
-        conn = sqlite3.connect(sqlite_db_name)
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
 
         # Create a cursor object to execute SQL commands
         cursor = conn.cursor()
 
+        # Allow worker processes to read while another worker writes
+        cursor.execute("PRAGMA journal_mode=WAL;")
+
         # Create required tables
         # To track messages collection details/metadata, such as offset ID or elapsed time
         cursor.execute(
@@ -32,10 +37,21 @@ def start_database():
                 start_offset_id INTEGER, 
                 last_offset_id INTEGER,
                 collection_start_timestamp INTEGER,
-                collection_end_timestamp INTEGER
+                collection_end_timestamp INTEGER,
+                messages_collected INTEGER,
+                iocs_collected INTEGER
             );
             """
         )
+        # Add the collection yield columns to databases created before they existed
+        messages_collection_columns: list[str] = [
+            row[1] for row in cursor.execute("PRAGMA table_info(Messages_collection);")
+        ]
+        for column_name in ["messages_collected", "iocs_collected"]:
+            if column_name not in messages_collection_columns:
+                cursor.execute(
+                    f"ALTER TABLE Messages_collection ADD COLUMN {column_name} INTEGER;"
+                )
         cursor.execute(
             """
             CREATE TABLE IF NOT EXISTS IOCs (
@@ -50,8 +66,126 @@ def start_database():
             );
             """
         )
+        # To track the participant IDs of an entity as of its latest participants collection
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Participants_snapshot (
+                entity_id INTEGER PRIMARY KEY,
+                user_ids BLOB,
+                collection_timestamp INTEGER
+            );
+            """
+        )
+        # To track participants joining or leaving an entity between participants collections
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Participants_membership (
+                id INTEGER PRIMARY KEY,
+                entity_id INTEGER,
+                user_id INTEGER,
+                event TEXT,
+                event_timestamp INTEGER
+            );
+            """
+        )
+        # To cache the dialogs (entities) each account is in for a short time between runs
+        dialogs_cache_columns: list[str] = [
+            row[1] for row in cursor.execute("PRAGMA table_info(Dialogs_cache);")
+        ]
+        if dialogs_cache_columns and "account_id" not in dialogs_cache_columns:
+            # Cached before dialogs were cached per account. Only a cache, so drop it
+            cursor.execute("DROP TABLE Dialogs_cache;")
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Dialogs_cache (
+                account_id INTEGER,
+                position INTEGER,
+                entity BLOB,
+                unread_count INTEGER,
+                top_message_id INTEGER,
+                date INTEGER,
+                cached_timestamp INTEGER,
+                PRIMARY KEY (account_id, position)
+            );
+            """
+        )
+        # To track the latest metadata of each entity and detect changes between collections
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Entities_metadata (
+                entity_id INTEGER PRIMARY KEY,
+                content_hash TEXT,
+                title TEXT,
+                username TEXT,
+                participants_count INTEGER,
+                changed_timestamp INTEGER
+            );
+            """
+        )
+        # To keep the history of every change in an entity's metadata (i.e.: renames)
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Entities_history (
+                id INTEGER PRIMARY KEY,
+                entity_id INTEGER,
+                content_hash TEXT,
+                title TEXT,
+                username TEXT,
+                participants_count INTEGER,
+                changed_timestamp INTEGER
+            );
+            """
+        )
+        # To share entities between worker processes (one per account) with time-limited leases
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Work_queue (
+                entity_id INTEGER PRIMARY KEY,
+                lease_owner TEXT,
+                lease_expires_timestamp INTEGER,
+                last_completed_timestamp INTEGER
+            );
+            """
+        )
+        # To index the raw API responses recorded in the local archive (see archive.py)
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Raw_responses (
+                id INTEGER PRIMARY KEY,
+                entity_id INTEGER,
+                collection_name TEXT,
+                entity_hash TEXT,
+                content_hash TEXT,
+                first_id INTEGER,
+                last_id INTEGER,
+                collection_timestamp INTEGER
+            );
+            """
+        )
+        # To skip files that were already re-enriched by reprocess.py
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Reprocessed_files (
+                input_path TEXT PRIMARY KEY,
+                content_hash TEXT,
+                enrichment_version TEXT,
+                reprocessed_timestamp INTEGER
+            );
+            """
+        )
         # Fetch names of all tables to verify that all tables were created successfully
-        table_names: list[str] = ["Messages_collection", "IOCs"]
+        table_names: list[str] = [
+            "Messages_collection",
+            "IOCs",
+            "Participants_snapshot",
+            "Participants_membership",
+            "Dialogs_cache",
+            "Entities_metadata",
+            "Entities_history",
+            "Work_queue",
+            "Raw_responses",
+            "Reprocessed_files",
+        ]
         for table_name in table_names:
             res = cursor.execute(
                 f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}';"
@@ -86,7 +220,7 @@ def messages_collection_get_offset_id(entity_id: int):
     """
     try:
         # Create or connect to the SQLite3 database
-        conn = sqlite3.connect(sqlite_db_name)
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
 
         # Create a cursor object to execute SQL commands
         cursor = conn.cursor()
@@ -123,6 +257,8 @@ def messages_collection_insert_offset_id(
     last_offset_id: int,
     collection_start_timestamp: int,
     collection_end_timestamp: int,
+    messages_collected: int = None,
+    iocs_collected: int = None,
 ):
     """
     Inserts the latest offset id in the database with the latest offset id
@@ -141,10 +277,14 @@ def messages_collection_insert_offset_id(
             epoch timestamp of when the latest completed successful collection started (i.e.: 1707699810)
         collection_end_timestamp:
             epoch timestamp of when the latest completed successful collection ended
+        messages_collected (optional):
+            number of messages collected in this collection
+        iocs_collected (optional):
+            number of IOCs extracted from the messages collected in this collection
     """
     try:
         # Create or connect to the SQLite3 database
-        conn = sqlite3.connect(sqlite_db_name)
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
 
         # Create a cursor object to execute SQL commands
         cursor = conn.cursor()
@@ -152,9 +292,10 @@ def messages_collection_insert_offset_id(
         # Define SQL query
         sql_query = """
         INSERT INTO Messages_collection (
-            entity_id, start_offset_id, last_offset_id, collection_start_timestamp, collection_end_timestamp
+            entity_id, start_offset_id, last_offset_id, collection_start_timestamp, collection_end_timestamp,
+            messages_collected, iocs_collected
         )
-        VALUES (?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
         """
 
         # Insert into the table
@@ -166,6 +307,8 @@ def messages_collection_insert_offset_id(
                 last_offset_id,
                 collection_start_timestamp,
                 collection_end_timestamp,
+                messages_collected,
+                iocs_collected,
             ),
         )
 
@@ -177,6 +320,39 @@ def messages_collection_insert_offset_id(
         conn.close()
 
 
+def messages_collection_get_stats() -> dict[int, tuple]:
+    """
+    Gets the historical yield of the messages collections of every entity.
+
+    Collections made before yields were tracked are ignored in the averages.
+
+    Returns:
+        Dictionary of entity id to its (latest offset id, average messages collected per run,
+        average IOCs extracted per run, epoch timestamp of the latest run that collected
+        new messages or None).
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        res = cursor.execute(
+            """
+            SELECT
+                entity_id,
+                MAX(last_offset_id),
+                AVG(messages_collected),
+                AVG(iocs_collected),
+                MAX(CASE WHEN messages_collected > 0 THEN collection_end_timestamp END)
+            FROM Messages_collection GROUP BY entity_id;
+            """
+        )
+        return {row[0]: row[1:] for row in res.fetchall()}
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
 def iocs_batch_insert(iocs: list[dict]):
     """
     Batch inserts IOCs into the database.
@@ -188,7 +364,7 @@ def iocs_batch_insert(iocs: list[dict]):
         if iocs is None or len(iocs) == 0:
             return
 
-        conn = sqlite3.connect(sqlite_db_name)
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
         cursor = conn.cursor()
 
         sql_query = """
@@ -216,3 +392,507 @@ def iocs_batch_insert(iocs: list[dict]):
         raise f"Database error: {err}"
     finally:
         conn.close()
+
+
+def participants_snapshot_get(entity_id: int) -> bytes | None:
+    """
+    Gets the participant IDs of an entity as of its latest participants collection.
+
+    Args:
+        entity_id:
+            id of the entity (i.e.: public group, private group, channel, user)
+
+    Returns:
+        The sorted participant IDs encoded as bytes (see helper/membership.py),
+        or None if the entity's participants have never been collected.
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        res = cursor.execute(
+            "SELECT user_ids FROM Participants_snapshot WHERE entity_id = ?;",
+            (entity_id,),
+        )
+        row = res.fetchone()
+
+        return row[0] if row is not None else None
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def participants_membership_update(
+    entity_id: int,
+    user_ids: bytes,
+    joined_ids: list[int],
+    left_ids: list[int],
+    collection_timestamp: int,
+):
+    """
+    Replaces the participants snapshot of an entity and records who joined or left.
+
+    Both writes are done in a single transaction so that the snapshot and the recorded
+    membership events never disagree with each other.
+
+    Args:
+        entity_id:
+            id of the entity (i.e.: public group, private group, channel, user)
+        user_ids:
+            sorted participant IDs of the current collection encoded as bytes
+        joined_ids:
+            IDs of users who joined the entity since the previous collection
+        left_ids:
+            IDs of users who left the entity since the previous collection
+        collection_timestamp:
+            epoch timestamp of the current participants collection (i.e.: 1707699810)
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO Participants_snapshot (entity_id, user_ids, collection_timestamp)
+            VALUES (?, ?, ?)
+            """,
+            (entity_id, user_ids, collection_timestamp),
+        )
+
+        events = [
+            (entity_id, user_id, "join", collection_timestamp) for user_id in joined_ids
+        ] + [(entity_id, user_id, "leave", collection_timestamp) for user_id in left_ids]
+        cursor.executemany(
+            """
+            INSERT INTO Participants_membership (entity_id, user_id, event, event_timestamp)
+            VALUES (?, ?, ?, ?)
+            """,
+            events,
+        )
+
+        conn.commit()
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def dialogs_cache_get(account_id: int, min_timestamp: int) -> list[tuple] | None:
+    """
+    Gets the cached dialogs of an account, if they were cached at or after the given
+    timestamp.
+
+    Args:
+        account_id: id of the Telegram account (user) that the dialogs belong to
+        min_timestamp: oldest acceptable epoch timestamp of the cached dialogs
+
+    Returns:
+        List of (entity bytes, unread count, top message id, date) tuples ordered from
+        most recent dialog first, or None if there are no recent enough cached dialogs.
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        res = cursor.execute(
+            "SELECT MIN(cached_timestamp) FROM Dialogs_cache WHERE account_id = ?;",
+            (account_id,),
+        )
+        cached_timestamp = res.fetchone()[0]
+        if cached_timestamp is None or cached_timestamp < min_timestamp:
+            return None
+
+        res = cursor.execute(
+            """
+            SELECT entity, unread_count, top_message_id, date FROM Dialogs_cache
+            WHERE account_id = ? ORDER BY position;
+            """,
+            (account_id,),
+        )
+        return res.fetchall()
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def dialogs_cache_insert(account_id: int, dialogs: list[tuple], cached_timestamp: int):
+    """
+    Replaces the cached dialogs of an account with the given dialogs.
+
+    Args:
+        account_id: id of the Telegram account (user) that the dialogs belong to
+        dialogs: list of (entity bytes, unread count, top message id, date) tuples
+            ordered from most recent dialog first
+        cached_timestamp: epoch timestamp of when the dialogs were enumerated
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        cursor.execute("DELETE FROM Dialogs_cache WHERE account_id = ?;", (account_id,))
+        cursor.executemany(
+            """
+            INSERT INTO Dialogs_cache (account_id, position, entity, unread_count, top_message_id, date, cached_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (account_id, position, *dialog, cached_timestamp)
+                for position, dialog in enumerate(dialogs)
+            ],
+        )
+
+        conn.commit()
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def entities_metadata_get() -> dict[int, tuple]:
+    """
+    Gets the latest known metadata of every collected entity.
+
+    Returns:
+        Dictionary of entity id to its (content hash, title, username, participants count).
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        res = cursor.execute(
+            """
+            SELECT entity_id, content_hash, title, username, participants_count FROM Entities_metadata;
+            """
+        )
+        return {row[0]: row[1:] for row in res.fetchall()}
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def entities_metadata_update(entities: list[tuple], changed_timestamp: int):
+    """
+    Stores the new metadata of changed entities and appends it to their history.
+
+    Args:
+        entities: list of (entity id, content hash, title, username, participants count)
+            tuples of the entities whose metadata changed
+        changed_timestamp: epoch timestamp of the collection that detected the changes
+    """
+    if entities is None or len(entities) == 0:
+        return
+
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        values = [(*entity, changed_timestamp) for entity in entities]
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO Entities_metadata (
+                entity_id, content_hash, title, username, participants_count, changed_timestamp
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            values,
+        )
+        cursor.executemany(
+            """
+            INSERT INTO Entities_history (
+                entity_id, content_hash, title, username, participants_count, changed_timestamp
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            values,
+        )
+
+        conn.commit()
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def work_queue_enqueue(entity_ids: list[int]):
+    """
+    Adds entities to the work queue shared by worker processes, if not already queued.
+
+    Args:
+        entity_ids: ids of the entities that the current worker is able to collect from
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        cursor.executemany(
+            "INSERT OR IGNORE INTO Work_queue (entity_id) VALUES (?)",
+            [(entity_id,) for entity_id in entity_ids],
+        )
+
+        conn.commit()
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def work_queue_claim(
+    worker_id: str,
+    entity_ids: list[int],
+    completed_before_timestamp: int,
+    lease_seconds: int,
+) -> int | None:
+    """
+    Claims a lease on the next available entity in the work queue.
+
+    An entity is available if it is not leased (or its lease expired, i.e. the worker
+    holding it crashed) and it has not been completed since the given timestamp.
+    Entities that were never completed, then least recently completed, are claimed first.
+    The lookup and the lease are done in a single exclusive transaction, so no two
+    workers can claim the same entity.
+
+    Args:
+        worker_id: unique id of the worker claiming the entity
+        entity_ids: ids of the entities that the worker is able to collect from
+        completed_before_timestamp: epoch timestamp; entities completed at or after it are skipped
+        lease_seconds: number of seconds before the lease expires, unless renewed
+
+    Returns:
+        The id of the claimed entity, or None if no entity is available.
+    """
+    try:
+        if entity_ids is None or len(entity_ids) == 0:
+            return None
+
+        conn = sqlite3.connect(
+            sqlite_db_name, timeout=sqlite_timeout, isolation_level=None
+        )
+        cursor = conn.cursor()
+        now: int = int(time.time())
+
+        cursor.execute("BEGIN IMMEDIATE;")  # Lock the database for writing
+        res = cursor.execute(
+            f"""
+            SELECT entity_id FROM Work_queue
+            WHERE entity_id IN ({",".join("?" * len(entity_ids))})
+                AND (lease_expires_timestamp IS NULL OR lease_expires_timestamp < ?)
+                AND (last_completed_timestamp IS NULL OR last_completed_timestamp < ?)
+            ORDER BY last_completed_timestamp IS NOT NULL, last_completed_timestamp
+            LIMIT 1;
+            """,
+            (*entity_ids, now, completed_before_timestamp),
+        )
+        row = res.fetchone()
+        if row is not None:
+            cursor.execute(
+                """
+                UPDATE Work_queue SET lease_owner = ?, lease_expires_timestamp = ?
+                WHERE entity_id = ?
+                """,
+                (worker_id, now + lease_seconds, row[0]),
+            )
+        cursor.execute("COMMIT;")
+
+        return row[0] if row is not None else None
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def work_queue_renew(worker_id: str, entity_id: int, lease_seconds: int) -> bool:
+    """
+    Extends the lease of a worker on an entity (heartbeat).
+
+    Args:
+        worker_id: unique id of the worker holding the lease
+        entity_id: id of the leased entity
+        lease_seconds: number of seconds from now before the lease expires, unless renewed
+
+    Returns:
+        True if the lease was renewed, False if the worker no longer holds the lease.
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        cursor.execute(
+            """
+            UPDATE Work_queue SET lease_expires_timestamp = ?
+            WHERE entity_id = ? AND lease_owner = ?
+            """,
+            (int(time.time()) + lease_seconds, entity_id, worker_id),
+        )
+        conn.commit()
+
+        return cursor.rowcount > 0
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def work_queue_release(worker_id: str, entity_id: int, completed: bool):
+    """
+    Releases the lease of a worker on an entity.
+
+    Args:
+        worker_id: unique id of the worker holding the lease
+        entity_id: id of the leased entity
+        completed: True if the collection of the entity completed successfully
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        cursor.execute(
+            f"""
+            UPDATE Work_queue SET lease_owner = NULL, lease_expires_timestamp = NULL
+                {", last_completed_timestamp = ?" if completed else ""}
+            WHERE entity_id = ? AND lease_owner = ?
+            """,
+            ((int(time.time()),) if completed else ()) + (entity_id, worker_id),
+        )
+
+        conn.commit()
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def raw_responses_insert(
+    entity_id: int,
+    collection_name: str,
+    entity_hash: str,
+    content_hash: str,
+    first_id: int,
+    last_id: int,
+    collection_timestamp: int,
+):
+    """
+    Indexes a raw API response recorded in the local archive.
+
+    Args:
+        entity_id: id of the entity the response was collected from
+        collection_name: type of data in the response ("messages", "participants")
+        entity_hash: content hash of the archived entity object
+        content_hash: content hash of the archived response
+        first_id: smallest id of the objects in the response
+        last_id: largest id of the objects in the response
+        collection_timestamp: epoch timestamp of when the response was collected
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        cursor.execute(
+            """
+            INSERT INTO Raw_responses (entity_id, collection_name, entity_hash, content_hash, first_id, last_id, collection_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                entity_id,
+                collection_name,
+                entity_hash,
+                content_hash,
+                first_id,
+                last_id,
+                collection_timestamp,
+            ),
+        )
+
+        conn.commit()
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def raw_responses_get(collection_name: str) -> list[tuple]:
+    """
+    Gets the index of the raw API responses recorded in the local archive.
+
+    Args:
+        collection_name: type of data in the responses ("messages", "participants")
+
+    Returns:
+        List of (entity id, entity hash, content hash) tuples, ordered by entity,
+        then by id of the objects in the response, then in order of recording.
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        res = cursor.execute(
+            """
+            SELECT entity_id, entity_hash, content_hash FROM Raw_responses
+            WHERE collection_name = ?
+            ORDER BY entity_id, first_id, id;
+            """,
+            (collection_name,),
+        )
+        return res.fetchall()
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def reprocessed_files_get() -> dict[str, tuple]:
+    """
+    Gets the files that were already re-enriched.
+
+    Returns:
+        Dictionary of input file path: (content hash, enrichment version) of the input
+        file when it was re-enriched.
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        res = cursor.execute(
+            "SELECT input_path, content_hash, enrichment_version FROM Reprocessed_files;"
+        )
+        return {row[0]: (row[1], row[2]) for row in res.fetchall()}
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
+
+
+def reprocessed_files_upsert(
+    input_path: str,
+    content_hash: str,
+    enrichment_version: str,
+    reprocessed_timestamp: int,
+):
+    """
+    Records that a file was re-enriched.
+
+    Args:
+        input_path: path of the input file
+        content_hash: content hash of the input file
+        enrichment_version: version of the enrichment applied to the file
+        reprocessed_timestamp: epoch timestamp of when the file was re-enriched
+    """
+    try:
+        conn = sqlite3.connect(sqlite_db_name, timeout=sqlite_timeout)
+        cursor = conn.cursor()
+
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO Reprocessed_files (input_path, content_hash, enrichment_version, reprocessed_timestamp)
+            VALUES (?, ?, ?, ?)
+            """,
+            (input_path, content_hash, enrichment_version, reprocessed_timestamp),
+        )
+
+        conn.commit()
+    except sqlite3.DatabaseError as err:
+        raise Exception(f"Database error: {err}")
+    finally:
+        conn.close()
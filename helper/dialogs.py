@@ -0,0 +1,146 @@
+"""
+Snapshot of the dialogs (entities) that the current user is in.
+
+Enumerating dialogs with `client.iter_dialogs()` takes many paginated GetDialogs API calls
+for accounts that are in thousands of entities. The dialogs are therefore enumerated once
+per run and shared by every part of the collection (entities metadata, messages,
+participants). The snapshot can also be persisted in the local database for a short time
+(see `--dialogs-ttl`), so that back-to-back runs can reuse it without calling the API.
+Snapshots are persisted per account, as worker processes of different accounts share the
+local database (see `--worker`) and are not in the same entities.
+"""
+
+import logging
+import time
+
+from telethon import TelegramClient
+from telethon.extensions import BinaryReader
+from telethon.types import *
+
+from helper import helper
+from helper.db import dialogs_cache_get, dialogs_cache_insert
+from helper.rate_limiter import call_api
+
+# Dialogs enumerated during this run
+_dialogs: list["DialogSnapshot"] | None = None
+
+
+class DialogSnapshot:
+    """
+    Lightweight copy of a Telethon Dialog holding only what the collection needs.
+
+    Attributes:
+        entity: entity of type Channel, Chat or User
+        unread_count: number of unread messages in the entity
+        top_message_id: id of the latest message in the entity (0 if there are no messages)
+        date: epoch timestamp of the latest message in the entity (0 if unknown)
+    """
+
+    __slots__ = ("entity", "unread_count", "top_message_id", "date")
+
+    def __init__(
+        self,
+        entity: Channel | Chat | User,
+        unread_count: int,
+        top_message_id: int,
+        date: int,
+    ):
+        self.entity = entity
+        self.unread_count = unread_count
+        self.top_message_id = top_message_id
+        self.date = date
+
+
+def get_dialogs(client: TelegramClient) -> list[DialogSnapshot]:
+    """
+    Gets all dialogs that the current user is in, enumerating them at most once per run.
+
+    Dialogs are returned from, in order:
+    - This run's snapshot, if dialogs were already enumerated
+    - The local database, if a snapshot of the current account younger than
+      `helper.dialogs_ttl` seconds exists
+    - The Telegram API via `client.get_dialogs()` (most recent first)
+
+    Args:
+        client: the Telegram client session
+
+    Returns:
+        The list of dialogs, most recent first.
+    """
+    global _dialogs
+    if _dialogs is not None:
+        return _dialogs
+
+    account_id: int | None = None
+    if helper.dialogs_ttl:
+        account_id = _get_account_id(client)
+        _dialogs = _load(account_id, int(time.time()) - helper.dialogs_ttl)
+        if _dialogs is not None:
+            logging.info(
+                f"Reusing {len(_dialogs)} dialogs enumerated less than {helper.dialogs_ttl} second(s) ago"
+            )
+            return _dialogs
+
+    logging.info(f"[+] Enumerating dialogs from Telethon API")
+    _dialogs = []
+    for dialog in call_api(client.get_dialogs, limit=None):
+        _dialogs.append(
+            DialogSnapshot(
+                dialog.entity,
+                dialog.unread_count,
+                dialog.message.id if dialog.message else 0,
+                int(dialog.date.timestamp()) if dialog.date else 0,
+            )
+        )
+    logging.info(f"Enumerated {len(_dialogs)} dialogs")
+
+    if helper.dialogs_ttl:
+        dialogs_cache_insert(
+            account_id,
+            [
+                (bytes(d.entity), d.unread_count, d.top_message_id, d.date)
+                for d in _dialogs
+            ],
+            int(time.time()),
+        )
+
+    return _dialogs
+
+
+def invalidate():
+    """
+    Discards this run's snapshot so that the next `get_dialogs` call enumerates again.
+    """
+    global _dialogs
+    _dialogs = None
+
+
+def _get_account_id(client: TelegramClient) -> int:
+    """
+    Gets the id of the Telegram account (user) that the client is logged in to, which
+    Telethon caches once the client is started.
+    """
+    return call_api(client.get_me, input_peer=True).user_id
+
+
+def _load(account_id: int, min_timestamp: int) -> list[DialogSnapshot] | None:
+    """
+    Loads the persisted dialogs snapshot of an account from the local database.
+
+    Args:
+        account_id: id of the Telegram account (user) that the dialogs belong to
+        min_timestamp: oldest acceptable epoch timestamp of the snapshot
+
+    Returns:
+        The list of dialogs, or None if there is no snapshot recent enough.
+    """
+    rows: list[tuple] | None = dialogs_cache_get(account_id, min_timestamp)
+    if rows is None:
+        return None
+
+    return [
+        DialogSnapshot(
+            BinaryReader(entity).tgread_object(), unread_count, top_message_id, date
+        )
+        for entity, unread_count, top_message_id, date in rows
+    ]
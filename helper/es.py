@@ -1,23 +1,36 @@
+import functools
 import hashlib
 import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-from elasticsearch import Elasticsearch, helpers
 from telethon.types import *
 
 from configs import es_ca_cert_path, es_password, es_username
-from helper.logger import OUTPUT_DIR, OUTPUT_NDJSON
+from helper import logger, metrics, output_format, profiler, serialization
 
-# https://www.elastic.co/guide/en/elasticsearch/client/python-api/current/connecting.html
-if None not in [es_ca_cert_path, es_password, es_username]:
-    es = Elasticsearch(
+ES_WORKERS: int = 4  # Number of files indexed in parallel
+
+
+@functools.lru_cache(maxsize=None)
+def _get_es():
+    """
+    Creates the Elasticsearch client on first use, so that runs which do not export
+    to Elasticsearch do not import or configure the Elasticsearch library.
+
+    Returns:
+        The Elasticsearch client.
+    """
+    from elasticsearch import Elasticsearch
+
+    # https://www.elastic.co/guide/en/elasticsearch/client/python-api/current/connecting.html
+    return Elasticsearch(
         "https://localhost:9200",
         basic_auth=(es_username, es_password),
         ca_certs=es_ca_cert_path,
     )  # Update with your credentials
 
-# print(es.info())  # https://www.elastic.co/guide/en/elasticsearch/client/python-api/current/connecting.html
-
 
 def _get_index_mapping(index_name: str) -> dict:
     """
@@ -87,7 +100,7 @@ def _get_record_id(index_name: str, collected_obj: dict) -> str | None:
         # -- Generate a deterministic hash for this IOC object's ID
 
         # Convert the object to a JSON string and encode it to bytes
-        data_string = json.dumps(collected_obj, sort_keys=True).encode()
+        data_string = serialization.dumps_canonical(collected_obj)
 
         # Use SHA-256 hash function to generate a hash of the data
         hash_object = hashlib.sha256(data_string)
@@ -114,7 +127,8 @@ def index_json_file_to_es(file_path: str, index_name: str) -> bool:
     analyze, filter, or produce reports out of the data.
 
     Args:
-        file_path: path to the JSON response file returned by Telegram API
+        file_path: path to the JSON response file returned by Telegram API, in any
+            supported output format
         index_name: descriptive name for the index (i.e.: messages_index)
 
     Returns:
@@ -132,38 +146,70 @@ def index_json_file_to_es(file_path: str, index_name: str) -> bool:
 
     # Create index with the provided index mapping, if this is a new index
     # index mapping / explicit mapping as defined by Elasticsearch https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping.html
+    from elasticsearch import helpers
+
+    es = _get_es()
     if not es.indices.exists(index=index_name):
         index_mapping: dict = _get_index_mapping(index_name)
         es.indices.create(index=index_name, body=index_mapping)
 
-    with open(file_path, "r") as file:
-        documents: list[dict] = json.load(file)
-        actions = [
-            {
-                "_index": index_name,
-                "_id": _get_record_id(
-                    index_name, document
-                ),  # Prevents duplicate records from being inserted into the document
-                "_source": document,
-            }
-            for document in documents
-        ]
-        # https://stackoverflow.com/questions/59555640/how-to-bulk-insert-in-elasticsearch-ignoring-all-errors-that-may-occur-in-the-pr
-        # https://elasticsearch-py.readthedocs.io/en/latest/helpers.html
-        helpers.bulk(es, actions, raise_on_error=False)
-        # raise_on_error argument ignores the BulkIndexError exception
-        # raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors) elasticsearch.helpers.BulkIndexError: 1 document(s) failed to index.
+    # Documents are streamed from the file into bulk requests, rather than loaded at once
+    actions = (
+        {
+            "_index": index_name,
+            "_id": _get_record_id(
+                index_name, document
+            ),  # Prevents duplicate records from being inserted into the document
+            "_source": document,
+        }
+        for document in output_format.read(file_path)
+    )
+    # https://stackoverflow.com/questions/59555640/how-to-bulk-insert-in-elasticsearch-ignoring-all-errors-that-may-occur-in-the-pr
+    # https://elasticsearch-py.readthedocs.io/en/latest/helpers.html
+    with metrics.timer("index"), profiler.stage("index"):
+        documents_indexed, errors = helpers.bulk(es, actions, raise_on_error=False)
+    # raise_on_error argument ignores the BulkIndexError exception
+    # raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors) elasticsearch.helpers.BulkIndexError: 1 document(s) failed to index.
+    metrics.count("documents_indexed", documents_indexed)
+    metrics.count("documents_failed_to_index", len(errors))
+    metrics.count("bytes_indexed", os.path.getsize(file_path))
 
     return True
 
 
-def transform_to_ndjson(json_file_path: str):
+def index_json_files_to_es(file_paths: list[str], index_name: str) -> bool:
+    """
+    Index several JSON files to Elasticsearch in parallel (i.e.: segments of the messages
+    of an entity, see output_format.write_segments).
+
+    Args:
+        file_paths: paths to the JSON response files returned by Telegram API
+        index_name: descriptive name for the index (i.e.: messages_index)
+
+    Returns:
+        True if every JSON file was successfully indexed into Elasticsearch
+    """
+    if len(file_paths) <= 1:
+        return all(index_json_file_to_es(path, index_name) for path in file_paths)
+
+    with ThreadPoolExecutor(max_workers=min(ES_WORKERS, len(file_paths))) as executor:
+        return all(
+            executor.map(lambda path: index_json_file_to_es(path, index_name), file_paths)
+        )
+
+
+def transform_to_ndjson(
+    json_file_path: str,
+    ndjson_file_path: str | None = None,
+    compression: str | None = None,
+):
     """
     Transforms a JSON formatted Telegram API response into a newline-delimited JSON
     so that the data can be imported into Elasticsearch for data analysis.
 
-    Takes the path to a list JSON file as input and outputs a ndjson file
-    into an output folder.
+    Takes the path to a file in any supported output format as input and outputs a
+    ndjson file into an output folder. Records are streamed, one at a time, so memory
+    usage does not grow with the size of the file.
 
     Example input:
     ```
@@ -185,6 +231,10 @@ def transform_to_ndjson(json_file_path: str):
 
     Args:
         json_file_path: path to your JSON file
+        ndjson_file_path (optional): path of the ndjson file, without extension, default
+            None for the same path in this run's ndjson output folder
+        compression (optional): "gzip" or "zstd" to compress the ndjson file, default
+            None for no compression
 
     Returns:
         True if the transformation and file output completed successfully
@@ -192,23 +242,25 @@ def transform_to_ndjson(json_file_path: str):
     if json_file_path is None:
         return False
 
-    ndjson_file_path = json_file_path.replace(OUTPUT_DIR, OUTPUT_NDJSON)
-
-    # Read the JSON data from the file
-    with open(json_file_path, "r") as file:
-        json_objects = json.load(file)
-
-    # Convert each JSON object into a newline-delimited string
-    ndjson_content = "\n".join(json.dumps(obj) for obj in json_objects)
+    if ndjson_file_path is None:
+        ndjson_file_path = output_format.strip_extension(
+            json_file_path.replace(logger.OUTPUT_DIR, logger.OUTPUT_NDJSON)
+        )
 
     # Check if directory exists, create it if necessary
     os.makedirs(os.path.dirname(ndjson_file_path), exist_ok=True)
 
-    # Write the NDJSON content to the output file
-    with open(ndjson_file_path, "w") as ndjson_file:
-        ndjson_file.write(ndjson_content)
+    # Convert each JSON object into a newline-delimited string, as it is read
+    # Written to a temporary file first, so that an interrupted conversion is never used
+    format_name: str = f"ndjson-{compression}" if compression else "ndjson"
+    temp_file_path: str = output_format.write(
+        f"{ndjson_file_path}.tmp", output_format.read(json_file_path), format_name
+    )
+    ndjson_file_path += output_format.FORMATS[format_name]
+    os.replace(temp_file_path, ndjson_file_path)
 
     logging.info(f"Converted NDJSON saved to {ndjson_file_path}")
+    return True
 
 
 if __name__ == "__main__":
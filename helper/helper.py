@@ -2,27 +2,40 @@
 Contains core helper functions required for the Telegram scraper to work.
 """
 
+import base64
 import datetime
+import hashlib
 import json
 import logging
-import random
-import time
+import threading
 from enum import Enum
 from typing import (
     ContextManager,
 )  # to enable static typing with the "with" statement in Python
 
-from requests import get
 from telethon.sync import TelegramClient
 from telethon.types import *
 
 from configs import API_HASH, API_ID, PROXIES
+from helper import metrics, proxy_pool, rate_limiter
 
 # Default values for CLI argument variables
 max_messages: int = 2500  # max number of messages to collect
 min_throttle: int = 1
 max_throttle: int = 10
 export_to_es: bool = False
+membership_diff: bool = False  # only record participants who joined or left
+parallel_participants: bool = False  # resolve participants with one client per proxy
+dialogs_ttl: int = 0  # seconds to reuse dialogs enumerated by a previous run (0 to disable)
+all_entities: bool = False  # export all entities' metadata, not only changed entities
+backfill_segments: int = 0  # parallel segments to split a channel's history into (0 to disable)
+record_responses: bool = False  # record raw API responses in the local archive
+output_format: str = "json"  # format of the output files (see output_format.py)
+binary_encoding: str = "repr"  # encoding of binary fields: "repr", "base64" or "sha256"
+export_parquet: bool = False  # export flattened records to Parquet files (see columnar.py)
+segment_messages: int = 0  # messages per output segment (0 for no limit)
+segment_mb: int = 0  # megabytes per output segment (0 for no limit)
+max_buffer_mb: int = 0  # megabytes of collected objects kept in memory (0 for no limit)
 
 
 class EntityName(Enum):
@@ -32,6 +45,28 @@ class EntityName(Enum):
     DIRECT_MESSAGE = "direct_message"
 
 
+def encode_json_default(o):
+    """
+    Encodes an object that is not parsable by JSON into an object that can be parsed by
+    JSON (see JSONEncoder). Shared by every serialization backend (see serialization.py).
+
+    Args:
+        o: the object to encode
+
+    Returns:
+        The encoded object.
+    """
+    if isinstance(o, datetime):  # encode datetime object to isoformat
+        return o.isoformat()
+    if isinstance(o, bytes):  # encode byte data into string
+        if binary_encoding == "base64":
+            return base64.b64encode(o).decode("ascii")
+        if binary_encoding == "sha256":
+            return hashlib.sha256(o).hexdigest()
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
 class JSONEncoder(json.JSONEncoder):
     """
     Encodes objects that are not parsable by JSON into objects that can be parsed by JSON.
@@ -40,15 +75,14 @@ class JSONEncoder(json.JSONEncoder):
     - Cannot insert datetime object into JSON, so this class converts the datetime object
     into ISO format.
     - Cannot insert byte object into JSON (i.e.: image or video files), so it is converted
-        to a normal string.
+        to a string, as set by `--binary-encoding`:
+        - "repr": Python representation of the bytes (i.e.: "b'\\x00'"), lossy and large
+        - "base64": base64 encoding of the bytes, lossless
+        - "sha256": SHA256 hash of the bytes, compact, to only compare binary values
     """
 
     def default(self, o):
-        if isinstance(o, datetime):  # encode datetime object to isoformat
-            return o.isoformat()
-        if isinstance(o, bytes):  # encode byte data into string
-            return str(o)
-        return super().default(o)
+        return encode_json_default(o)
 
 
 class TelegramClientContext(ContextManager[TelegramClient]):
@@ -94,15 +128,22 @@ class TelegramClientContext(ContextManager[TelegramClient]):
     and __exit__ methods, it allows for static typing when using the "with" statement.
     """
 
+    def __init__(self, session_name: str = None):
+        """
+        Args:
+            session_name (optional): name of the session file to use, i.e. one per account
+                when running multiple workers. Default "anon" or "anon_proxy".
+        """
+        self._session_name: str = session_name
+
     def __enter__(self) -> TelegramClient:
         api_id = API_ID
         api_hash = API_HASH
         session_name: str = None  # private var
         proxy: dict = None  # private var
 
-        # Display machine's public IP address (https://stackoverflow.com/a/36205547)
-        public_ip: str = get("https://api.ipify.org").content.decode("utf8")
-        logging.info(f"Collection public IP address '{public_ip}'")
+        # Display machine's public IP address in the background, off the startup path
+        threading.Thread(target=_log_public_ip, daemon=True).start()
 
         # Detect proxy in config file
         if PROXIES is not None and len(PROXIES) > 0:  # There exists at least one proxy
@@ -116,11 +157,18 @@ class TelegramClientContext(ContextManager[TelegramClient]):
             session_name = "anon"
             logging.info(f"No proxy detected in configurations...")
 
+        if self._session_name is not None:
+            session_name = self._session_name
+
         # Create and return a TelegramClient instance
         logging.info(f"Creating Telegram client with session name: {session_name}")
         logging.info(
             "=========================================================================="
         )
+        rate_limiter.set_connection(proxy)
+
+        # Telethon sleeps on short FloodWaitErrors and retries the request, so that calls
+        # not made through rate_limiter.call_api and paginated calls are not interrupted
         return TelegramClient(session_name, api_id, api_hash, proxy=proxy)
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -128,6 +176,19 @@ class TelegramClientContext(ContextManager[TelegramClient]):
         pass
 
 
+def _log_public_ip():
+    """
+    Logs the machine's public IP address (https://stackoverflow.com/a/36205547).
+    """
+    from requests import get
+
+    try:
+        public_ip: str = get("https://api.ipify.org", timeout=10).content.decode("utf8")
+        logging.info(f"Collection public IP address '{public_ip}'")
+    except Exception as e:
+        logging.warning(f"[-] Unable to determine the collection public IP address: {e}")
+
+
 def setup() -> bool:
     """
     Execute required setup operations prior to running a collection.
@@ -229,46 +290,35 @@ def generate_user_keys() -> list:
     return keys
 
 
-def rotate_proxy(client: TelegramClient) -> bool:
+def rotate_proxy(client: TelegramClient, api_calls: int = 1) -> TelegramClient:
     """
-    Disconnects from Telegram, sets the new proxy as the next proxy in the list,
-    and reconnect to Telegram.
+    Rotates to the connection of another proxy, once the current proxy has been used
+    for a number of API calls or amount of time. To be called once per batch of API calls
+    (see proxy_pool.ROTATE_BATCH_REQUESTS), rather than before every API call.
+
+    Connections to the proxies are pre-warmed in the background and the healthiest
+    proxies are picked, so rotating never disconnects and reconnects the client
+    (see proxy_pool.py).
 
     Args:
-        client: the Telegram client session whose new proxy is to be set
+        client: the Telegram client currently in use
+        api_calls (optional): number of API calls to make with the returned client
+            before the next rotation, default 1
 
     Return:
-        True if the proxy rotation was a success
+        The Telegram client to use for the next API calls, which is connected through
+        the new proxy, or `client` itself if no rotation was needed or possible
     """
 
     if PROXIES is None or len(PROXIES) == 0:
         logging.debug(f"No proxies configured. Skipping proxy rotation...")
-        return True
-
-    new_proxy: dict = None
-    try:
-        # Determine the next proxy to rotate to
-        new_proxy = random.choice(PROXIES)
+        return client
 
-        # Set proxy
-        logging.info(f"[+] Rotating proxy...")
-        logging.info(
-            f"[+] Setting {new_proxy['proxy_type']} proxy at '{new_proxy['addr']}:{new_proxy['port']}'"
-        )
-        client.set_proxy(new_proxy)
-
-        # Disconnect and reconnect Telegram client
-        client.disconnect()
-        client.connect()
-        if client.is_connected():
-            return True
-        else:
-            logging.error(f"[-] Unknown error occured during proxy rotation...")
-            return False
-    except OSError:
-        logging.critical(f"[-] Failed to reconnect to Telegram during proxy rotation")
-    except:
-        logging.critical(f"[-] Unknown error occured during proxy rotation")
+    with metrics.timer("rotate_proxy"):
+        new_client: TelegramClient = proxy_pool.rotate(client, api_calls)
+    if new_client is not client:
+        metrics.count("proxy_rotations")
+    return new_client
 
 
 def throttle():
@@ -277,29 +327,36 @@ def throttle():
 
     Used to throttle API calls to prevent API flooding, as Telegram could
     ban the current account for bot behaviour or spamming. This function
-    throttles the code by a random number of seconds between a min_throttle
-    time and a max_throttle time. By default, the min. is 1 second and the
-    max. is 10 seconds. However, the values can be overriden in the CLI
-    with `python scrape.py ... --throttle-time <min_time> <max_time>`
+    waits until the adaptive rate limiters of the account and of the current
+    proxy allow the next API call, plus a random jitter (see rate_limiter.py).
+    The rate starts at one call per average of the min_throttle time and the
+    max_throttle time, and never exceeds one call per min_throttle time. By
+    default, the min. is 1 second and the max. is 10 seconds. However, the
+    values can be overriden in the CLI with
+    `python scrape.py ... --throttle-time <min_time> <max_time>`
     """
-    min_throttle_ms: float = min_throttle * 1000  # 1 second is 1000 milliseconds
-    max_throttle_ms: float = max_throttle * 1000
-
-    # Generate a random delay between min_throttle_ms and max_throttle_ms
-    delay_ms = random.uniform(min_throttle_ms, max_throttle_ms)
-
-    # Convert milliseconds to seconds
-    delay_sec = delay_ms / 1000
-
-    logging.info(f"Delaying execution: {delay_sec} second(s)")
-    logging.info(f"")
-    time.sleep(delay_sec)
+    rate_limiter.throttle()
 
     return
 
 
 def update_argument_variables(
-    new_max_messages, new_min_throttle, new_max_throttle, new_export_to_es
+    new_max_messages,
+    new_min_throttle,
+    new_max_throttle,
+    new_export_to_es,
+    new_membership_diff=False,
+    new_parallel_participants=False,
+    new_dialogs_ttl=0,
+    new_all_entities=False,
+    new_backfill_segments=0,
+    new_record_responses=False,
+    new_output_format="json",
+    new_binary_encoding="repr",
+    new_export_parquet=False,
+    new_segment_messages=0,
+    new_segment_mb=0,
+    new_max_buffer_mb=0,
 ):
     """
     Update argument variables with values from CLI arguments.
@@ -308,7 +365,23 @@ def update_argument_variables(
     For example, `helper.max_messages` will work.
     """
     global max_messages, min_throttle, max_throttle, export_to_es
+    global membership_diff, parallel_participants, dialogs_ttl, all_entities
+    global backfill_segments, record_responses, output_format, binary_encoding
+    global export_parquet, segment_messages, segment_mb, max_buffer_mb
     max_messages = new_max_messages
     min_throttle = new_min_throttle
     max_throttle = new_max_throttle
+    rate_limiter.configure(min_throttle, max_throttle)
     export_to_es = new_export_to_es
+    membership_diff = new_membership_diff
+    parallel_participants = new_parallel_participants
+    dialogs_ttl = new_dialogs_ttl
+    all_entities = new_all_entities
+    backfill_segments = new_backfill_segments
+    record_responses = new_record_responses
+    output_format = new_output_format
+    binary_encoding = new_binary_encoding
+    export_parquet = new_export_parquet
+    segment_messages = new_segment_messages
+    segment_mb = new_segment_mb
+    max_buffer_mb = new_max_buffer_mb
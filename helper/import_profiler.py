@@ -0,0 +1,133 @@
+"""
+Measures the time spent importing modules and starting up, for `--profile-startup`.
+
+The profiler must be enabled before the modules to measure are imported, so it only
+depends on the standard library. Once enabled, every module imported is timed, including
+modules imported lazily later in the run (i.e.: translation models on the first message).
+
+Example usage:
+```
+import_profiler.enable()
+import telethon
+import_profiler.mark("imports")
+...
+import_profiler.log_report()
+```
+"""
+
+import importlib.abc
+import logging
+import sys
+import time
+
+_start_time: float | None = None  # None when the profiler is disabled
+_phases: list[tuple[str, float]] = []  # (phase name, perf_counter at the end of the phase)
+_import_times: dict[str, tuple[float, float]] = {}  # module: (inclusive, self) seconds
+_import_stack: list[float] = []  # Time spent importing submodules of each module being imported
+_total_import_time: float = 0.0  # Time spent in outermost imports
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """
+    Wraps the loader of a module to time the execution of the module.
+    """
+
+    def __init__(self, loader, module_name: str):
+        self._loader = loader
+        self._module_name: str = module_name
+
+    def __getattr__(self, name: str):
+        return getattr(self._loader, name)  # i.e.: get_resource_reader, is_package
+
+    def create_module(self, spec):
+        return self._timed(self._loader.create_module, spec)
+
+    def exec_module(self, module):
+        return self._timed(self._loader.exec_module, module)
+
+    def _timed(self, func, arg):
+        global _total_import_time
+        start_time: float = time.perf_counter()
+        _import_stack.append(0.0)
+        try:
+            return func(arg)
+        finally:
+            elapsed: float = time.perf_counter() - start_time
+            children: float = _import_stack.pop()
+            inclusive, self_time = _import_times.get(self._module_name, (0.0, 0.0))
+            _import_times[self._module_name] = (
+                inclusive + elapsed,
+                self_time + elapsed - children,
+            )
+            if _import_stack:
+                _import_stack[-1] += elapsed
+            else:
+                _total_import_time += elapsed
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    """
+    Finds modules with the other finders and wraps their loaders with a _TimedLoader.
+    """
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None:
+                    spec.loader = _TimedLoader(spec.loader, fullname)
+                return spec
+        return None
+
+
+def enable():
+    """
+    Starts timing module imports and startup phases.
+    """
+    global _start_time
+    if _start_time is not None:
+        return
+    _start_time = time.perf_counter()
+    sys.meta_path.insert(0, _TimingFinder())
+
+
+def mark(phase: str):
+    """
+    Marks the end of a startup phase. Does nothing if the profiler is disabled.
+
+    Args:
+        phase: name of the phase that just ended (i.e.: "imports")
+    """
+    if _start_time is not None:
+        _phases.append((phase, time.perf_counter()))
+
+
+def log_report(top: int = 20):
+    """
+    Logs the duration of each startup phase and the slowest module imports.
+
+    Args:
+        top (optional): number of slowest modules to report
+    """
+    if _start_time is None:
+        return
+
+    logging.info(f"[+] Startup profile")
+    previous: float = _start_time
+    for phase, end_time in _phases:
+        logging.info(f"Phase {phase:<28}: {'{:.3f}'.format(end_time - previous)} second(s)")
+        previous = end_time
+
+    logging.info(
+        f"Imported {len(_import_times)} modules in {'{:.3f}'.format(_total_import_time)} second(s)"
+    )
+    logging.info(f"Slowest imports (self / inclusive seconds):")
+    slowest: list[tuple[str, tuple[float, float]]] = sorted(
+        _import_times.items(), key=lambda item: item[1][1], reverse=True
+    )[:top]
+    for name, (inclusive, self_time) in slowest:
+        logging.info(
+            f"  {name:<40} {'{:.3f}'.format(self_time)} / {'{:.3f}'.format(inclusive)}"
+        )
@@ -1,5 +1,13 @@
+import atexit
 import datetime
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import queue
+import threading
+
+from helper import metrics
 
 DATETIME_CODE_EXECUTED: str = str(
     datetime.datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%SZ")
@@ -7,11 +15,172 @@ DATETIME_CODE_EXECUTED: str = str(
 OUTPUT_DIR: str = f"output/{DATETIME_CODE_EXECUTED}"
 OUTPUT_NDJSON: str = f"output_ndjson/{DATETIME_CODE_EXECUTED}"  # newline-delimited JSON for Elasticsearch
 
+# Output folders of the whole run. OUTPUT_DIR and OUTPUT_NDJSON may point to a subfolder
+# of these (i.e.: one per polling cycle in daemon mode), so they must be referenced with
+# "logger.VARIABLE". For example, `logger.OUTPUT_DIR` will work.
+RUN_OUTPUT_DIR: str = OUTPUT_DIR
+RUN_OUTPUT_NDJSON: str = OUTPUT_NDJSON
+
+LOG_FILE_NAME: str = "logging.log"  # Text, as on the terminal
+JSON_LOG_FILE_NAME: str = "logging.jsonl"  # JSON lines, with the context of each record
+
+# Repetitive messages (i.e.: one per chunk of messages or per API call) are logged with
+# `extra=SAMPLED`, and only the first SAMPLED_MAX_RECORDS of each line of code are logged
+# every SAMPLED_INTERVAL seconds, unless in debug mode
+SAMPLED: dict = {"sampled": True}
+SAMPLED_MAX_RECORDS: int = 5
+SAMPLED_INTERVAL: float = 30
+
+_listener: logging.handlers.QueueListener | None = None
+_worker_listener: logging.handlers.QueueListener | None = None
+_worker_queue = None  # multiprocessing.Queue of the log records of worker processes
+_sampling: bool = True
+
+
+def set_output_subdir(subdir_name: str | None):
+    """
+    Sets the output folders to a subfolder of this run's output folders.
+
+    Args:
+        subdir_name: name of the subfolder (i.e.: a timestamp), None for the run's folders
+    """
+    global OUTPUT_DIR, OUTPUT_NDJSON
+    if subdir_name is None:
+        OUTPUT_DIR = RUN_OUTPUT_DIR
+        OUTPUT_NDJSON = RUN_OUTPUT_NDJSON
+    else:
+        OUTPUT_DIR = f"{RUN_OUTPUT_DIR}/{subdir_name}"
+        OUTPUT_NDJSON = f"{RUN_OUTPUT_NDJSON}/{subdir_name}"
+
+
+def set_output_dir(output_dir: str):
+    """
+    Sets the output folder of this run (the log files' folder), i.e. for tools that do
+    not collect and must not write into the output folders of collections (see
+    reprocess.py).
+
+    Args:
+        output_dir: path of the folder
+    """
+    global OUTPUT_DIR, RUN_OUTPUT_DIR
+    OUTPUT_DIR = output_dir
+    RUN_OUTPUT_DIR = output_dir
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts log records in a queue, to be written by a listener thread, so that logging
+    never waits for the disk or the terminal. The message and the traceback, if any, are
+    formatted by the caller, so that records can be sent to other processes.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class _ContextFilter(logging.Filter):
+    """
+    Adds the entity being collected (see metrics.set_entity) to log records, when they
+    are logged rather than when they are written.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.entity_id = metrics.get_entity()
+        return True
+
+
+class _SamplingFilter(logging.Filter):
+    """
+    Rate-limits the records of repetitive messages (see `SAMPLED`), per line of code.
+    The first record logged after a line of code was rate-limited reports the number of
+    records that were dropped. Warnings and errors are never dropped.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock: threading.Lock = threading.Lock()
+        # (file, line) -> [start of the interval, records logged, records dropped]
+        self._intervals: dict[tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if (
+            not _sampling
+            or not getattr(record, "sampled", False)
+            or record.levelno >= logging.WARNING
+        ):
+            return True
+
+        key: tuple[str, int] = (record.pathname, record.lineno)
+        with self._lock:
+            interval: list | None = self._intervals.get(key)
+            if interval is None or record.created - interval[0] >= SAMPLED_INTERVAL:
+                if interval is not None and interval[2] > 0:
+                    record.suppressed = interval[2]
+                interval = [record.created, 0, 0]
+                self._intervals[key] = interval
+            if interval[1] >= SAMPLED_MAX_RECORDS:
+                interval[2] += 1
+                return False
+            interval[1] += 1
+            return True
+
+
+class _JsonFormatter(logging.Formatter):
+    """
+    Formats log records as JSON lines, with their context as separate fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        log: dict = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if getattr(record, "entity_id", None) is not None:
+            log["entity_id"] = record.entity_id
+        if getattr(record, "suppressed", 0):
+            log["suppressed"] = record.suppressed
+        if record.exc_text:
+            log["exception"] = record.exc_text
+        if record.stack_info:
+            log["stack"] = record.stack_info
+        return json.dumps(log, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    """
+    Formats log records as text, for the terminal and the text log file.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        text: str = super().format(record)
+        if getattr(record, "suppressed", 0):
+            text += f" ({record.suppressed} similar messages suppressed)"
+        return text
+
 
 def configure_logging(debug_mode: bool = False):
     """
     Setup logging configurations such as output path and output formatting.
 
+    Log records are written as text to the terminal and to the log file, and as JSON lines
+    to the JSON log file, by a listener thread: logging only puts records in a queue.
+    Records of worker processes are written with the same handlers (see
+    `get_worker_initargs`).
+
     To setup logging configs in a new file, simply call this function
     ```
     # Import required libraries
@@ -24,38 +193,122 @@ def configure_logging(debug_mode: bool = False):
     # Start logging
     logging.info("This is a log")
     logging.info("Привет")
+    logging.info(f"Collected {len(chunk)} messages...", extra=SAMPLED)  # Repetitive
     ```
     Args:
         debug_mode (optional): set debug mode to True or False. Default False.
     """
-    logging_filename = f"{OUTPUT_DIR}/logging.log"
+    global _listener, _sampling
+    logging_filename = f"{OUTPUT_DIR}/{LOG_FILE_NAME}"
+    json_logging_filename = f"{OUTPUT_DIR}/{JSON_LOG_FILE_NAME}"
 
     # Set UTC time
     logging.Formatter.converter = lambda *args: datetime.datetime.now(
         datetime.timezone.utc
     ).timetuple()
 
-    # Set basic configurations for logging formatting
-    if debug_mode == False:
-        logging.basicConfig(
-            level=logging.INFO,
-            encoding="utf-8",
-            format="%(asctime)s %(levelname)s %(message)s",
-            datefmt=f"%Y-%m-%dT%H:%M:%S",
-            handlers=[
-                logging.FileHandler(logging_filename, encoding="utf-8"),  # output to file
-                logging.StreamHandler(),  # output to terminal
-            ],
-        )
-    else:
-        logging.basicConfig(
-            level=logging.DEBUG,
-            encoding="utf-8",
-            format="%(asctime)s %(levelname)s %(message)s",
-            datefmt=f"%Y-%m-%dT%H:%M:%S",
-            handlers=[
-                logging.FileHandler(logging_filename, encoding="utf-8"),  # output to file
-                logging.StreamHandler(),  # output to terminal
-            ],
+    # Handlers are only used by the listener thread
+    text_formatter = _TextFormatter(
+        "%(asctime)s %(levelname)s %(message)s", f"%Y-%m-%dT%H:%M:%S"
+    )
+    file_handler = logging.FileHandler(logging_filename, encoding="utf-8")  # output to file
+    file_handler.setFormatter(text_formatter)
+    json_file_handler = logging.FileHandler(json_logging_filename, encoding="utf-8")
+    json_file_handler.setFormatter(_JsonFormatter())
+    stream_handler = logging.StreamHandler()  # output to terminal
+    stream_handler.setFormatter(text_formatter)
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(
+        log_queue,
+        file_handler,
+        json_file_handler,
+        stream_handler,
+        respect_handler_level=True,
+    )
+    _listener.start()
+    atexit.register(stop_logging)
+
+    # Keep every record in debug mode
+    _sampling = not debug_mode
+    logging.basicConfig(
+        level=logging.DEBUG if debug_mode else logging.INFO,
+        handlers=[_get_queue_handler(log_queue)],
+    )
+    logging.info(
+        f"Logging to '{logging_filename}' and '{json_logging_filename}' in UTC timezone"
+    )
+
+
+def get_worker_initargs() -> tuple:
+    """
+    Gets the arguments of `configure_worker_logging` for the worker processes of a pool,
+    and starts the listener that writes the log records of worker processes with the
+    handlers of this process.
+    ```
+    ProcessPoolExecutor(
+        initializer=logger.configure_worker_logging,
+        initargs=logger.get_worker_initargs(),
+    )
+    ```
+    Returns:
+        The arguments, to be passed as `initargs` of the pool.
+    """
+    global _worker_queue, _worker_listener
+    if _worker_queue is None:
+        _worker_queue = multiprocessing.Queue()
+        _worker_listener = logging.handlers.QueueListener(
+            _worker_queue,
+            *(_listener.handlers if _listener is not None else []),
+            respect_handler_level=True,
         )
-    logging.info(f"Logging to '{logging_filename}' in UTC timezone")
+        _worker_listener.start()
+    return _worker_queue, logging.getLogger().level, _sampling
+
+
+def configure_worker_logging(log_queue, level: int, sampling: bool):
+    """
+    Sends the log records of a worker process to the listener of the process that started
+    it (see `get_worker_initargs`). Initializer of the worker processes of pools.
+
+    Args:
+        log_queue: queue of the log records of worker processes
+        level: logging level of the main process
+        sampling: True to rate-limit repetitive messages (see `SAMPLED`)
+    """
+    global _sampling
+    _sampling = sampling
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)  # Inherited from the main process
+    # The entity being collected is only known to the main process
+    root_logger.addHandler(_get_queue_handler(log_queue, with_context=False))
+    root_logger.setLevel(level)
+
+
+def stop_logging():
+    """
+    Writes the log records left in the queues and stops the listener threads.
+    """
+    global _listener, _worker_listener, _worker_queue
+    if _worker_listener is not None:
+        _worker_listener.stop()
+        _worker_listener = None
+        _worker_queue.close()
+        _worker_queue = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _get_queue_handler(log_queue, with_context: bool = True) -> _QueueHandler:
+    """
+    Creates a handler that puts log records in a queue, after rate-limiting repetitive
+    messages and adding their context.
+    """
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(_SamplingFilter())
+    if with_context:
+        handler.addFilter(_ContextFilter())
+    return handler
@@ -0,0 +1,79 @@
+"""
+Membership diffing between participants collections.
+
+Rather than comparing full participant snapshots, the previous run's participant IDs
+are stored locally as a compact sorted array of 64-bit integers. The freshly collected
+IDs are sorted and merged against the stored array to find who joined and who left the
+entity since the last collection, so only the churn needs to be persisted.
+"""
+
+from array import array
+
+# Typecode of a signed 64-bit integer array (Telegram user IDs do not fit in 32 bits)
+ID_ARRAY_TYPECODE: str = "q"
+
+
+def encode_ids(user_ids) -> bytes:
+    """
+    Encodes a collection of user IDs into a compact sorted array of bytes.
+
+    Args:
+        user_ids: iterable of unique user IDs (duplicates are removed)
+
+    Returns:
+        The sorted array of user IDs as bytes, ready to be stored in the database.
+    """
+    return array(ID_ARRAY_TYPECODE, sorted(set(user_ids))).tobytes()
+
+
+def decode_ids(data: bytes | None) -> array:
+    """
+    Decodes bytes created by `encode_ids` back into a sorted array of user IDs.
+
+    Args:
+        data: bytes stored in the database, or None if there is no previous snapshot
+
+    Returns:
+        A sorted array of user IDs. The array is empty if no data was provided.
+    """
+    ids = array(ID_ARRAY_TYPECODE)
+    if data:
+        ids.frombytes(data)
+    return ids
+
+
+def diff_sorted_ids(previous_ids, current_ids) -> tuple[list[int], list[int]]:
+    """
+    Compares two sorted arrays of user IDs in a single linear pass.
+
+    Example:
+    ```
+    diff_sorted_ids([1, 2, 3], [2, 3, 4])  # Output: ([4], [1])
+    ```
+
+    Args:
+        previous_ids: sorted user IDs of the previous collection
+        current_ids: sorted user IDs of the current collection
+
+    Returns:
+        A tuple of (joined IDs, left IDs).
+    """
+    joined: list[int] = []
+    left: list[int] = []
+    i, j = 0, 0
+
+    while i < len(previous_ids) and j < len(current_ids):
+        if previous_ids[i] == current_ids[j]:
+            i += 1
+            j += 1
+        elif previous_ids[i] < current_ids[j]:
+            left.append(previous_ids[i])  # No longer in the entity
+            i += 1
+        else:
+            joined.append(current_ids[j])  # New to the entity
+            j += 1
+
+    left.extend(previous_ids[i:])
+    joined.extend(current_ids[j:])
+
+    return joined, left
@@ -0,0 +1,107 @@
+"""
+Compact representation of a collected message, for the enrichment stage.
+
+Enrichment (translation, IOCs extraction) only uses a handful of fields of a message,
+but converting a Telethon Message object with `to_dict()` builds a nested dictionary of
+every TL field. A MessageRecord reads the fields used by the pipeline directly from the
+Message object, once, and the full message is only converted to a dictionary once it is
+enriched, to be written to disk.
+
+Example usage:
+```
+record = MessageRecord.from_message(message)
+if record.text:
+    record.text_translated = translate(record.text)
+message_dict = record.to_dict()  # Full message, with its translation
+```
+"""
+
+from telethon.types import *
+
+
+class MessageRecord:
+    """
+    Fields of a message used by the enrichment stage, and the message they were read from.
+    """
+
+    __slots__ = (
+        "id",
+        "date",
+        "entity_id",
+        "sender_user_id",
+        "sender_channel_id",
+        "text",
+        "text_translated",
+        "_message",
+    )
+
+    def __init__(self):
+        self.id: int | None = None
+        self.date = None
+        self.entity_id: int | None = None
+        self.sender_user_id: int | None = None
+        self.sender_channel_id: int | None = None
+        self.text: str | None = None
+        self.text_translated: str | None = None
+        self._message: Message | dict | None = None  # Message object or dictionary
+
+    @classmethod
+    def from_message(cls, message: Message) -> "MessageRecord":
+        """
+        Creates a record from a Message object, as collected from the Telegram API.
+        Service and empty messages have no text and may have no date or sender.
+        """
+        from_id = getattr(message, "from_id", None)
+        record = cls()
+        record.id = message.id
+        record.date = getattr(message, "date", None)
+        record.entity_id = _get_peer_id(getattr(message, "peer_id", None))
+        record.sender_user_id = getattr(from_id, "user_id", None)
+        record.sender_channel_id = getattr(from_id, "channel_id", None)
+        record.text = getattr(message, "message", None)
+        record._message = message
+        return record
+
+    @classmethod
+    def from_dict(cls, message_dict: dict) -> "MessageRecord":
+        """
+        Creates a record from a message converted to a dictionary (i.e.: read back from
+        the JSON output). The record shares the dictionary.
+        """
+        from_id: dict = message_dict.get("from_id") or {}
+        peer_id: dict = message_dict.get("peer_id") or {}
+        record = cls()
+        record.id = message_dict.get("id")
+        record.date = message_dict.get("date")
+        record.entity_id = (
+            peer_id.get("channel_id") or peer_id.get("chat_id") or peer_id.get("user_id")
+        )
+        record.sender_user_id = from_id.get("user_id")
+        record.sender_channel_id = from_id.get("channel_id")
+        record.text = message_dict.get("message")
+        record.text_translated = message_dict.get("message_translated")
+        record._message = message_dict
+        return record
+
+    def to_dict(self) -> dict:
+        """
+        Converts the full message to a dictionary, with its translation if any. A record
+        created from a dictionary returns that dictionary.
+        """
+        message_dict: dict = (
+            self._message if isinstance(self._message, dict) else self._message.to_dict()
+        )
+        if self.text_translated:
+            message_dict["message_translated"] = self.text_translated
+        return message_dict
+
+
+def _get_peer_id(peer: PeerChannel | PeerChat | PeerUser | None) -> int | None:
+    """
+    Gets the id of a peer, whatever its type.
+    """
+    return (
+        getattr(peer, "channel_id", None)
+        or getattr(peer, "chat_id", None)
+        or getattr(peer, "user_id", None)
+    )
@@ -0,0 +1,329 @@
+"""
+Metrics of a collection run: counters and latency histograms, per entity and per stage.
+
+Every stage of the pipeline records its metrics here (API calls, throttling, proxy
+rotations, translation, IOCs extraction, writing and indexing), attributed to the entity
+being collected (see `set_entity`), so that a slow run can be explained after the fact.
+
+Metrics are exported as a JSON run report at the end of the run (see `write_report`)
+and, in long-running modes, served in the Prometheus text format (see `--metrics-port`
+and `start_server`).
+
+Example usage:
+```
+set_entity(entity.id)
+with timer("translate"):
+    translated = translate(texts)
+count("messages_translated", len(texts))
+write_report(f"{logger.RUN_OUTPUT_DIR}/run_report.json")
+```
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (in seconds) of the buckets of the latency histograms
+BUCKETS: tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300,
+)  # fmt: skip
+PROMETHEUS_PREFIX: str = "telegram_scraper_"
+
+# Throughputs of the run report: (name, counter, histogram of the time spent)
+RATES: tuple[tuple[str, str, str], ...] = (
+    ("translation_messages_per_second", "messages_translated", "translate_seconds"),
+    ("ioc_scan_messages_per_second", "messages_scanned", "ioc_scan_seconds"),
+    ("write_bytes_per_second", "bytes_written", "write_seconds"),
+    ("index_documents_per_second", "documents_indexed", "index_seconds"),
+)
+
+
+class Histogram:
+    """
+    Distribution of durations, in seconds, counted in the buckets of `BUCKETS`.
+    """
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts: list[int] = [0] * len(BUCKETS)  # Not cumulative
+        self.count: int = 0
+        self.sum: float = 0
+
+    def observe(self, seconds: float):
+        for i, upper_bound in enumerate(BUCKETS):
+            if seconds <= upper_bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other: "Histogram"):
+        for i, bucket_count in enumerate(other.counts):
+            self.counts[i] += bucket_count
+        self.count += other.count
+        self.sum += other.sum
+
+    def to_dict(self) -> dict:
+        cumulative_count: int = 0
+        buckets: dict[str, int] = {}
+        for upper_bound, bucket_count in zip(BUCKETS, self.counts):
+            cumulative_count += bucket_count
+            buckets[str(upper_bound)] = cumulative_count
+        buckets["+Inf"] = self.count
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+_lock = threading.Lock()
+_counters: dict[tuple[str, int | None], float] = {}  # (name, entity id) -> value
+_histograms: dict[tuple[str, int | None], Histogram] = {}  # (name, entity id) -> histogram
+_entity_id: int | None = None  # Entity being collected, shared by every thread
+_start_time: float = time.time()
+_server: ThreadingHTTPServer | None = None
+
+
+def set_entity(entity_id: int | None):
+    """
+    Sets the entity that the next metrics are attributed to, in every thread (i.e.: the
+    threads of the client pool and of the Elasticsearch exports).
+
+    Args:
+        entity_id: id of the entity being collected, None once its collection is done
+    """
+    global _entity_id
+    _entity_id = entity_id
+
+
+def get_entity() -> int | None:
+    """
+    Returns the id of the entity that metrics are currently attributed to, if any.
+    """
+    return _entity_id
+
+
+def count(name: str, value: float = 1):
+    """
+    Increments a counter of the current entity.
+
+    Args:
+        name: name of the counter (i.e.: "api_calls")
+        value (optional): increment, default 1
+    """
+    key = (name, _entity_id)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(stage: str, seconds: float):
+    """
+    Records a duration in the latency histogram of a stage, for the current entity.
+
+    Args:
+        stage: name of the stage (i.e.: "api_call"), recorded as "<stage>_seconds"
+        seconds: duration of the stage
+    """
+    key = (f"{stage}_seconds", _entity_id)
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        _histograms[key].observe(seconds)
+
+
+@contextmanager
+def timer(stage: str):
+    """
+    Times the enclosed block of code and records its duration (see `observe`), even if
+    it raises an exception.
+
+    Args:
+        stage: name of the stage (i.e.: "translate")
+    """
+    start_time: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start_time)
+
+
+def _snapshot() -> tuple[dict, dict]:
+    """
+    Copies the metrics, so that they can be exported without holding the lock.
+
+    Returns:
+        A tuple of (counters, histograms), keyed by (name, entity id).
+    """
+    with _lock:
+        histograms: dict[tuple[str, int | None], Histogram] = {}
+        for key, histogram in _histograms.items():
+            histograms[key] = Histogram()
+            histograms[key].merge(histogram)
+        return dict(_counters), histograms
+
+
+def _summarize(counters: dict[str, float], histograms: dict[str, Histogram]) -> dict:
+    """
+    Builds the report of a set of metrics, with the throughputs derived from them.
+    """
+    rates: dict[str, float] = {}
+    for rate_name, counter_name, histogram_name in RATES:
+        histogram: Histogram | None = histograms.get(histogram_name)
+        if counter_name in counters and histogram is not None and histogram.sum > 0:
+            rates[rate_name] = counters[counter_name] / histogram.sum
+    return {
+        "counters": dict(sorted(counters.items())),
+        "histograms": {
+            name: histograms[name].to_dict() for name in sorted(histograms)
+        },
+        "rates": rates,
+    }
+
+
+def get_report() -> dict:
+    """
+    Builds the report of the run: metrics of the whole run, and of each entity.
+
+    Returns:
+        The report, as a JSON-serializable dictionary.
+    """
+    counters, histograms = _snapshot()
+
+    total_counters: dict[str, float] = {}
+    total_histograms: dict[str, Histogram] = {}
+    entity_counters: dict[int, dict[str, float]] = {}
+    entity_histograms: dict[int, dict[str, Histogram]] = {}
+    for (name, entity_id), value in counters.items():
+        total_counters[name] = total_counters.get(name, 0) + value
+        if entity_id is not None:
+            entity_counters.setdefault(entity_id, {})[name] = value
+    for (name, entity_id), histogram in histograms.items():
+        total_histograms.setdefault(name, Histogram()).merge(histogram)
+        if entity_id is not None:
+            entity_histograms.setdefault(entity_id, {})[name] = histogram
+
+    return {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(_start_time)),
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "elapsed_seconds": time.time() - _start_time,
+        "total": _summarize(total_counters, total_histograms),
+        "entities": {
+            str(entity_id): _summarize(
+                entity_counters.get(entity_id, {}), entity_histograms.get(entity_id, {})
+            )
+            for entity_id in sorted(set(entity_counters) | set(entity_histograms))
+        },
+    }
+
+
+def write_report(path: str):
+    """
+    Writes the JSON report of the run (see `get_report`). The report is replaced
+    atomically, so that it can be read while a long-running collection updates it.
+
+    Args:
+        path: path of the report file
+    """
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(get_report(), file, indent=2)
+    os.replace(path + ".tmp", path)
+    logging.info(f"[+] Run metrics report written to '{path}'")
+
+
+def to_prometheus() -> str:
+    """
+    Formats the metrics in the Prometheus text exposition format, labelled by entity.
+
+    Returns:
+        The metrics, as text.
+    """
+    counters, histograms = _snapshot()
+    lines: list[str] = [
+        f"# TYPE {PROMETHEUS_PREFIX}uptime_seconds gauge",
+        f"{PROMETHEUS_PREFIX}uptime_seconds {time.time() - _start_time}",
+    ]
+
+    previous_name: str | None = None
+    for (name, entity_id), value in sorted(counters.items(), key=_sort_key):
+        if name != previous_name:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name}_total counter")
+            previous_name = name
+        lines.append(f"{PROMETHEUS_PREFIX}{name}_total{_labels(entity_id)} {value}")
+
+    for (name, entity_id), histogram in sorted(histograms.items(), key=_sort_key):
+        if name != previous_name:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} histogram")
+            previous_name = name
+        for upper_bound, cumulative_count in histogram.to_dict()["buckets"].items():
+            lines.append(
+                f"{PROMETHEUS_PREFIX}{name}_bucket{_labels(entity_id, le=upper_bound)} {cumulative_count}"
+            )
+        lines.append(f"{PROMETHEUS_PREFIX}{name}_sum{_labels(entity_id)} {histogram.sum}")
+        lines.append(f"{PROMETHEUS_PREFIX}{name}_count{_labels(entity_id)} {histogram.count}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _sort_key(item: tuple) -> tuple[str, str]:
+    """
+    Sorts metrics keyed by (name, entity id) by name, then entity id.
+    """
+    (name, entity_id), _ = item
+    return name, "" if entity_id is None else str(entity_id)
+
+
+def _labels(entity_id: int | None, **labels: str) -> str:
+    """
+    Formats the Prometheus labels of a metric. Metrics recorded outside of an entity
+    collection (i.e.: enumerating dialogs) have an empty entity label.
+    """
+    labels = {"entity_id": "" if entity_id is None else str(entity_id), **labels}
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics at /metrics, in the Prometheus text format.
+    """
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body: bytes = to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Metrics endpoint: {format % args}")
+
+
+def start_server(port: int):
+    """
+    Serves the metrics at http://<host>:<port>/metrics in a background thread, for
+    Prometheus to scrape.
+
+    Args:
+        port: port to listen on, on every interface
+    """
+    global _server
+    _server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    logging.info(f"[+] Serving metrics at http://localhost:{port}/metrics")
+
+
+def stop_server():
+    """
+    Stops serving the metrics, if they are served.
+    """
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
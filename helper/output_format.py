@@ -0,0 +1,434 @@
+"""
+Output format of the collected data, and streaming readers for every supported format.
+
+Supported formats (see `--output-format`):
+- json:        JSON list, pretty-printed (default, as read by older tools)
+- ndjson:      newline-delimited JSON, one compact record per line
+- ndjson-gzip: newline-delimited JSON, compressed with gzip
+- ndjson-zstd: newline-delimited JSON, compressed with zstandard (requires `pip install zstandard`)
+
+Files are written in the format of the current run, but every format can be read back,
+record by record, so that output folders mixing several formats can be processed.
+
+Large outputs can be split into numbered segments of bounded size (see `write_segments`),
+listed in a segment index along with their range of ids and dates, so that consumers can
+process segments in parallel or only read the segments of the range they need:
+```
+messages_123_seg0001.ndjson.gz
+messages_123_seg0002.ndjson.gz
+messages_123.segments.json
+```
+
+Example usage:
+```
+path = write(f"{logger.OUTPUT_DIR}/messages_123", messages)  # i.e.: ".../messages_123.ndjson.gz"
+for message in read(path):
+    ...
+```
+"""
+
+import glob as glob_module
+import gzip
+import io
+import json
+import os
+import textwrap
+
+import ijson
+
+from helper import helper, metrics, profiler, serialization
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File extension of each output format
+FORMATS: dict[str, str] = {
+    "json": ".json",
+    "ndjson": ".ndjson",
+    "ndjson-gzip": ".ndjson.gz",
+    "ndjson-zstd": ".ndjson.zst",
+}
+SEGMENT_INDEX_EXTENSION: str = ".segments.json"
+
+
+class _Writer:
+    """
+    Writes records to a file one at a time, in the output format of the current run, and
+    tracks the number of records and of (uncompressed) bytes written.
+    """
+
+    __slots__ = ("path", "count", "bytes", "_file", "_json")
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.count: int = 0
+        self.bytes: int = 0
+        self._json: bool = path.endswith(FORMATS["json"])
+        self._file = (
+            open(path, "w", encoding="utf-8") if self._json else _open_text(path, "w")
+        )
+
+    def write(self, record: dict):
+        if self._json:
+            # Same layout as json.dump(records, indent=2), one record at a time
+            text: str = ("[\n" if self.count == 0 else ",\n") + textwrap.indent(
+                serialization.dumps(record, indent=True), "  "
+            )
+        else:
+            text = serialization.dumps(record) + "\n"
+        self._file.write(text)
+        self.count += 1
+        self.bytes += len(text.encode("utf-8"))
+
+    def close(self):
+        if self._json:
+            self._file.write("[]" if self.count == 0 else "\n]")
+        self._file.close()
+        metrics.count("records_written", self.count)
+        metrics.count("bytes_written", os.path.getsize(self.path))  # After compression
+
+
+def zstd_available() -> bool:
+    """
+    Returns True if the zstandard library is installed.
+    """
+    return zstandard is not None
+
+
+def write(path_without_extension: str, records, format_name: str | None = None) -> str:
+    """
+    Writes records to a file in the output format of the current run.
+
+    Args:
+        path_without_extension: path of the file, without extension
+        records: list or generator of records (dictionaries)
+        format_name (optional): output format to write instead of the current run's
+            (i.e.: "ndjson-gzip"), default None
+
+    Returns:
+        The path of the written file, with the extension of the output format.
+    """
+    writer = OutputWriter(path_without_extension, format_name=format_name)
+    try:
+        writer.write(records)
+    finally:
+        paths: list[str] = writer.close()
+    return paths[0]
+
+
+def write_segments(
+    path_without_extension: str,
+    records,
+    max_records: int = 0,
+    max_bytes: int = 0,
+) -> list[str]:
+    """
+    Writes records to numbered segment files in the output format of the current run,
+    rolling over to a new segment after a number of records or of bytes, and writes the
+    segment index listing each segment with its range of ids and dates.
+
+    Args:
+        path_without_extension: path of the file, without extension
+        records: list or generator of records (dictionaries) with "id" and "date" fields
+        max_records (optional): maximum number of records per segment, 0 for no limit
+        max_bytes (optional): maximum number of bytes per segment, before compression,
+            0 for no limit
+
+    Returns:
+        The paths of the written segment files, in order.
+    """
+    writer = OutputWriter(
+        path_without_extension,
+        segmented=True,
+        max_records=max_records,
+        max_bytes=max_bytes,
+    )
+    try:
+        writer.write(records)
+    finally:
+        paths: list[str] = writer.close()
+    return paths
+
+
+class OutputWriter:
+    """
+    Writes records to a file, or to numbered segment files (see `write_segments`), over
+    several calls (i.e.: one per chunk of processed messages), so that the records do not
+    have to be in memory at once.
+    ```
+    writer = OutputWriter(f"{logger.OUTPUT_DIR}/messages_123")
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+    finally:
+        paths = writer.close()
+    ```
+    """
+
+    __slots__ = (
+        "path_without_extension",
+        "segmented",
+        "max_records",
+        "max_bytes",
+        "count",
+        "_extension",
+        "_writer",
+        "_segment",
+        "_segments",
+        "_paths",
+    )
+
+    def __init__(
+        self,
+        path_without_extension: str,
+        segmented: bool = False,
+        max_records: int = 0,
+        max_bytes: int = 0,
+        format_name: str | None = None,
+    ):
+        """
+        Args:
+            path_without_extension: path of the file, without extension
+            segmented (optional): True to write numbered segment files and their segment
+                index, default False for a single file
+            max_records (optional): maximum number of records per segment, 0 for no limit
+            max_bytes (optional): maximum number of bytes per segment, before compression,
+                0 for no limit
+            format_name (optional): output format to write instead of the current run's
+                (i.e.: "ndjson-gzip"), default None
+        """
+        self.path_without_extension: str = path_without_extension
+        self.segmented: bool = segmented
+        self.max_records: int = max_records
+        self.max_bytes: int = max_bytes
+        self.count: int = 0  # Number of records written
+        self._extension: str = FORMATS[format_name or helper.output_format]
+        self._writer: _Writer | None = None
+        self._segment: dict | None = None
+        self._segments: list[dict] = []
+        self._paths: list[str] = []
+        if not segmented:
+            # Written even if there are no records
+            self._writer = _Writer(path_without_extension + self._extension)
+            self._paths.append(self._writer.path)
+
+    def write(self, records):
+        """
+        Writes records after the records already written.
+
+        Args:
+            records: list or generator of records (dictionaries), with "id" and "date"
+                fields if written in segments
+        """
+        with metrics.timer("write"), profiler.stage("serialize"):
+            for record in records:
+                if self._writer is None:
+                    self._writer = _Writer(
+                        f"{self.path_without_extension}_seg{len(self._segments) + 1:04d}"
+                        + self._extension
+                    )
+                    self._paths.append(self._writer.path)
+                    self._segment = {"file": os.path.basename(self._writer.path)}
+                    self._segments.append(self._segment)
+                self._writer.write(record)
+                self.count += 1
+                if not self.segmented:
+                    continue
+
+                _update_range(self._segment, "id", record.get("id"))
+                _update_range(self._segment, "date", _to_string(record.get("date")))
+                if (self.max_records and self._writer.count >= self.max_records) or (
+                    self.max_bytes and self._writer.bytes >= self.max_bytes
+                ):
+                    self._close_writer()
+
+    def close(self) -> list[str]:
+        """
+        Closes the file being written and, if written in segments, writes the segment
+        index.
+
+        Returns:
+            The paths of the written files, in order.
+        """
+        with metrics.timer("write"), profiler.stage("serialize"):
+            if self._writer is not None:
+                self._close_writer()
+        if self.segmented:
+            with open(
+                self.path_without_extension + SEGMENT_INDEX_EXTENSION,
+                "w",
+                encoding="utf-8",
+            ) as file:
+                json.dump({"segments": self._segments}, file, indent=2)
+        return self._paths
+
+    def _close_writer(self):
+        self._writer.close()
+        if self._segment is not None:
+            self._segment.update(
+                {"count": self._writer.count, "bytes": self._writer.bytes}
+            )
+        self._writer = None
+
+
+def read_segment_index(path_without_extension: str) -> list[dict] | None:
+    """
+    Reads the segment index of a file written in segments.
+
+    Args:
+        path_without_extension: path of the file, without extension
+
+    Returns:
+        The list of segments, with their file name, number of records and bytes, and
+        range of ids and dates, or None if the file was not written in segments.
+    """
+    index_path: str = path_without_extension + SEGMENT_INDEX_EXTENSION
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r", encoding="utf-8") as file:
+        return json.load(file)["segments"]
+
+
+def find_segments(
+    path_without_extension: str, first_id: int = None, last_id: int = None
+) -> list[str]:
+    """
+    Finds the files of a file written in segments, or the file itself if it was written
+    as a single file, optionally only the segments overlapping a range of ids.
+
+    Args:
+        path_without_extension: path of the file, without extension
+        first_id (optional): first id of the range, None for no lower bound
+        last_id (optional): last id of the range, None for no upper bound
+
+    Returns:
+        The paths of the files, in order.
+    """
+    segments: list[dict] | None = read_segment_index(path_without_extension)
+    if segments is None:
+        path: str | None = find(path_without_extension)
+        return [] if path is None else [path]
+
+    directory: str = os.path.dirname(path_without_extension)
+    return [
+        os.path.join(directory, segment["file"])
+        for segment in segments
+        if (first_id is None or segment["last_id"] >= first_id)
+        and (last_id is None or segment["first_id"] <= last_id)
+    ]
+
+
+def read(path: str):
+    """
+    Reads the records of a file written in any supported output format, one at a time.
+
+    Args:
+        path: path of the file
+
+    Returns:
+        A generator of records (dictionaries).
+    """
+    if path.endswith(FORMATS["json"]):
+        with open(path, "rb") as file:
+            # Files of a single object (i.e.: an entity's information) are one record
+            first_character: bytes = file.read(1)
+            while first_character.isspace():
+                first_character = file.read(1)
+            file.seek(0)
+            prefix: str = "item" if first_character == b"[" else ""
+            yield from ijson.items(file, prefix, use_float=True)
+        return
+
+    with _open_text(path, "r") as file:
+        for line in file:
+            if line.strip():
+                yield serialization.loads(line)
+
+
+def find(path_without_extension: str) -> str | None:
+    """
+    Finds a file written in any supported output format.
+
+    Args:
+        path_without_extension: path of the file, without extension
+
+    Returns:
+        The path of the file, or None if it does not exist.
+    """
+    for extension in FORMATS.values():
+        if os.path.exists(path_without_extension + extension):
+            return path_without_extension + extension
+    return None
+
+
+def glob(pattern_without_extension: str) -> list[str]:
+    """
+    Finds the files matching a glob pattern, written in any supported output format.
+    Segment indexes are not matched.
+
+    Args:
+        pattern_without_extension: glob pattern of the files, without extension
+
+    Returns:
+        The sorted list of paths of the matching files.
+    """
+    return sorted(
+        path
+        for extension in FORMATS.values()
+        for path in glob_module.glob(pattern_without_extension + extension)
+        if not path.endswith(SEGMENT_INDEX_EXTENSION)
+    )
+
+
+def strip_extension(path: str) -> str:
+    """
+    Removes the extension of an output format from a path.
+    """
+    for extension in sorted(FORMATS.values(), key=len, reverse=True):
+        if path.endswith(extension):
+            return path[: -len(extension)]
+    return path
+
+
+def _update_range(segment: dict, field: str, value):
+    """
+    Extends the range of a field (i.e.: "first_id" and "last_id") of a segment to a value.
+    """
+    if value is None:
+        return
+    if segment.get(f"first_{field}") is None or value < segment[f"first_{field}"]:
+        segment[f"first_{field}"] = value
+    if segment.get(f"last_{field}") is None or value > segment[f"last_{field}"]:
+        segment[f"last_{field}"] = value
+
+
+def _to_string(value) -> str | None:
+    """
+    Converts a date (datetime object as collected, or ISO string as read back) to a string.
+    """
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _open_text(path: str, mode: str):
+    """
+    Opens a newline-delimited JSON file in text mode, compressed based on its extension.
+
+    Args:
+        path: path of the file
+        mode: "r" to read or "w" to write
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, f"{mode}t", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise Exception(
+                f"Cannot open '{path}'. Install zstandard with `pip install zstandard`"
+            )
+        if mode == "w":
+            stream = zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
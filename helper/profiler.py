@@ -0,0 +1,381 @@
+"""
+Profiling of collection runs, for `--profile`.
+
+Profiles the whole run or selected stages of the pipeline, per entity:
+- run:       the whole run; each entity's collection is profiled separately from the
+             rest of the run (startup, enumerating dialogs, listening for new messages)
+- fetch:     Telegram API calls (see rate_limiter.call_api)
+- translate: translation of messages, in this process and in the translation workers
+- ioc:       IOCs extraction
+- serialize: conversion of messages to dictionaries and writing of the output files
+- index:     indexing into Elasticsearch
+
+Two modes are supported:
+- cprofile: deterministic profiling with cProfile. Every function call is recorded, which
+            slows down CPU-bound stages. Profiles can be read with `python -m pstats` or
+            snakeviz.
+- sampling: the stacks of the threads in a profiled stage are sampled every
+            `SAMPLING_INTERVAL` seconds by a background thread, with a low overhead.
+            Profiles are written in the collapsed stacks format ("folded"), which can be
+            read with flamegraph.pl or speedscope.
+
+Time spent in a profiled stage is not counted in the profiled stage that encloses it
+(i.e.: API calls are not counted in "run" if "fetch" is also profiled).
+
+Profiles are written into the output folder of the run, and merged with the profiles of
+the same entity and stage already written there (i.e.: one per live micro-batch):
+```
+profiles/run.prof                              # Outside of entity collections
+profiles/entity_<entity id>/<stage>.prof
+profiles/entity_<entity id>/translate_worker_<process id>.prof
+```
+
+Example usage:
+```
+configure("sampling", ["fetch", "translate"])
+with stage("fetch"):
+    messages = client.get_messages(entity, limit=500)
+flush(entity.id)  # Write the entity's profiles
+```
+"""
+
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import sys
+import threading
+from contextlib import contextmanager
+
+from helper import logger, metrics
+
+MODES: tuple[str, ...] = ("cprofile", "sampling")
+STAGES: tuple[str, ...] = ("run", "fetch", "translate", "ioc", "serialize", "index")
+SAMPLING_INTERVAL: float = 0.01  # Seconds between samples of the stacks
+PROFILES_DIR: str = "profiles"
+
+mode: str | None = None  # None when profiling is disabled
+stages: frozenset[str] = frozenset()
+
+_lock = threading.Lock()
+# (path without extension, thread id) -> profile. Each thread has its own profiles, which
+# are merged into the same file
+_profiles: dict[tuple[str, int], "_StageProfile"] = {}
+_active: dict[int, list["_StageProfile"]] = {}  # thread id -> stack of profiled stages
+_sampler: threading.Thread | None = None
+_sampler_stop: threading.Event = threading.Event()
+
+
+class _StageProfile:
+    """
+    Profile of a stage of an entity in a thread, not yet written to disk.
+    """
+
+    __slots__ = ("path", "thread_id", "entity_id", "profile", "stacks", "enabled")
+
+    def __init__(self, path: str, thread_id: int, entity_id: int | None):
+        self.path: str = path  # Without extension
+        self.thread_id: int = thread_id
+        self.entity_id: int | None = entity_id
+        self.profile: cProfile.Profile | None = (
+            cProfile.Profile() if mode == "cprofile" else None
+        )
+        self.stacks: dict[str, int] = {}  # Folded stack -> number of samples
+        self.enabled: bool = False
+
+    def start(self):
+        if self.profile is not None:
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Python 3.12+ only allows one active cProfile at a time, in any thread
+                logging.debug(f"Another profiler is active. Not profiling {self.path}")
+                return
+        self.enabled = True
+
+    def stop(self):
+        if self.profile is not None and self.enabled:
+            self.profile.disable()
+        self.enabled = False
+
+    def empty(self) -> bool:
+        if self.profile is not None:
+            self.profile.create_stats()
+            return len(self.profile.stats) == 0
+        return len(self.stacks) == 0
+
+    def write(self):
+        """
+        Merges the profile into its file, if any, and resets the profile.
+        """
+        if self.empty():
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        if self.profile is not None:
+            path: str = self.path + ".prof"
+            stats = pstats.Stats(self.profile)
+            if os.path.exists(path):
+                stats.add(path)
+            stats.dump_stats(path + ".tmp")
+            self.profile = cProfile.Profile()
+        else:
+            path = self.path + ".folded"
+            stacks: dict[str, int] = _read_folded(path) if os.path.exists(path) else {}
+            with _lock:
+                for folded_stack, samples in self.stacks.items():
+                    stacks[folded_stack] = stacks.get(folded_stack, 0) + samples
+                self.stacks = {}
+            with open(path + ".tmp", "w", encoding="utf-8") as file:
+                for folded_stack, samples in stacks.items():
+                    file.write(f"{folded_stack} {samples}\n")
+        os.replace(path + ".tmp", path)
+        logging.debug(f"Profile written to '{path}'")
+
+
+def configure(new_mode: str | None, new_stages: list[str]):
+    """
+    Enables profiling of stages.
+
+    Args:
+        new_mode: "cprofile" or "sampling", None to disable profiling
+        new_stages: stages to profile (see `STAGES`)
+    """
+    global mode, stages
+    mode = new_mode
+    stages = frozenset(new_stages)
+
+
+def enabled(stage_name: str) -> bool:
+    """
+    Returns True if a stage is profiled.
+    """
+    return mode is not None and stage_name in stages
+
+
+@contextmanager
+def stage(stage_name: str):
+    """
+    Profiles the enclosed block of code as a stage of the current entity (see
+    metrics.set_entity), if the stage is profiled. Otherwise, does nothing.
+
+    Args:
+        stage_name: name of the stage (see `STAGES`)
+    """
+    if not enabled(stage_name):
+        yield
+        return
+
+    entity_id: int | None = metrics.get_entity()
+    with _lock:
+        stage_profile: _StageProfile = _get_profile(
+            _get_path(entity_id, stage_name), entity_id
+        )
+    with _enter(stage_profile):
+        yield
+
+
+def worker_task(func, stage_name: str):
+    """
+    Wraps a function to be executed by worker processes (i.e.: the translation pool), so
+    that each worker profiles its calls into its own profile of the current entity.
+
+    Args:
+        func: function to execute in the worker processes, which must be picklable
+        stage_name: name of the stage (see `STAGES`)
+
+    Returns:
+        The function to submit to the worker processes, `func` itself if the stage is not
+        profiled.
+    """
+    if not enabled(stage_name):
+        return func
+    path: str = _get_path(metrics.get_entity(), f"{stage_name}_worker")
+    return functools.partial(_run_in_worker, mode, path, func)
+
+
+def flush(entity_id: int | None = None):
+    """
+    Writes the profiles of an entity into the output folder of the run, and resets them.
+
+    Args:
+        entity_id (optional): id of the entity, default None for the profiles outside of
+            entity collections
+    """
+    if mode is None:
+        return
+    with _lock:
+        stage_profiles: list[_StageProfile] = [
+            stage_profile
+            for stage_profile in _profiles.values()
+            if stage_profile.entity_id == entity_id and not stage_profile.enabled
+        ]
+    for stage_profile in stage_profiles:
+        stage_profile.write()
+        with _lock:
+            _profiles.pop((stage_profile.path, stage_profile.thread_id), None)
+
+
+def close():
+    """
+    Stops the sampler, if any, and writes every profile left.
+    """
+    global _sampler
+    if _sampler is not None:
+        _sampler_stop.set()
+        _sampler.join()
+        _sampler = None
+        _sampler_stop.clear()
+    for entity_id in {stage_profile.entity_id for stage_profile in list(_profiles.values())}:
+        flush(entity_id)
+
+
+def _get_path(entity_id: int | None, name: str) -> str:
+    """
+    Gets the path of a profile, without extension, in the current output folder.
+    """
+    if entity_id is None:
+        return f"{logger.OUTPUT_DIR}/{PROFILES_DIR}/{name}"
+    return f"{logger.OUTPUT_DIR}/{PROFILES_DIR}/entity_{entity_id}/{name}"
+
+
+def _get_profile(path: str, entity_id: int | None) -> _StageProfile:
+    """
+    Gets the current thread's profile not yet written to a path, creating it if
+    necessary. The lock must be held.
+    """
+    key: tuple[str, int] = (path, threading.get_ident())
+    if key not in _profiles:
+        _profiles[key] = _StageProfile(path, key[1], entity_id)
+    return _profiles[key]
+
+
+@contextmanager
+def _enter(stage_profile: _StageProfile):
+    """
+    Makes a profile the active profile of the current thread, pausing the profile of the
+    enclosing stage, if any, until the enclosed block of code is done.
+    """
+    thread_id: int = threading.get_ident()
+    if mode == "sampling":
+        _start_sampler()
+
+    with _lock:
+        stack: list[_StageProfile] = _active.setdefault(thread_id, [])
+        enclosing: _StageProfile | None = stack[-1] if stack else None
+        stack.append(stage_profile)
+    if enclosing is not None:
+        enclosing.stop()
+    # The same profile may already be active in the thread (i.e.: nested API calls)
+    if not stage_profile.enabled:
+        stage_profile.start()
+    try:
+        yield
+    finally:
+        with _lock:
+            stack.pop()
+            if len(stack) == 0:
+                _active.pop(thread_id, None)
+        if stage_profile not in stack:
+            stage_profile.stop()
+        if enclosing is not None and not enclosing.enabled:
+            enclosing.start()
+
+
+def _run_in_worker(worker_mode: str, path: str, func, *args):
+    """
+    Calls a function in a worker process, profiling the call into the worker's own
+    profile, which is written after each call as worker processes do not run exit
+    handlers. Function to be executed in the worker processes.
+
+    Args:
+        worker_mode: profiling mode of the main process
+        path: path of the profile, without extension and process id
+        func: the function to call
+        *args: arguments of the function
+
+    Returns:
+        The result of the function.
+    """
+    global mode
+    mode = worker_mode
+    with _lock:
+        stage_profile: _StageProfile = _get_profile(f"{path}_{os.getpid()}", None)
+    try:
+        with _enter(stage_profile):
+            return func(*args)
+    finally:
+        stage_profile.write()
+
+
+def _start_sampler():
+    """
+    Starts the thread that samples the stacks of profiled threads, if it is not running.
+    """
+    global _sampler
+    with _lock:
+        if _sampler is not None:
+            return
+        _sampler_stop.clear()
+        _sampler = threading.Thread(target=_sample, name="profiler", daemon=True)
+        _sampler.start()
+
+
+def _sample():
+    """
+    Samples the stack of every thread in a profiled stage, until the sampler is stopped.
+    """
+    while not _sampler_stop.wait(SAMPLING_INTERVAL):
+        frames: dict = sys._current_frames()
+        with _lock:
+            for thread_id, stack in _active.items():
+                if len(stack) > 0 and stack[-1].enabled and thread_id in frames:
+                    folded_stack: str = _fold(frames[thread_id])
+                    stacks: dict[str, int] = stack[-1].stacks
+                    stacks[folded_stack] = stacks.get(folded_stack, 0) + 1
+
+
+def _fold(frame) -> str:
+    """
+    Formats a stack in the collapsed stacks format: frames from the outermost to the
+    innermost, separated by semicolons.
+    """
+    frames: list[str] = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+def _read_folded(path: str) -> dict[str, int]:
+    """
+    Reads a profile in the collapsed stacks format.
+    """
+    stacks: dict[str, int] = {}
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            folded_stack, _, samples = line.rstrip("\n").rpartition(" ")
+            stacks[folded_stack] = stacks.get(folded_stack, 0) + int(samples)
+    return stacks
+
+
+def _reset_after_fork():
+    """
+    Resets the profiling state of a forked process (i.e.: a translation worker), which
+    inherits the profiles, and any profiler enabled, of the thread that forked it.
+    """
+    global _lock, _profiles, _active, _sampler
+    for stage_profile in _profiles.values():
+        if stage_profile.enabled and stage_profile.thread_id == threading.get_ident():
+            stage_profile.stop()
+    _lock = threading.Lock()  # May have been held by another thread when forking
+    _profiles = {}
+    _active = {}
+    _sampler = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
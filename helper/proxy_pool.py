@@ -0,0 +1,290 @@
+"""
+Pool of pre-warmed Telegram connections used to rotate proxies without reconnecting.
+
+Rotating the proxy of a client requires a disconnect and a new TCP + MTProto handshake,
+which blocks the collection. Instead, the pool keeps one client per proxy connected in the
+background (started from the authorization of the main client via a StringSession), and a
+rotation simply switches to another already connected client.
+
+The health of each proxy is tracked (connect latency, successful and failed connections).
+Rotations pick the healthiest proxies, failing proxies are quarantined for an increasing
+amount of time, and proxies that keep failing are ejected for the rest of the run.
+
+Example usage:
+```
+while True:
+    if api_calls % ROTATE_BATCH_REQUESTS == 0:
+        # Switches client when the rotation budget is used up
+        client = rotate_proxy(client, ROTATE_BATCH_REQUESTS)
+    api_calls += 1
+    chunk = client.get_messages(entity, ...)
+```
+"""
+
+import logging
+import random
+import time
+
+from telethon.sessions import StringSession
+from telethon.sync import TelegramClient
+
+from configs import API_HASH, API_ID, PROXIES
+from helper import rate_limiter
+from helper.logger import SAMPLED
+
+ROTATE_REQUESTS: int = 20  # Number of API calls until rotating to another proxy
+ROTATE_SECONDS: int = 300  # Number of seconds until rotating to another proxy
+ROTATE_BATCH_REQUESTS: int = 5  # Number of API calls made between rotations
+QUARANTINE_SECONDS: int = 60  # Doubled on every consecutive failure of a proxy
+MAX_CONSECUTIVE_FAILURES: int = 5  # Failures until a proxy is ejected for the run
+
+# Pool of the main client, created on its first rotation
+_pool: "ProxyPool | None" = None
+
+
+class ProxyHealth:
+    """
+    Health and connection of a proxy in the pool.
+
+    Attributes:
+        proxy: the proxy configuration
+        client: client connected through the proxy, None until warmed up
+        latency: moving average of the number of seconds taken to connect
+        successes: number of successful connections
+        failures: number of failed connections (including dropped connections)
+        consecutive_failures: number of failures since the last successful connection
+        quarantined_until: epoch timestamp until which the proxy is not used
+        warming: True while the client is connecting in the background
+    """
+
+    __slots__ = (
+        "proxy",
+        "client",
+        "latency",
+        "successes",
+        "failures",
+        "consecutive_failures",
+        "quarantined_until",
+        "warming",
+    )
+
+    def __init__(self, proxy: dict):
+        self.proxy = proxy
+        self.client = None
+        self.latency = None
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.quarantined_until = 0
+        self.warming = False
+
+    @property
+    def name(self) -> str:
+        return f"{self.proxy['proxy_type']} proxy '{self.proxy['addr']}:{self.proxy['port']}'"
+
+    @property
+    def ejected(self) -> bool:
+        return self.consecutive_failures >= MAX_CONSECUTIVE_FAILURES
+
+    @property
+    def ready(self) -> bool:
+        return (
+            not self.warming
+            and self.client is not None
+            and self.client.is_connected()
+            and time.time() >= self.quarantined_until
+        )
+
+    @property
+    def score(self) -> float:
+        """
+        Higher is healthier: the connection success rate over the connect latency.
+        """
+        success_rate: float = (self.successes + 1) / (self.successes + self.failures + 2)
+        return success_rate / max(self.latency or 1.0, 0.01)
+
+    def record_failure(self):
+        """
+        Records a failed or dropped connection and quarantines the proxy.
+        """
+        self.failures += 1
+        self.consecutive_failures += 1
+        quarantine_seconds: int = QUARANTINE_SECONDS * 2 ** (self.consecutive_failures - 1)
+        self.quarantined_until = time.time() + quarantine_seconds
+        if self.ejected:
+            logging.warning(f"[-] Ejecting {self.name} after {self.failures} failures")
+        else:
+            logging.warning(
+                f"[-] Quarantining {self.name} for {quarantine_seconds} second(s)"
+            )
+
+
+class ProxyPool:
+    """
+    Keeps one connected client per proxy and rotates between them on a budget of API calls
+    or time. Clients connect in the background on the main client's event loop, which runs
+    whenever the main client makes an API call, so a rotation never waits for a connection.
+    """
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        proxies: list[dict] = None,
+        rotate_requests: int = ROTATE_REQUESTS,
+        rotate_seconds: int = ROTATE_SECONDS,
+    ):
+        """
+        Args:
+            client: the main, authorized Telegram client whose session is shared
+            proxies (optional): proxies to connect through (default PROXIES)
+            rotate_requests (optional): number of API calls until rotating
+            rotate_seconds (optional): number of seconds until rotating
+        """
+        self._main_client: TelegramClient = client
+        self._session_string: str = StringSession.save(client.session)
+        self._proxies: list[ProxyHealth] = [
+            ProxyHealth(proxy) for proxy in (proxies if proxies is not None else PROXIES)
+        ]
+        self._rotate_requests: int = rotate_requests
+        self._rotate_seconds: int = rotate_seconds
+        self._current: ProxyHealth | None = None
+        self._requests: int = 0
+        self._rotated_time: float = time.time()
+
+    def rotate(self, client: TelegramClient, requests: int = 1) -> TelegramClient:
+        """
+        Gets the client to make the next API calls with, switching to the client of another
+        healthy proxy if the rotation budget is used up or the current connection dropped.
+
+        Args:
+            client: the client currently in use
+            requests (optional): number of API calls to make with the returned client
+                before the next rotation, default 1
+
+        Returns:
+            The client to use, which is `client` itself if no other client is ready yet.
+        """
+        self._requests += requests
+
+        # Detect a dropped connection of the client currently in use
+        if (
+            self._current is not None
+            and client is self._current.client
+            and not client.is_connected()
+        ):
+            self._current.record_failure()
+            self._current = None
+
+        self._warm_up()
+
+        budget_used: bool = (
+            self._requests > self._rotate_requests
+            or time.time() - self._rotated_time >= self._rotate_seconds
+        )
+        if self._current is not None and client is self._current.client and not budget_used:
+            return client
+
+        ready: list[ProxyHealth] = [
+            p for p in self._proxies if p.ready and p is not self._current
+        ]
+        if len(ready) == 0:
+            return client  # Keep using the current client rather than waiting
+
+        # Pick randomly among proxies, weighted by health
+        new: ProxyHealth = random.choices(ready, weights=[p.score for p in ready])[0]
+        logging.info(f"[+] Rotating proxy to the connection via {new.name}", extra=SAMPLED)
+        rate_limiter.set_connection(new.proxy)
+        self._current = new
+        self._requests = requests
+        self._rotated_time = time.time()
+
+        return new.client
+
+    def close(self):
+        """
+        Disconnects the clients of the pool.
+        """
+        for proxy in self._proxies:
+            if proxy.client is not None and proxy.client.is_connected():
+                proxy.client.disconnect()
+            proxy.client = None
+
+    def _warm_up(self):
+        """
+        Starts connecting, in the background, every proxy that is not connected, not
+        quarantined and not ejected.
+        """
+        for proxy in self._proxies:
+            if (
+                proxy.warming
+                or proxy.ejected
+                or time.time() < proxy.quarantined_until
+                or (proxy.client is not None and proxy.client.is_connected())
+            ):
+                continue
+            proxy.warming = True
+            self._main_client.loop.create_task(self._connect(proxy))
+
+    async def _connect(self, proxy: ProxyHealth):
+        """
+        Connects the client of a proxy and records the connect latency or failure.
+
+        Args:
+            proxy: the proxy to connect through
+        """
+        start_time: float = time.monotonic()
+        try:
+            if proxy.client is None:
+                proxy.client = TelegramClient(
+                    StringSession(self._session_string),
+                    API_ID,
+                    API_HASH,
+                    proxy=proxy.proxy,
+                )
+            await proxy.client.connect()  # Returns a coroutine since the loop is running
+            latency: float = time.monotonic() - start_time
+            proxy.latency = (
+                latency if proxy.latency is None else 0.8 * proxy.latency + 0.2 * latency
+            )
+            proxy.successes += 1
+            proxy.consecutive_failures = 0
+            logging.debug(
+                f"Pre-warmed connection via {proxy.name} in {'{:.2f}'.format(latency)} second(s)"
+            )
+        except Exception as e:  # Any failure would otherwise leave the proxy warming forever
+            logging.debug(f"Failed to pre-warm connection via {proxy.name}: {e}")
+            proxy.record_failure()
+        finally:
+            proxy.warming = False
+
+
+def rotate(client: TelegramClient, requests: int = 1) -> TelegramClient:
+    """
+    Gets the client to make the next API calls with, rotating proxies on a budget.
+    The pool is created on the first call.
+
+    Args:
+        client: the client currently in use
+        requests (optional): number of API calls to make with the returned client
+            before the next rotation, default 1
+
+    Returns:
+        The client to use for the next API calls.
+    """
+    global _pool
+    if PROXIES is None or len(PROXIES) == 0:
+        return client
+    if _pool is None:
+        logging.info(f"[+] Pre-warming connections via {len(PROXIES)} proxies")
+        _pool = ProxyPool(client)
+    return _pool.rotate(client, requests)
+
+
+def close():
+    """
+    Disconnects the clients of the main client's pool, if it was created.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
@@ -0,0 +1,298 @@
+"""
+Adaptive rate limiting of Telegram API calls.
+
+API calls are paced by token buckets: one for the Telegram account and one per connection
+(the proxy, or direct connection, that the calling client is connected through). A call
+waits until both buckets have a token, plus a random human-like jitter.
+
+The rate of each bucket adapts to how Telegram responds:
+- Each successful call slowly increases the rate (additive increase)
+- A FloodWaitError halves the rate and pauses the bucket for the requested number of
+  seconds (multiplicative decrease)
+- A call that responds much slower than usual slightly decreases the rate
+
+Clients keep Telethon's `flood_sleep_threshold`: Telethon sleeps on FloodWaitErrors of up
+to a minute and retries the request itself, so that paginated calls (i.e.: every dialog
+or participant) resume where they stopped. Only longer waits are raised as
+FloodWaitErrors to `call_api`. Shorter waits are recorded from the message Telethon logs
+before sleeping (at the INFO level, see logger.configure_logging), so that they tighten
+the rate limiters of the sleeping thread's client and are reported as well.
+
+Example usage:
+```
+messages = call_api(client.get_messages, entity, limit=500)  # Handles FloodWaitError
+throttle()  # Wait before making the next API call
+```
+"""
+
+import logging
+import random
+import threading
+import time
+
+from telethon import errors
+
+from helper import metrics, profiler
+from helper.logger import SAMPLED
+
+ACCOUNT_KEY: str = "account"
+DIRECT_CONNECTION_KEY: str = "direct"
+MIN_RATE: float = 1 / 300  # Never slower than one call every 5 minutes
+INCREASE_STEP: float = 0.02  # Fraction of the rate added after each successful call
+SLOW_RESPONSE_FACTOR: float = 3.0  # Responses this many times slower than usual are slow
+SLOW_RESPONSE_DECREASE: float = 0.9  # Rate multiplier after a slow response
+MAX_FLOOD_WAIT_RETRIES: int = 5
+
+_limiters: dict[str, "RateLimiter"] = {}
+_limiters_lock: threading.Lock = threading.Lock()
+# Connection key of the current thread, and seconds slept by Telethon on FloodWaits
+_connection: threading.local = threading.local()
+
+# Logger and message of Telethon when it sleeps on a FloodWait (see _FloodSleepFilter)
+TELETHON_FLOOD_LOGGER: str = "telethon.client.users"
+TELETHON_FLOOD_MESSAGE: str = "Sleeping%s for %ds (%s) on %s flood wait"
+
+
+class RateLimiter:
+    """
+    Token bucket whose rate adapts to FloodWaitErrors and response latencies.
+    """
+
+    def __init__(self, key: str, rate: float, max_rate: float, capacity: float = 1):
+        """
+        Args:
+            key: name of what is rate limited (i.e.: "account", or a proxy address)
+            rate: initial number of API calls per second
+            max_rate: max number of API calls per second
+            capacity (optional): max number of calls that can be made without waiting
+        """
+        self.key: str = key
+        self.rate: float = rate
+        self.max_rate: float = max_rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.last_refill: float = time.monotonic()
+        self.paused_until: float = 0
+        self.latency: float | None = None  # Moving average of response latencies
+        self.calls: int = 0
+        self.flood_waits: int = 0
+        self.flood_wait_seconds: float = 0
+        self.waited_seconds: float = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token from the bucket.
+
+        Returns:
+            The number of seconds to wait before the token can be used.
+        """
+        with self._lock:
+            now: float = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.last_refill) * self.rate
+            )
+            self.last_refill = now
+            self.tokens -= 1
+
+            delay: float = 0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(delay, self.paused_until - now)
+
+    def on_success(self, latency: float):
+        """
+        Relaxes the rate after a successful API call, unless the response was slow.
+
+        Args:
+            latency: number of seconds the API call took
+        """
+        with self._lock:
+            self.calls += 1
+            if self.latency is not None and latency > SLOW_RESPONSE_FACTOR * self.latency:
+                self.rate = max(MIN_RATE, self.rate * SLOW_RESPONSE_DECREASE)
+            else:
+                self.rate = min(self.max_rate, self.rate * (1 + INCREASE_STEP))
+            self.latency = (
+                latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            )
+
+    def on_flood_wait(self, seconds: int):
+        """
+        Tightens the rate and pauses the bucket after a FloodWaitError.
+
+        Args:
+            seconds: number of seconds Telegram requires to wait
+        """
+        with self._lock:
+            self.flood_waits += 1
+            self.flood_wait_seconds += seconds
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0)
+
+
+def configure(min_throttle: float, max_throttle: float):
+    """
+    Resets all rate limiters based on the throttle time set in the CLI arguments.
+
+    The initial rate is one call per average of the min. and max. throttle time,
+    and the rate never exceeds one call per min. throttle time.
+
+    Args:
+        min_throttle: min. number of seconds between API calls
+        max_throttle: max. number of seconds between API calls
+    """
+    global _initial_rate, _max_rate
+    _initial_rate = 2 / max(min_throttle + max_throttle, 0.2)
+    _max_rate = 1 / max(min_throttle, 0.1)
+    with _limiters_lock:
+        _limiters.clear()
+
+
+_initial_rate: float = 2 / 11  # Default throttle time of 1 to 10 seconds
+_max_rate: float = 1
+
+
+def get_limiter(key: str) -> RateLimiter:
+    """
+    Gets the rate limiter of the given key, creating it if needed.
+
+    Args:
+        key: name of what is rate limited (i.e.: "account", or a proxy address)
+
+    Returns:
+        The rate limiter.
+    """
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(key, _initial_rate, _max_rate)
+        return _limiters[key]
+
+
+def set_connection(proxy: dict | None):
+    """
+    Sets the connection (proxy) that the client of the current thread is connected through.
+
+    Args:
+        proxy: proxy the client is connected through, None for a direct connection
+    """
+    _connection.key = (
+        f"{proxy['addr']}:{proxy['port']}" if proxy is not None else DIRECT_CONNECTION_KEY
+    )
+
+
+def _get_current_limiters() -> list[RateLimiter]:
+    """
+    Gets the rate limiters of the account and of the current thread's connection.
+    """
+    return [
+        get_limiter(ACCOUNT_KEY),
+        get_limiter(getattr(_connection, "key", DIRECT_CONNECTION_KEY)),
+    ]
+
+
+def _on_flood_wait(limiters: list[RateLimiter], seconds: int):
+    """
+    Tightens the rate limiters after a FloodWait, and counts it in the run metrics.
+    """
+    for limiter in limiters:
+        limiter.on_flood_wait(seconds)
+    metrics.count("flood_waits")
+    metrics.count("flood_wait_seconds", seconds)
+
+
+class _FloodSleepFilter(logging.Filter):
+    """
+    Records the FloodWaits that Telethon sleeps through by itself, which are never raised
+    to `call_api`. Telethon also logs when it sleeps "early", before a request that is
+    still in a FloodWait that was already recorded: those are not recorded again.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.msg == TELETHON_FLOOD_MESSAGE and record.args and not record.args[0]:
+            seconds: int = record.args[1]
+            _on_flood_wait(_get_current_limiters(), seconds)
+            _connection.flood_slept = getattr(_connection, "flood_slept", 0) + seconds
+        return True
+
+
+logging.getLogger(TELETHON_FLOOD_LOGGER).addFilter(_FloodSleepFilter())
+
+
+def throttle():
+    """
+    Delays code execution until the next API call is allowed by the account's and the
+    current connection's rate limiters, plus a random human-like jitter.
+    """
+    limiters: list[RateLimiter] = _get_current_limiters()
+    delay: float = max(limiter.reserve() for limiter in limiters)
+
+    # Jitter of up to half the current interval between calls
+    delay += random.uniform(0, 0.5 / min(limiter.rate for limiter in limiters))
+    for limiter in limiters:
+        with limiter._lock:
+            limiter.waited_seconds += delay
+    metrics.count("throttled_seconds", delay)
+
+    logging.info(f"Delaying execution: {delay} second(s)", extra=SAMPLED)
+    time.sleep(delay)
+
+
+def call_api(func, *args, **kwargs):
+    """
+    Makes an API call, waiting and retrying if Telegram responds with a FloodWaitError
+    longer than the client's `flood_sleep_threshold` (shorter ones are waited out by
+    Telethon, and recorded by `_FloodSleepFilter`).
+
+    Args:
+        func: client method to call (i.e.: client.get_messages, or the client itself)
+        *args, **kwargs: arguments of the API call
+
+    Returns:
+        The result of the API call.
+    """
+    limiters: list[RateLimiter] = _get_current_limiters()
+    for attempt in range(MAX_FLOOD_WAIT_RETRIES + 1):
+        start_time: float = time.monotonic()
+        _connection.flood_slept = 0
+        try:
+            with profiler.stage("fetch"):
+                result = func(*args, **kwargs)
+        except errors.FloodWaitError as e:
+            if attempt == MAX_FLOOD_WAIT_RETRIES:
+                raise
+            logging.warning(
+                f"[-] Telegram requires waiting {e.seconds} second(s) (FloodWaitError). Slowing down API calls"
+            )
+            _on_flood_wait(limiters, e.seconds)
+            throttle()
+            continue
+
+        # FloodWaits slept by Telethon are already recorded, and are not slow responses
+        latency: float = max(
+            0, time.monotonic() - start_time - getattr(_connection, "flood_slept", 0)
+        )
+        for limiter in limiters:
+            limiter.on_success(latency)
+        metrics.count("api_calls")
+        metrics.observe("api_call", latency)
+        return result
+
+
+def get_summary() -> list[str]:
+    """
+    Summarizes the state of every rate limiter, for logging at the end of a run.
+
+    Returns:
+        One line of summary per rate limiter.
+    """
+    with _limiters_lock:
+        limiters: list[RateLimiter] = list(_limiters.values())
+
+    return [
+        f"Rate limiter '{limiter.key}': "
+        f"{'{:.2f}'.format(limiter.rate * 60)} calls/min, "
+        f"{limiter.calls} calls, "
+        f"{'{:.1f}'.format(limiter.waited_seconds)} second(s) waited, "
+        f"{limiter.flood_waits} FloodWaits ({limiter.flood_wait_seconds} second(s))"
+        for limiter in limiters
+    ]
@@ -0,0 +1,197 @@
+"""
+Schedules the entities to collect messages from by their expected yield.
+
+Rather than collecting entities in dialogs order, entities are ranked by how much new data
+they are expected to yield, so that the busiest entities are collected first and quiet or
+dead entities do not consume the run's budget. The expected yield of an entity is based on:
+- The number of new messages since the latest collection (known exactly for channels from
+  the dialog's top message id, otherwise estimated from the unread messages count, which
+  is only a lower bound)
+- The historical number of IOCs per message collected in the entity
+- The time since a collection of the entity last returned new messages
+
+An optional per-run budget of API calls is then shared between the ranked entities in
+proportion to their expected yield.
+"""
+
+import logging
+import math
+import time
+
+from telethon.types import *
+
+from helper.db import messages_collection_get_stats
+from helper.dialogs import DialogSnapshot
+
+CHUNK_SIZE: int = 500  # Number of messages retrieved per API call (see scrape_messages.py)
+IOC_WEIGHT: float = 10.0  # Weight of the IOCs per message ratio in an entity's score
+DECAY_DAYS: float = 7.0  # Halves the score of entities with no new messages in this many days
+
+
+class ScheduledDialog:
+    """
+    A dialog ranked by the scheduler.
+
+    Attributes:
+        dialog: the dialog to collect from
+        expected_messages: estimated number of new messages since the latest collection
+        score: expected yield of the dialog, higher is collected first
+    """
+
+    __slots__ = ("dialog", "expected_messages", "score")
+
+    def __init__(self, dialog: DialogSnapshot, expected_messages: int, score: float):
+        self.dialog = dialog
+        self.expected_messages = expected_messages
+        self.score = score
+
+
+class Scheduler:
+    """
+    Ranks dialogs by expected yield and allocates the run's API calls budget between them.
+
+    Example usage:
+    ```
+    scheduler = Scheduler(get_dialogs(client), api_budget=200, time_budget=3600)
+    for scheduled in scheduler.ranked:
+        if scheduler.exhausted():
+            break
+        max_api_calls = scheduler.allocate(scheduled.dialog)
+        if max_api_calls == 0:
+            continue
+        scrape_messages.scrape(client, scheduled.dialog.entity, max_api_calls)
+    ```
+    """
+
+    def __init__(
+        self,
+        dialogs: list[DialogSnapshot],
+        api_budget: int | None = None,
+        time_budget: int | None = None,
+    ):
+        """
+        Args:
+            dialogs: dialogs to rank
+            api_budget (optional): max number of messages API calls in this run
+            time_budget (optional): max number of seconds to spend starting new collections
+        """
+        self.api_budget: int | None = api_budget
+        self.time_budget: int | None = time_budget
+        self.start_time: float = time.time()
+        self.ranked: list[ScheduledDialog] = _rank(dialogs)
+        self._scheduled: dict[int, ScheduledDialog] = {
+            s.dialog.entity.id: s for s in self.ranked
+        }
+        self._remaining_score: float = sum(s.score for s in self.ranked)
+
+    def exhausted(self) -> bool:
+        """
+        Returns True if the run's API calls or time budget has been used up.
+        """
+        if self.api_budget is not None and self.api_budget <= 0:
+            logging.info(f"API calls budget of this run has been used up")
+            return True
+        if (
+            self.time_budget is not None
+            and time.time() - self.start_time >= self.time_budget
+        ):
+            logging.info(f"Time budget of {self.time_budget} second(s) has been used up")
+            return True
+        return False
+
+    def allocate(self, dialog: DialogSnapshot) -> int | None:
+        """
+        Allocates API calls to a dialog from the remaining budget, in proportion to the
+        dialog's share of the remaining expected yield. At least one API call is allocated
+        to a dialog with new messages, and never more than a channel needs (the new
+        messages of other entities are not known exactly).
+
+        Args:
+            dialog: the ranked dialog about to be collected
+
+        Returns:
+            Max number of API calls to make for this dialog, 0 to skip the dialog,
+            or None if there is no limit (always, without an API calls budget).
+        """
+        scheduled: ScheduledDialog = self._scheduled[dialog.entity.id]
+        needed_calls: int | None = (
+            math.ceil(scheduled.expected_messages / CHUNK_SIZE) + 1
+            if _counts_exactly(dialog)
+            else None
+        )
+        share: float = (
+            scheduled.score / self._remaining_score if self._remaining_score > 0 else 0
+        )
+        self._remaining_score -= scheduled.score
+
+        if scheduled.expected_messages == 0:
+            return 0
+        if self.api_budget is None:
+            return None
+
+        calls: int = max(1, math.floor(self.api_budget * share))
+        if needed_calls is not None:
+            calls = min(calls, needed_calls)
+        calls = min(calls, self.api_budget)
+        self.api_budget -= calls
+
+        return calls
+
+
+def _counts_exactly(dialog: DialogSnapshot) -> bool:
+    """
+    Returns True if the number of new messages of a dialog is known exactly, which is
+    only the case for channels: message ids are sequential within a channel, but not
+    within chats and direct messages.
+    """
+    return type(dialog.entity) is Channel and bool(dialog.top_message_id)
+
+
+def _rank(dialogs: list[DialogSnapshot]) -> list[ScheduledDialog]:
+    """
+    Ranks dialogs by their expected yield, highest first.
+
+    Args:
+        dialogs: dialogs to rank
+
+    Returns:
+        The list of ranked dialogs.
+    """
+    now: float = time.time()
+    stats: dict[int, tuple] = messages_collection_get_stats()
+
+    ranked: list[ScheduledDialog] = []
+    for dialog in dialogs:
+        last_offset_id, avg_messages, avg_iocs, last_new_timestamp = stats.get(
+            dialog.entity.id, (None, None, None, None)
+        )
+
+        # Estimate the number of new messages since the latest collection
+        expected_messages: int | None = None  # Unknown
+        if _counts_exactly(dialog):
+            expected_messages = max(0, dialog.top_message_id - (last_offset_id or 0))
+        elif dialog.unread_count > 0:
+            expected_messages = dialog.unread_count
+
+        # Entities with more IOCs per message are more valuable
+        ioc_rate: float = avg_iocs / avg_messages if avg_messages and avg_iocs else 0
+        score: float = (
+            expected_messages if expected_messages is not None else avg_messages or 0
+        ) * (1 + IOC_WEIGHT * ioc_rate)
+
+        # Entities that have been quiet for a long time are less likely to yield new data
+        if last_new_timestamp is not None:
+            days_quiet: float = max(0, now - last_new_timestamp) / 86400
+            score /= 1 + days_quiet / DECAY_DAYS
+
+        ranked.append(ScheduledDialog(dialog, expected_messages, score))
+
+    ranked.sort(key=lambda s: s.score, reverse=True)  # Stable sort keeps dialogs order on ties
+
+    for scheduled in ranked:
+        logging.debug(
+            f"Scheduled {scheduled.dialog.entity.id}: "
+            f"score {'{:.2f}'.format(scheduled.score)}, expected messages {scheduled.expected_messages}"
+        )
+
+    return ranked
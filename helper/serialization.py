@@ -0,0 +1,106 @@
+"""
+JSON serialization backend, used for every record written to disk or sent to Elasticsearch.
+
+orjson is used when installed (`pip install orjson`): it serializes several times faster
+than the standard library and handles datetime objects natively. Otherwise, the standard
+library's json module is used with helper.JSONEncoder. Both backends produce the same
+values: datetimes in ISO format, and bytes as set by `--binary-encoding`.
+
+Hashes of records (i.e.: Elasticsearch ids of IOCs) must not change with the backend, so
+`dumps_canonical` always uses the standard library's encoding.
+
+Example usage:
+```
+line: str = dumps(message)
+pretty: str = dumps(message, indent=True)
+```
+"""
+
+import json
+
+from helper.helper import JSONEncoder, encode_json_default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS: tuple[str, ...] = ("orjson", "json")
+backend: str = "orjson" if orjson is not None else "json"
+
+
+def set_backend(name: str):
+    """
+    Sets the serialization backend.
+
+    Args:
+        name: "orjson" or "json"
+    """
+    global backend
+    if name not in BACKENDS:
+        raise Exception(f"Unsupported serialization backend `{name}`")
+    if name == "orjson" and orjson is None:
+        raise Exception(f"Cannot use orjson. Install it with `pip install orjson`")
+    backend = name
+
+
+def available_backends() -> list[str]:
+    """
+    Returns the serialization backends that are installed.
+    """
+    return [name for name in BACKENDS if name != "orjson" or orjson is not None]
+
+
+def dumps(obj, indent: bool = False) -> str:
+    """
+    Serializes an object to a JSON string.
+
+    Args:
+        obj: the object to serialize
+        indent (optional): True to indent with 2 spaces, False for a compact string
+
+    Returns:
+        The JSON string.
+    """
+    if backend == "orjson":
+        try:
+            return orjson.dumps(
+                obj,
+                default=encode_json_default,
+                option=orjson.OPT_INDENT_2 if indent else 0,
+            ).decode("utf-8")
+        except TypeError:
+            pass  # i.e.: integers over 64 bits, only supported by the standard library
+
+    if indent:
+        return json.dumps(obj, cls=JSONEncoder, indent=2)
+    return json.dumps(obj, cls=JSONEncoder, separators=(",", ":"))
+
+
+def dumps_canonical(obj) -> bytes:
+    """
+    Serializes an object to canonical JSON bytes (sorted keys), to be hashed. Always uses
+    the standard library, so that hashes do not depend on the installed backend.
+
+    Args:
+        obj: the object to serialize
+
+    Returns:
+        The JSON bytes.
+    """
+    return json.dumps(obj, sort_keys=True, cls=JSONEncoder).encode()
+
+
+def loads(data: str | bytes):
+    """
+    Deserializes a JSON string.
+
+    Args:
+        data: the JSON string or bytes
+
+    Returns:
+        The deserialized object.
+    """
+    if backend == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
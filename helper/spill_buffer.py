@@ -0,0 +1,186 @@
+"""
+Collection buffer with a memory budget, which spills collected objects to disk.
+
+Collections keep every object returned by the Telegram API in memory until they are
+processed, so a large entity can exhaust the memory of the host. When a budget is set
+(see `--max-buffer-mb`), objects are serialized in Telegram's own binary format (TL) and
+moved to an anonymous temporary file each time the buffered objects exceed the budget.
+Iterating over the buffer reads the spilled objects back, in order, followed by the
+objects still in memory. To process the objects within the budget too, they can be read
+back in chunks of at most the budget (see `SpillBuffer.chunks`).
+
+The budget is measured on the serialized size of the objects, which is smaller than the
+memory they use once deserialized, so it should be set well below the available memory.
+Objects are only serialized once they are spilled: the size of the buffered objects is
+estimated from a sample of every `SIZE_SAMPLE_INTERVAL` objects.
+
+Example usage:
+```
+buffer = SpillBuffer(helper.max_buffer_mb * 1024 * 1024)
+try:
+    buffer.extend(client.get_messages(entity, limit=500))
+    for messages in buffer.chunks():
+        ...
+finally:
+    buffer.close()
+```
+"""
+
+import logging
+import struct
+import tempfile
+
+from telethon.extensions import BinaryReader
+from telethon.tl.tlobject import TLObject
+
+from helper.logger import SAMPLED
+
+_LENGTH = struct.Struct("<I")  # Length prefix of each spilled object
+SIZE_SAMPLE_INTERVAL: int = 20  # Number of objects per object serialized to estimate sizes
+
+
+class SpillBuffer:
+    """
+    List-like buffer of TL objects (i.e.: Message, User) that spills to a temporary file
+    once its objects exceed a number of bytes. Objects must not be added while iterating.
+    """
+
+    __slots__ = (
+        "max_bytes",
+        "_memory",
+        "_memory_bytes",
+        "_file",
+        "_spilled_count",
+    )
+
+    def __init__(self, max_bytes: int = 0):
+        """
+        Args:
+            max_bytes (optional): number of bytes of serialized objects to keep in memory
+                before spilling them to disk, 0 to never spill
+        """
+        self.max_bytes: int = max_bytes
+        self._memory: list[TLObject] = []
+        self._memory_bytes: int = 0
+        self._file = None
+        self._spilled_count: int = 0
+
+    def __len__(self) -> int:
+        return self._spilled_count + len(self._memory)
+
+    def __iter__(self):
+        if self._file is not None:
+            self._file.flush()
+            self._file.seek(0)
+            for _ in range(self._spilled_count):
+                (length,) = _LENGTH.unpack(self._file.read(_LENGTH.size))
+                yield BinaryReader(self._file.read(length)).tgread_object()
+            self._file.seek(0, 2)  # Back to the end, for the next spill
+        yield from self._memory
+
+    def extend(self, objects: list[TLObject]):
+        """
+        Adds objects to the buffer, spilling the buffered objects to disk if they exceed
+        the budget.
+
+        Args:
+            objects: objects returned by the API
+        """
+        if len(objects) == 0:
+            return
+        self._memory.extend(objects)
+        if self.max_bytes <= 0:
+            return
+
+        # Estimate the serialized size of the new objects from a sample of them
+        sample: list[TLObject] = objects[::SIZE_SAMPLE_INTERVAL]
+        self._memory_bytes += (
+            sum(len(bytes(o)) for o in sample) * len(objects) // len(sample)
+        )
+        if self._memory_bytes > self.max_bytes:
+            self._spill()
+
+    def chunks(self):
+        """
+        Reads the buffered objects back in order, in chunks whose serialized size is at
+        most the budget (or of a single object, if larger), so that only one chunk needs
+        to be in memory at a time. Without a budget, every object is in a single chunk.
+
+        Yields:
+            Lists of objects.
+        """
+        if self._file is not None:
+            self._file.flush()
+            self._file.seek(0)
+            chunk: list[TLObject] = []
+            chunk_bytes: int = 0
+            for _ in range(self._spilled_count):
+                (length,) = _LENGTH.unpack(self._file.read(_LENGTH.size))
+                if len(chunk) > 0 and chunk_bytes + length > self.max_bytes:
+                    yield chunk
+                    chunk, chunk_bytes = [], 0
+                chunk.append(BinaryReader(self._file.read(length)).tgread_object())
+                chunk_bytes += length
+            if len(chunk) > 0:
+                yield chunk
+            self._file.seek(0, 2)  # Back to the end, for the next spill
+        # Objects in memory are within the budget, or there is no budget
+        if len(self._memory) > 0:
+            yield self._memory
+
+    def to_dicts(self) -> "_DictsView":
+        """
+        Converts the buffered objects to dictionaries one at a time, as they are iterated,
+        rather than all at once.
+
+        Returns:
+            A view of the buffer, with a length, that yields dictionaries.
+        """
+        return _DictsView(self)
+
+    def close(self):
+        """
+        Releases the buffered objects and deletes the temporary file, if any.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._memory = []
+        self._memory_bytes = 0
+        self._spilled_count = 0
+
+    def _spill(self):
+        """
+        Moves the objects in memory to the temporary file, creating it on first use.
+        """
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="spill_")
+        for o in self._memory:
+            data: bytes = bytes(o)
+            self._file.write(_LENGTH.pack(len(data)))
+            self._file.write(data)
+        self._spilled_count += len(self._memory)
+        logging.info(
+            f"Buffered objects exceeded {self.max_bytes} bytes. Spilled {len(self._memory)} objects to disk ({self._spilled_count} in total)",
+            extra=SAMPLED,
+        )
+        self._memory = []
+        self._memory_bytes = 0
+
+
+class _DictsView:
+    """
+    View of a SpillBuffer that converts its objects to dictionaries as they are iterated.
+    """
+
+    __slots__ = ("_buffer",)
+
+    def __init__(self, buffer: SpillBuffer):
+        self._buffer: SpillBuffer = buffer
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def __iter__(self):
+        for o in self._buffer:
+            yield o.to_dict()
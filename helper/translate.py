@@ -9,13 +9,12 @@ sensitive data from various groups. As such, it is in the user's best interest t
 data private from translation services' servers.
 """
 
+import functools
 import logging
 
-import argostranslate.apis
-import argostranslate.argospm
-import argostranslate.package
-import argostranslate.translate
-from lingua import Language, LanguageDetectorBuilder
+# NOTE: argostranslate (which loads ctranslate2, stanza and torch) and lingua are imported
+# within the functions that use them, as importing them takes several seconds and hundreds
+# of MB of RAM. Collections that never translate a message do not pay that cost.
 
 
 def translate(text: str) -> str | None:
@@ -33,6 +32,9 @@ def translate(text: str) -> str | None:
     if text is None or text == "":
         return None
 
+    import argostranslate.translate
+    from lingua import Language
+
     # Attempt to detect the ISO 639 code of the source language (e.g. "en" for English)
     # NOTE: Feel free to add/remove languages from this list as needed
     languages_to_detect = [
@@ -56,9 +58,7 @@ def translate(text: str) -> str | None:
     # languages_to_detect_code = [x.iso_code_639_1.name.lower() for x in Language.all()]  # ['en', 'fr',...] all 75 langs
 
     # Detect language
-    detector = LanguageDetectorBuilder.from_languages(*languages_to_detect).build()  # Detect listed languages
-    # detector = LanguageDetectorBuilder.from_all_languages().with_preloaded_language_models().build()  # Detect all languages available in the library (eager loading)
-    # detector = LanguageDetectorBuilder.from_all_languages().build()  # Detect all languages available in the library (lazy loading)
+    detector = _get_language_detector(tuple(languages_to_detect))
     language_detected = detector.detect_language_of(text)
 
     if language_detected is None:
@@ -100,19 +100,54 @@ def translate(text: str) -> str | None:
         #     install_language(from_code)
 
     # Translate text
-    logging.debug(f"Translating: ", text)
+    logging.debug(f"Translating: {text}")
     translatedText = argostranslate.translate.translate(text, from_code, to_code)
 
     return translatedText
 
 
-def get_installed_languages() -> list[argostranslate.translate.Language]:
+def translate_texts(texts: list[str]) -> list[str | None]:
+    """
+    Translates several pieces of text to English (see `translate`), i.e.: a chunk of texts
+    sent to a worker process at once.
+
+    Args:
+        texts: the texts to be translated into English
+
+    Returns:
+        The texts translated into English, None for texts already in English.
+    """
+    return [translate(text) for text in texts]
+
+
+@functools.lru_cache(maxsize=None)
+def _get_language_detector(languages_to_detect: tuple["Language"]):
+    """
+    Builds a language detector for the given languages once per process and reuses it,
+    as building a detector loads the language models of every listed language.
+
+    Args:
+        languages_to_detect: languages that the detector can detect
+
+    Returns:
+        The language detector.
+    """
+    from lingua import LanguageDetectorBuilder
+
+    return LanguageDetectorBuilder.from_languages(*languages_to_detect).build()  # Detect listed languages
+    # return LanguageDetectorBuilder.from_all_languages().with_preloaded_language_models().build()  # Detect all languages available in the library (eager loading)
+    # return LanguageDetectorBuilder.from_all_languages().build()  # Detect all languages available in the library (lazy loading)
+
+
+def get_installed_languages() -> list["argostranslate.translate.Language"]:
     """
     Lists languages that have been installed locally and can be translated offline.
 
     Returns:
         List of languages that can be translated locally.
     """
+    import argostranslate.translate
+
     languages = argostranslate.translate.get_installed_languages()
     # Print the list of installed languages
     # print(f"Number of languages installed: {len(languages)}")
@@ -137,6 +172,8 @@ def install_language(from_code: str):
         return
     to_code = "en"
 
+    import argostranslate.package
+
     # Download and install Argos Translate package
     argostranslate.package.update_package_index()
     available_packages = argostranslate.package.get_available_packages()
@@ -160,6 +197,8 @@ def install_all_languages():
     Args:
         from_code: the ISO 639 code of the source language (e.g. "en" for English)
     """
+    import argostranslate.argospm
+
     argostranslate.argospm.install_all_packages()
 
 
@@ -0,0 +1,171 @@
+"""
+Coordinates worker processes that collect from a shared queue of entities.
+
+Several worker processes, each logged in to its own Telegram account (session), can collect
+at the same time. Entities are queued in the local database, and each worker claims one
+entity at a time with a time-limited lease. While the worker collects from the entity, a
+heartbeat thread keeps renewing the lease. If a worker crashes, its lease expires and the
+entity is claimed again by another worker.
+
+A worker that loses its lease (i.e.: it was paused for longer than the lease, and another
+worker claimed the entity) must stop collecting from the entity, so that two workers never
+write the same entity's output and offsets. The collection calls `check_lease` before
+writing, which raises `LeaseLostError` once the lease is lost.
+
+Example usage:
+```
+worker_id = get_worker_id(PHONE_NUMBER)
+work_queue_enqueue(entity_ids)
+while (entity_id := work_queue_claim(worker_id, entity_ids, start, LEASE_SECONDS)) is not None:
+    with EntityLease(worker_id, entity_id):
+        ...  # Collect from the entity
+```
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+
+from helper.db import work_queue_release, work_queue_renew
+
+LEASE_SECONDS: int = 300  # Seconds before a lease expires unless renewed by a heartbeat
+
+# Lease of the entity being collected by this worker, None outside of worker mode
+_current_lease: "EntityLease | None" = None
+
+
+class LeaseLostError(Exception):
+    """
+    Raised when a worker no longer holds the lease on the entity it collects from.
+    """
+
+
+def check_lease(renew: bool = True):
+    """
+    Checks that the worker still holds the lease on the entity being collected, if any.
+    Does nothing outside of worker mode.
+
+    Args:
+        renew (optional): True to confirm the lease with the work queue, renewing it
+            (i.e.: before writing output or offsets), False to only check whether the
+            heartbeat lost it. Default True.
+
+    Raises:
+        LeaseLostError: if the lease was lost
+    """
+    if _current_lease is not None:
+        _current_lease.check(renew)
+
+
+def get_worker_id(account: str) -> str:
+    """
+    Generates an id that is unique to the current worker process.
+
+    Args:
+        account: the phone number (or any name) of the account used by the worker
+
+    Returns:
+        The worker id, i.e. "+12223334444:1234@hostname"
+    """
+    return f"{account}:{os.getpid()}@{socket.gethostname()}"
+
+
+class EntityLease:
+    """
+    Keeps a worker's lease on an entity alive while the entity is being collected, and
+    releases the lease when done. The entity is marked as completed only if no exception
+    was raised.
+
+    The lease is lost if a renewal finds that another worker holds it, or if it was not
+    renewed for a whole lease period (i.e.: the database could not be written).
+    """
+
+    def __init__(self, worker_id: str, entity_id: int, lease_seconds: int = LEASE_SECONDS):
+        """
+        Args:
+            worker_id: unique id of the worker holding the lease
+            entity_id: id of the leased entity
+            lease_seconds (optional): number of seconds a heartbeat extends the lease by
+        """
+        self.worker_id: str = worker_id
+        self.entity_id: int = entity_id
+        self.lease_seconds: int = lease_seconds
+        self._stopped: threading.Event = threading.Event()
+        self._lost: threading.Event = threading.Event()
+        self._renewed_time: float = time.monotonic()
+        self._heartbeat: threading.Thread = threading.Thread(
+            target=self._run_heartbeat, daemon=True
+        )
+
+    def __enter__(self) -> "EntityLease":
+        global _current_lease
+        logging.info(f"[+] Worker {self.worker_id} leased entity {self.entity_id}")
+        self._renewed_time = time.monotonic()
+        self._heartbeat.start()
+        _current_lease = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _current_lease
+        _current_lease = None
+        self._stopped.set()
+        self._heartbeat.join()
+        # Only the worker holding the lease releases it. A lost lease is never completed
+        work_queue_release(
+            self.worker_id, self.entity_id, exc_type is None and not self.lost()
+        )
+        logging.info(f"[+] Worker {self.worker_id} released entity {self.entity_id}")
+
+    def lost(self) -> bool:
+        """
+        Returns True if the lease was lost.
+        """
+        if (
+            not self._lost.is_set()
+            and time.monotonic() - self._renewed_time >= self.lease_seconds
+        ):
+            self._set_lost("it was not renewed in time")
+        return self._lost.is_set()
+
+    def check(self, renew: bool = True):
+        """
+        Raises LeaseLostError if the lease was lost (see `check_lease`).
+        """
+        if renew and not self.lost():
+            self._renew()
+        if self.lost():
+            raise LeaseLostError(
+                f"Worker {self.worker_id} lost its lease on entity {self.entity_id}"
+            )
+
+    def _renew(self):
+        """
+        Extends the lease, or marks it as lost if another worker holds it.
+        """
+        renewed_time: float = time.monotonic()
+        if work_queue_renew(self.worker_id, self.entity_id, self.lease_seconds):
+            self._renewed_time = max(self._renewed_time, renewed_time)
+        else:
+            self._set_lost("another worker holds it")
+
+    def _set_lost(self, reason: str):
+        if not self._lost.is_set():
+            self._lost.set()
+            logging.warning(
+                f"[-] Worker {self.worker_id} lost its lease on entity {self.entity_id}: {reason}"
+            )
+
+    def _run_heartbeat(self):
+        """
+        Renews the lease three times per lease period until the lease is released or
+        lost. Failed renewals are retried at the next heartbeat, until the lease expires.
+        """
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                self._renew()
+            except Exception as e:
+                logging.exception(msg=e, exc_info=True)
+            if self.lost():
+                return
@@ -0,0 +1,312 @@
+"""
+Re-enriches previously collected messages offline, using every core of the machine.
+
+Walks the output folders of previous collections for messages files (i.e.:
+`output/<timestamp>/<entity>/messages_<id>.json`, in any output format) and re-runs the
+enrichment of each message with the current IOC patterns and translation models. Each file
+is streamed and re-enriched by a pool of worker processes, one file per worker.
+
+The re-enriched messages and their IOCs are written to a separate output folder, with the
+same layout as the input folder, as JSON files. Input files are skipped if they were already re-enriched
+with the same content and the same enrichment (IOC patterns and translation setting), so
+an interrupted run can simply be restarted. The log files of each run are written to
+`<output folder>/logs/<timestamp>/`.
+
+Example usage:
+```
+python reprocess.py
+python reprocess.py --input-dir output/2024-03-18T04-21-06Z --skip-translation --export-to-es
+```
+"""
+
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from helper import logger, output_format, serialization
+from helper.db import reprocessed_files_get, reprocessed_files_upsert, start_database
+from helper.es import index_json_file_to_es
+from helper.logger import configure_logging
+
+# Messages files, optionally downloaded in several numbered parts (i.e.: messages_123_0.json)
+# and segments (i.e.: messages_123_0_seg0001.json)
+MESSAGES_FILE_PATTERN: re.Pattern = re.compile(
+    r"^messages_-?\d+(_\d+)?(_seg\d+)?("
+    + "|".join(re.escape(extension) for extension in output_format.FORMATS.values())
+    + ")$"
+)
+IOC_PATTERNS_PATH: str = "helper/ioc.py"
+LOGS_DIR: str = "logs"  # Folder of the log files of each run, in the output folder
+
+###########################################################################################
+# Create the ArgumentParser object to parse command line arguments
+parser = argparse.ArgumentParser(
+    description=f"Re-enriches previously collected messages with the current IOC patterns and translation models."
+)
+parser.add_argument(
+    "--input-dir",
+    default="output",
+    help="Folder of previous collections to re-enrich (default 'output')",
+)
+parser.add_argument(
+    "--output-dir",
+    default="output_reprocessed",
+    help="Folder to write the re-enriched messages and IOCs to (default 'output_reprocessed')",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=os.cpu_count(),
+    help=f"Number of worker processes (default {os.cpu_count()}, the number of CPUs)",
+)
+parser.add_argument(
+    "--skip-translation",
+    action="store_true",
+    default=False,
+    help="Only re-extract IOCs, keeping existing translations (default False)",
+)
+parser.add_argument(
+    "--retranslate",
+    action="store_true",
+    default=False,
+    help="Translate messages again even if they were already translated (default False)",
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    default=False,
+    help="Re-enrich every file, even if it was already re-enriched (default False)",
+)
+parser.add_argument(
+    "--export-to-es",
+    action="store_true",
+    default=False,
+    help="Index the re-enriched messages and IOCs into Elasticsearch (default False)",
+)
+parser.add_argument(
+    "--debug",
+    action="store_true",
+    default=False,
+    help="Enable debug mode (default False)",
+)
+
+###########################################################################################
+
+
+def get_enrichment_version(translation: str) -> str:
+    """
+    Generates the version of the enrichment, which changes whenever the IOC patterns or
+    the translation setting change.
+
+    Args:
+        translation: translation setting ("skip", "missing" or "all")
+
+    Returns:
+        The enrichment version.
+    """
+    with open(IOC_PATTERNS_PATH, "rb") as file:
+        ioc_patterns_hash: str = hashlib.sha256(file.read()).hexdigest()
+    return f"{ioc_patterns_hash[:16]}-{translation}"
+
+
+def find_messages_files(input_dir: str, output_dir: str) -> list[str]:
+    """
+    Finds every messages file in the input folder, in any output format.
+
+    Args:
+        input_dir: folder of previous collections
+        output_dir: folder of the re-enriched files, which is never used as input
+
+    Returns:
+        The list of paths of messages files, sorted.
+    """
+    output_dir = os.path.abspath(output_dir)
+    return sorted(
+        path
+        for path in glob.glob(f"{input_dir}/**/messages_*", recursive=True)
+        if MESSAGES_FILE_PATTERN.match(os.path.basename(path))
+        and not os.path.abspath(path).startswith(output_dir + os.sep)
+    )
+
+
+def _hash_file(path: str) -> str:
+    """
+    Computes the SHA256 hash of a file, reading it in blocks.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _reprocess_file(task: tuple) -> tuple:
+    """
+    Re-enriches a messages file. Function to be executed in parallel.
+
+    Args:
+        task: tuple of (input path, output path, translation setting, content hash of
+            the input file when it was last re-enriched or None)
+
+    Returns:
+        A tuple of (input path, content hash, paths of the messages and IOCs output files,
+        number of messages, number of IOCs). The output paths are None if the file was
+        skipped because its content has not changed.
+    """
+    # Imported here so that each worker process loads the collection modules only once
+    from scrape_messages import _extract_iocs, _translate_message
+
+    input_path, output_path, translation, previous_hash = task
+    content_hash: str = _hash_file(input_path)
+    if content_hash == previous_hash:
+        return input_path, content_hash, None, None, 0, 0
+
+    iocs_output_path: str = os.path.join(
+        os.path.dirname(output_path),
+        os.path.basename(output_path).replace("messages_", "iocs_", 1),
+    )
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    # Stream messages in and out, so that large files are never fully loaded in memory
+    # Outputs are written to temporary files, then renamed once complete
+    messages_count: int = 0
+    iocs_count: int = 0
+    with open(f"{output_path}.tmp", "w", encoding="utf-8") as messages_file, open(
+        f"{iocs_output_path}.tmp", "w", encoding="utf-8"
+    ) as iocs_file:
+        messages_file.write("[")
+        iocs_file.write("[")
+        for message in output_format.read(input_path):
+            if message.get("message"):
+                if translation == "all" or (
+                    translation == "missing" and not message.get("message_translated")
+                ):
+                    translated: str | None = _translate_message(message)
+                    if translated:
+                        message["message_translated"] = translated
+
+                for ioc in _extract_iocs(message):
+                    iocs_file.write(
+                        f"{',' if iocs_count else ''}\n{serialization.dumps(ioc)}"
+                    )
+                    iocs_count += 1
+
+            messages_file.write(
+                f"{',' if messages_count else ''}\n{serialization.dumps(message)}"
+            )
+            messages_count += 1
+        messages_file.write("\n]\n")
+        iocs_file.write("\n]\n")
+
+    os.replace(f"{output_path}.tmp", output_path)
+    os.replace(f"{iocs_output_path}.tmp", iocs_output_path)
+
+    return (
+        input_path,
+        content_hash,
+        output_path,
+        iocs_output_path,
+        messages_count,
+        iocs_count,
+    )
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    start_time = time.time()
+    start_database()
+    # Logs are written with the re-enriched files, never into the folders read as input
+    logger.set_output_dir(
+        f"{args.output_dir}/{LOGS_DIR}/{logger.DATETIME_CODE_EXECUTED}"
+    )
+    os.makedirs(logger.OUTPUT_DIR, exist_ok=True)
+    configure_logging(args.debug)
+
+    translation: str = (
+        "skip" if args.skip_translation else "all" if args.retranslate else "missing"
+    )
+    enrichment_version: str = get_enrichment_version(translation)
+    logging.info(f"Set input folder                 : {args.input_dir}")
+    logging.info(f"Set output folder                : {args.output_dir}")
+    logging.info(f"Set number of worker processes   : {args.workers}")
+    logging.info(f"Set translation                  : {translation}")
+    logging.info(f"Set export data to Elasticsearch : {args.export_to_es}")
+    logging.info(f"Enrichment version               : {enrichment_version}")
+
+    input_paths: list[str] = find_messages_files(args.input_dir, args.output_dir)
+    reprocessed_files: dict[str, tuple] = {} if args.force else reprocessed_files_get()
+    tasks: list[tuple] = []
+    for input_path in input_paths:
+        previous_hash, previous_version = reprocessed_files.get(input_path, (None, None))
+        tasks.append(
+            (
+                input_path,
+                os.path.join(
+                    args.output_dir,
+                    output_format.strip_extension(
+                        os.path.relpath(input_path, args.input_dir)
+                    )
+                    + output_format.FORMATS["json"],
+                ),
+                translation,
+                previous_hash if previous_version == enrichment_version else None,
+            )
+        )
+    logging.info(f"[+] Re-enriching {len(tasks)} messages files")
+
+    files_reprocessed: int = 0
+    files_skipped: int = 0
+    files_failed: int = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=logger.configure_worker_logging,
+        initargs=logger.get_worker_initargs(),
+    ) as executor:
+        futures = {executor.submit(_reprocess_file, task): task[0] for task in tasks}
+        for future in as_completed(futures):
+            try:
+                (
+                    input_path,
+                    content_hash,
+                    output_path,
+                    iocs_output_path,
+                    messages_count,
+                    iocs_count,
+                ) = future.result()
+            except Exception as e:
+                logging.error(f"[-] Failed to re-enrich {futures[future]}: {e}")
+                files_failed += 1
+                continue
+
+            if output_path is None:
+                logging.debug(f"Skipping unchanged file {input_path}")
+                files_skipped += 1
+                continue
+
+            logging.info(
+                f"Re-enriched {messages_count} messages with {iocs_count} IOCs: {input_path}"
+            )
+            if args.export_to_es:
+                index_json_file_to_es(output_path, "messages_index")
+                index_json_file_to_es(iocs_output_path, "iocs_index")
+
+            # Checkpoint: the file is skipped if the run is restarted
+            reprocessed_files_upsert(
+                input_path, content_hash, enrichment_version, int(time.time())
+            )
+            files_reprocessed += 1
+
+    logging.info(
+        f"=========================================================================="
+    )
+    logging.info(f"Re-enrichment completed!")
+    logging.info(
+        f"Files re-enriched: {files_reprocessed}, skipped: {files_skipped}, failed: {files_failed}"
+    )
+    logging.info(f"Total elapsed time: {'{:.6f}'.format(time.time() - start_time)} seconds")
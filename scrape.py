@@ -1,22 +1,55 @@
 import argparse
 import logging
 import os
+import sys
 import time
 
+from helper import import_profiler
+
+# Enabled before any other module is imported, so that every import is timed
+if "--profile-startup" in sys.argv:
+    import_profiler.enable()
+
+from telethon import TelegramClient
 from telethon.types import *
 
 import scrape_entities
 import scrape_messages
 import scrape_participants
 from configs import PHONE_NUMBER
-from helper import helper
-from helper.db import start_database
+from helper import (
+    archive,
+    columnar,
+    helper,
+    logger,
+    metrics,
+    output_format,
+    profiler,
+    proxy_pool,
+    rate_limiter,
+    serialization,
+)
+from helper.db import (
+    messages_collection_get_offset_id,
+    start_database,
+    work_queue_claim,
+    work_queue_enqueue,
+)
+from helper.dialogs import DialogSnapshot, get_dialogs
+from helper.dialogs import invalidate as invalidate_dialogs
 from helper.helper import (
     TelegramClientContext,
     get_entity_info,
     update_argument_variables,
 )
-from helper.logger import OUTPUT_DIR, configure_logging
+from helper.logger import configure_logging, set_output_subdir
+from helper.work_queue import LEASE_SECONDS, EntityLease, check_lease, get_worker_id
+from helper.scheduler import Scheduler
+
+import_profiler.mark("imports")
+
+DIALOGS_REFRESH_INTERVAL: int = 900  # Seconds between re-enumerating entities in daemon mode
+RUN_REPORT_FILE_NAME: str = "run_report.json"  # Metrics report, see helper/metrics.py
 
 ###########################################################################################
 # Create the ArgumentParser object to parse command line arguments
@@ -41,6 +74,13 @@ parser.add_argument(
     help="Collect all messages in an entity, optionally specify max messages to collect as a multiple of 500",
 )
 
+parser.add_argument(
+    "--backfill-segments",
+    type=int,
+    default=helper.backfill_segments,
+    metavar="SEGMENTS",
+    help="Collect the uncollected history of channels in SEGMENTS id ranges in parallel, one client per configured proxy (default 0, disabled)",
+)
 parser.add_argument(
     "--get-participants",
     action="store_true",
@@ -49,12 +89,81 @@ parser.add_argument(
 parser.add_argument(
     "--get-entities", action="store_true", help="Collect all entities' metadata"
 )
+parser.add_argument(
+    "--all-entities",
+    action="store_true",
+    default=helper.all_entities,
+    help=f"With --get-entities, export all entities' metadata rather than only new or changed entities (default {helper.all_entities})",
+)
 parser.add_argument(
     "--max-entities",
     type=int,
     default=None,
     help="Number of entities to collect from (most recent first)",
 )
+parser.add_argument(
+    "--schedule",
+    action="store_true",
+    default=False,
+    help="Collect entities with the most expected new messages and IOCs first, rather than most recent first (default False)",
+)
+parser.add_argument(
+    "--api-budget",
+    type=int,
+    default=None,
+    metavar="API_CALLS",
+    help="With --schedule, max number of messages API calls to share between entities by expected yield (default no limit)",
+)
+parser.add_argument(
+    "--time-budget",
+    type=int,
+    default=None,
+    metavar="SECONDS",
+    help="With --schedule, stop starting new entity collections after this many seconds (default no limit)",
+)
+parser.add_argument(
+    "--daemon",
+    action="store_true",
+    default=False,
+    help="Keep running and poll each entity on its own interval until interrupted (default False)",
+)
+parser.add_argument(
+    "--worker",
+    action="store_true",
+    default=False,
+    help="Run as one of several worker processes sharing the entities to collect through app.db, each with its own account (default False)",
+)
+parser.add_argument(
+    "--account",
+    type=str,
+    default=None,
+    metavar="PHONE_NUMBER",
+    help="Phone number of the Telegram account to log in with (default PHONE_NUMBER in configs.py)",
+)
+parser.add_argument(
+    "--session",
+    type=str,
+    default=None,
+    metavar="SESSION_NAME",
+    help="Name of the Telegram session file, one per account (default 'anon', or 'anon_<phone number>' with --account)",
+)
+parser.add_argument(
+    "--live",
+    nargs="?",
+    const=5,
+    default=None,
+    type=int,
+    metavar="FLUSH_SECONDS",
+    help="After collecting messages, keep listening for new messages pushed by Telegram and process them every FLUSH_SECONDS (default 5) until interrupted",
+)
+parser.add_argument(
+    "--poll-interval",
+    nargs=2,
+    type=int,
+    default=[60, 3600],
+    metavar=("MIN_SECONDS", "MAX_SECONDS"),
+    help="With --daemon, min. and max. seconds between polls of an entity, adapted to its activity (default min: 60, default max: 3600)",
+)
 parser.add_argument(
     "--throttle-time",
     nargs=2,
@@ -75,6 +184,100 @@ parser.add_argument(
     type=int,
     help="Specify entity IDs to collect messages and participants from (i.e.: --entities <id1> <id2>  # scrapes entities with <id1> and <id2>)",
 )
+parser.add_argument(
+    "--membership-diff",
+    action="store_true",
+    default=helper.membership_diff,
+    help=f"Only record participants who joined or left since the previous participants collection (default {helper.membership_diff})",
+)
+parser.add_argument(
+    "--parallel-participants",
+    action="store_true",
+    default=helper.parallel_participants,
+    help=f"Resolve participants in parallel with one Telegram client per configured proxy (default {helper.parallel_participants})",
+)
+parser.add_argument(
+    "--dialogs-ttl",
+    type=int,
+    default=helper.dialogs_ttl,
+    metavar="SECONDS",
+    help=f"Reuse the list of entities enumerated by a previous run if it is at most SECONDS old (default {helper.dialogs_ttl}, never reuse)",
+)
+parser.add_argument(
+    "--export-parquet",
+    action="store_true",
+    default=helper.export_parquet,
+    help=f"Export flattened messages, IOCs and participants to partitioned Parquet files for analytics, requires `pip install pyarrow` (default {helper.export_parquet})",
+)
+parser.add_argument(
+    "--record",
+    action="store_true",
+    default=helper.record_responses,
+    help=f"Record the raw API responses of the collection in the local archive for offline re-processing (default {helper.record_responses})",
+)
+parser.add_argument(
+    "--replay",
+    action="store_true",
+    default=False,
+    help="Re-process messages and participants recorded in the local archive (see --record) without connecting to Telegram (default False)",
+)
+parser.add_argument(
+    "--output-format",
+    choices=list(output_format.FORMATS),
+    default=helper.output_format,
+    help=f"Format of the output files; ndjson formats are compact and streamed, ndjson-zstd requires `pip install zstandard` (default {helper.output_format})",
+)
+parser.add_argument(
+    "--segment-messages",
+    type=int,
+    default=helper.segment_messages,
+    help=f"Split messages output files into numbered segments of at most this many messages, listed in a segment index, 0 for no limit (default {helper.segment_messages})",
+)
+parser.add_argument(
+    "--segment-mb",
+    type=int,
+    default=helper.segment_mb,
+    help=f"Split messages output files into numbered segments of at most this many megabytes before compression, 0 for no limit (default {helper.segment_mb})",
+)
+parser.add_argument(
+    "--max-buffer-mb",
+    type=int,
+    default=helper.max_buffer_mb,
+    help=f"Megabytes of collected messages or participants of an entity to keep in memory before spilling them to a temporary file, measured on their serialized size, 0 for no limit (default {helper.max_buffer_mb})",
+)
+parser.add_argument(
+    "--binary-encoding",
+    choices=["repr", "base64", "sha256"],
+    default=helper.binary_encoding,
+    help=f"Encoding of binary fields in the output files: Python repr (lossy), base64 (lossless) or SHA256 hash (compact) (default {helper.binary_encoding})",
+)
+parser.add_argument(
+    "--metrics-port",
+    type=int,
+    default=None,
+    metavar="PORT",
+    help="With --daemon or --live, serve the run metrics at http://localhost:PORT/metrics in the Prometheus text format (default None, not served)",
+)
+parser.add_argument(
+    "--profile",
+    choices=list(profiler.MODES),
+    default=None,
+    help="Profile the run with cProfile (deterministic) or by sampling stacks (low overhead), writing profiles per entity into the run's output folder (default None, no profiling)",
+)
+parser.add_argument(
+    "--profile-stages",
+    nargs="+",
+    choices=list(profiler.STAGES),
+    default=None,
+    metavar="STAGE",
+    help=f"With --profile, stages to profile: {', '.join(profiler.STAGES)} (default run, the whole run)",
+)
+parser.add_argument(
+    "--profile-startup",
+    action="store_true",
+    default=False,
+    help="Log the duration of each startup phase and of the slowest module imports (default False)",
+)
 parser.add_argument(
     "--debug",
     action="store_true",
@@ -92,6 +295,50 @@ if not (args.get_messages or args.get_participants or args.get_entities):
         "Please specify at least one of the following options: --get-messages, --get-participants, --get-entities"
     )
 
+# Check that live mode is only used to collect messages
+if args.live is not None and (not args.get_messages or args.daemon):
+    parser.error("Error: --live requires --get-messages and cannot be used with --daemon.")
+
+# Check that worker mode is only used for one-shot collections
+if args.worker and (args.daemon or args.live is not None):
+    parser.error("Error: --worker cannot be used with --daemon or --live.")
+
+# Check that replay mode only re-processes recorded messages and participants
+if args.replay and (
+    args.record or args.get_entities or args.daemon or args.worker or args.live is not None
+):
+    parser.error(
+        "Error: --replay cannot be used with --record, --get-entities, --daemon, --worker or --live."
+    )
+
+# Check that the compression library of the output format is installed
+if args.output_format == "ndjson-zstd" and not output_format.zstd_available():
+    parser.error(
+        "Error: --output-format ndjson-zstd requires zstandard. Install it with `pip install zstandard`."
+    )
+
+# Check that the metrics endpoint is only served by long-running modes
+if args.metrics_port is not None and not (args.daemon or args.live is not None):
+    parser.error("Error: --metrics-port requires --daemon or --live.")
+
+# Check that profiled stages are only set when profiling
+if args.profile_stages is not None and args.profile is None:
+    parser.error("Error: --profile-stages requires --profile.")
+
+# Check that output segment sizes are valid
+if args.segment_messages < 0 or args.segment_mb < 0:
+    parser.error("Error: --segment-messages and --segment-mb cannot be negative.")
+
+# Check that the memory budget is valid
+if args.max_buffer_mb < 0:
+    parser.error("Error: --max-buffer-mb cannot be negative.")
+
+# Check that the Parquet library is installed
+if args.export_parquet and not columnar.available():
+    parser.error(
+        "Error: --export-parquet requires pyarrow. Install it with `pip install pyarrow`."
+    )
+
 # Check if throttle time is specified and contains both min and max seconds
 if args.throttle_time and (
     args.throttle_time[0] is None or args.throttle_time[1] is None
@@ -100,24 +347,40 @@ if args.throttle_time and (
         "Error: Both minimum and maximum seconds must be specified for throttle time."
     )
 
+# Account and session to log in with
+ACCOUNT: str = args.account if args.account else PHONE_NUMBER
+SESSION_NAME: str | None = args.session
+if SESSION_NAME is None and args.account:
+    SESSION_NAME = f"anon_{args.account.lstrip('+')}"
+
 # Set values of argument variables
 if args.get_messages is True:
     # Collect all messages without limit
-    update_argument_variables(
-        None, args.throttle_time[0], args.throttle_time[1], args.export_to_es
-    )
+    max_messages = None
 elif isinstance(args.get_messages, int):
     # Collect messages up to the specified limit
     max_messages = args.get_messages
-    update_argument_variables(
-        max_messages, args.throttle_time[0], args.throttle_time[1], args.export_to_es
-    )
 else:
     # --get-messages not specified, do not collect messages
     max_messages = 0
-    update_argument_variables(
-        max_messages, args.throttle_time[0], args.throttle_time[1], args.export_to_es
-    )
+update_argument_variables(
+    max_messages,
+    args.throttle_time[0],
+    args.throttle_time[1],
+    args.export_to_es,
+    args.membership_diff,
+    args.parallel_participants,
+    args.dialogs_ttl,
+    args.all_entities,
+    args.backfill_segments,
+    args.record,
+    args.output_format,
+    args.binary_encoding,
+    args.export_parquet,
+    args.segment_messages,
+    args.segment_mb,
+    args.max_buffer_mb,
+)
 
 
 ###########################################################################################
@@ -151,11 +414,20 @@ def setup() -> bool:
     try:
         # Start a new database or connect to an existing one
         start_database()
-        if not os.path.exists(OUTPUT_DIR):
-            os.makedirs(OUTPUT_DIR)
+
+        # Each worker process writes to its own output folder and log file
+        if args.worker:
+            set_output_subdir(f"worker_{ACCOUNT.lstrip('+')}_{os.getpid()}")
+        if not os.path.exists(logger.OUTPUT_DIR):
+            os.makedirs(logger.OUTPUT_DIR)
 
         # Setup logging configurations (do not run logging.* before this)
         configure_logging(args.debug)
+
+        # Profile the whole run unless stages are specified
+        if args.profile and args.profile_stages is None:
+            args.profile_stages = ["run"]
+        profiler.configure(args.profile, args.profile_stages or [])
         logging.info(f"Debug mode set to {args.debug}")
         logging.debug(f"Set arguments: {vars(args)}")
 
@@ -165,9 +437,41 @@ def setup() -> bool:
         )
         if args.get_messages:
             logging.info(f"Max number of messages to collect: {helper.max_messages}")
+            logging.info(f"Set backfill segments            : {helper.backfill_segments}")
+        if args.get_entities:
+            logging.info(f"Set export all entities metadata : {helper.all_entities}")
         logging.info(f"Set list of entities to collect  : {args.entities}")
         logging.info(f"Set maximum entities to collect  : {args.max_entities}")
+        logging.info(f"Set dialogs cache TTL (seconds)  : {helper.dialogs_ttl}")
+        logging.info(f"Set account                      : {ACCOUNT}")
+        logging.info(f"Set worker mode                  : {args.worker}")
+        logging.info(f"Set daemon mode                  : {args.daemon}")
+        if args.daemon:
+            logging.info(f"Set poll interval (seconds)      : {args.poll_interval}")
+        logging.info(f"Set live messages flush (seconds): {args.live}")
+        logging.info(f"Set metrics endpoint port        : {args.metrics_port}")
+        logging.info(f"Set profiling mode               : {args.profile}")
+        if args.profile:
+            logging.info(f"Set profiled stages              : {args.profile_stages}")
+        logging.info(f"Set schedule by expected yield   : {args.schedule}")
+        if args.schedule:
+            logging.info(f"Set messages API calls budget    : {args.api_budget}")
+            logging.info(f"Set time budget (seconds)        : {args.time_budget}")
         logging.info(f"Set export data to Elasticsearch : {helper.export_to_es}")
+        logging.info(f"Set export data to Parquet       : {helper.export_parquet}")
+        logging.info(f"Set output format                : {helper.output_format}")
+        logging.info(f"Set binary fields encoding       : {helper.binary_encoding}")
+        logging.info(f"JSON serialization backend       : {serialization.backend}")
+        logging.info(f"Set messages per output segment  : {helper.segment_messages}")
+        logging.info(f"Set megabytes per output segment : {helper.segment_mb}")
+        logging.info(f"Set collection buffer megabytes  : {helper.max_buffer_mb}")
+        logging.info(f"Set record raw API responses     : {helper.record_responses}")
+        logging.info(f"Set replay recorded responses    : {args.replay}")
+        if args.get_participants:
+            logging.info(f"Set participants membership diff : {helper.membership_diff}")
+            logging.info(
+                f"Set parallel participants        : {helper.parallel_participants}"
+            )
         logging.info(f"Set minimum API throttle time    : {helper.min_throttle}")
         logging.info(f"Set maxmimum API throttle time   : {helper.max_throttle}")
 
@@ -176,73 +480,386 @@ def setup() -> bool:
         raise
 
 
-if __name__ == "__main__":
+def write_run_report():
+    """
+    Writes the metrics report of the run (see helper/metrics.py) into the run's output
+    folder, or into the worker's output folder in worker mode.
+    """
+    report_dir: str = logger.OUTPUT_DIR if args.worker else logger.RUN_OUTPUT_DIR
+    metrics.write_report(f"{report_dir}/{RUN_REPORT_FILE_NAME}")
 
-    # Setup operations
-    start_time = time.time()  # Start of program execution to measure elapsed time
-    if setup() is not True:
-        raise "[-] Failed to setup the environment. Cannot begin collection."
 
+def collect_entity(
+    client: TelegramClient,
+    dialog: DialogSnapshot,
+    max_api_calls: int | None = None,
+):
+    """
+    Runs the collections specified in the CLI arguments on a single entity.
+
+    Args:
+        client: the Telegram client session
+        dialog: dialog of the entity to collect from
+        max_api_calls (optional): max number of messages API calls for this entity,
+            0 to skip messages collection, default None for no limit
+    """
+    entity: Channel | Chat | User = dialog.entity
+    logging.info(
+        f"=========================================================================="
+    )
+    logging.info(f"[+] Collection in progress: {get_entity_info(entity)}")
+
+    # Attribute the metrics and profiles of the collection to the entity
+    metrics.set_entity(entity.id)
     try:
-        entities_collected: int = 0  # Number of entities to collect (most recent first)
+        with profiler.stage("run"):
+            if args.get_messages and max_api_calls == 0:
+                logging.info(
+                    f"No new {scrape_messages.COLLECTION_NAME} expected. Skipping {scrape_messages.COLLECTION_NAME} collection..."
+                )
+            elif args.get_messages:
+                with metrics.timer("collect_messages"):
+                    scrape_messages.scrape(
+                        client, entity, max_api_calls, dialog.top_message_id
+                    )
+            if args.get_participants:
+                check_lease()  # Only in worker mode
+                with metrics.timer("collect_participants"):
+                    if args.get_messages:
+                        scrape_participants.scrape(client, entity, True)
+                    else:
+                        scrape_participants.scrape(client, entity, False)
 
-        # Start the Telegram client to iteract with its APIs
-        with TelegramClientContext() as client:
+        # Make the entity's Parquet files readable
+        columnar.close()
+    finally:
+        profiler.flush(entity.id)
+        metrics.set_entity(None)
 
-            # Connect to Telegram
-            client.start(PHONE_NUMBER)
 
-            # Channel, Chat, User types explained: https://stackoverflow.com/questions/76683847/telethon-same-entity-type-for-a-group-and-channel-in-telethon
-            #                                      https://docs.telethon.dev/en/stable/concepts/chats-vs-channels.html
-            # Channel (Broadcast or Public Group): channel.broadcast == True/False
-            # Chat    (Private group)            : No chat.username attribute
-            # User    (User/DM)                  : No user.title attribute
+def run_once(client: TelegramClient, entity_ids_to_scrape: set[int] | None) -> int:
+    """
+    Collects from every entity once, in dialogs order or by expected yield (--schedule).
 
-            # Iterate through all inboxes aka dialogs (DMs, public groups, private groups, broadcast channels)
-            # https://docs.telethon.dev/en/stable/quick-references/client-reference.html#dialogs
-            # https://docs.telethon.dev/en/stable/modules/client.html#telethon.client.dialogs.DialogMethods.iter_dialogs
+    Args:
+        client: the connected Telegram client session
+        entity_ids_to_scrape: IDs of the entities to collect from, None for all entities
 
-            if args.get_entities:
-                logging.info(
-                    f"=========================================================================="
-                )
-                logging.info(f"[+] Collecting metadata on all entities")
-                scrape_entities.scrape(client)
-
-            # Entity IDs from which to scrape, if specified in CLI arguments
-            entity_ids_to_scrape: set[int] | None = (
-                set(args.entities) if args.entities else None
-            )  # None means scrape all entities since no specific list of entities were provided in the CLI arguments
-
-            # Iterate through all entities that the user is in
-            for dialog in client.iter_dialogs():
-                # If the current entity/dialog is in list of entities to scape from (specified in CLI arguments)
-                #  and the number of entities do not exceed the max. number of entities to scrape from (specified in CLI arguments)
+    Returns:
+        The number of entities collected.
+    """
+    entities_collected: int = 0  # Number of entities to collect (most recent first)
+
+    # Order entities by their expected yield rather than most recent first, if specified
+    dialogs: list[DialogSnapshot] = get_dialogs(client)
+    scheduler: Scheduler | None = None
+    if args.schedule:
+        scheduler = Scheduler(
+            [
+                dialog
+                for dialog in dialogs
+                if entity_ids_to_scrape is None
+                or dialog.entity.id in entity_ids_to_scrape
+            ],
+            args.api_budget,
+            args.time_budget,
+        )
+        dialogs = [scheduled.dialog for scheduled in scheduler.ranked]
+
+    # Iterate through all entities that the user is in
+    for dialog in dialogs:
+        # If the current entity/dialog is in list of entities to scape from (specified in CLI arguments)
+        #  and the number of entities do not exceed the max. number of entities to scrape from (specified in CLI arguments)
+        if (
+            entity_ids_to_scrape is None
+            or dialog.entity.id in entity_ids_to_scrape
+        ) and not (
+            args.max_entities and entities_collected > args.max_entities
+        ):
+            # Stop once the run's budget has been used up
+            max_api_calls: int | None = None
+            if scheduler is not None:
+                if scheduler.exhausted():
+                    break
+                max_api_calls = scheduler.allocate(dialog)
+
+            entities_collected += 1
+
+            collect_entity(client, dialog, max_api_calls)
+
+            # scrape_entities.download_entity(entity)  # NOTE: Uncomment to download this entity's metadata
+
+    return entities_collected
+
+
+def run_worker(client: TelegramClient, entity_ids_to_scrape: set[int] | None) -> int:
+    """
+    Collects from entities claimed from the work queue shared with other worker processes.
+
+    The worker queues every entity its account is in, then claims entities one at a time
+    with a lease (see helper/work_queue.py) until no entity is left that has not been
+    completed by any worker since this worker started. Entities whose collection fails
+    are released for other workers and are not claimed again by this worker.
+
+    Args:
+        client: the connected Telegram client session
+        entity_ids_to_scrape: IDs of the entities to collect from, None for all entities
+
+    Returns:
+        The number of entities collected by this worker.
+    """
+    worker_id: str = get_worker_id(ACCOUNT)
+    worker_start_time: int = int(time.time())
+    entities_collected: int = 0
+
+    dialogs_by_id: dict[int, DialogSnapshot] = {
+        dialog.entity.id: dialog
+        for dialog in get_dialogs(client)
+        if entity_ids_to_scrape is None or dialog.entity.id in entity_ids_to_scrape
+    }
+    work_queue_enqueue(list(dialogs_by_id.keys()))
+    logging.info(
+        f"[+] Worker {worker_id} queued {len(dialogs_by_id)} entities shared with other workers"
+    )
+
+    while not (args.max_entities and entities_collected >= args.max_entities):
+        entity_id: int | None = work_queue_claim(
+            worker_id, list(dialogs_by_id.keys()), worker_start_time, LEASE_SECONDS
+        )
+        if entity_id is None:
+            logging.info(f"No entities left to claim")
+            break
+
+        try:
+            with EntityLease(worker_id, entity_id):
+                collect_entity(client, dialogs_by_id[entity_id])
+            entities_collected += 1
+        except Exception as e:
+            # Leave the entity to the other workers
+            logging.exception(msg=e, exc_info=True)
+            dialogs_by_id.pop(entity_id)
+
+    return entities_collected
+
+
+def run_daemon(client: TelegramClient, entity_ids_to_scrape: set[int] | None) -> int:
+    """
+    Continuously collects from entities, keeping the client connected between polls.
+
+    Each entity is polled on its own interval, between the min. and max. seconds set
+    with --poll-interval. The interval of an entity is halved when a poll collects new
+    messages and doubled when it does not, so busy entities are polled more often than
+    quiet ones. Each polling cycle writes to its own subfolder of the run's output folder.
+    The list of entities is re-enumerated every `DIALOGS_REFRESH_INTERVAL` seconds.
+
+    The daemon runs until it is interrupted (i.e.: Ctrl+C).
+
+    Args:
+        client: the connected Telegram client session
+        entity_ids_to_scrape: IDs of the entities to collect from, None for all entities
+
+    Returns:
+        The number of entity collections made.
+    """
+    min_interval, max_interval = args.poll_interval
+    poll_schedule: dict[int, list[float]] = {}  # entity id -> [next poll time, interval]
+    dialogs_refresh_time: float = time.time()
+    entities_collected: int = 0
+
+    logging.info(f"[+] Running in daemon mode. Press Ctrl+C to stop")
+    try:
+        while True:
+            # Pick up entities joined or left since the last enumeration
+            if time.time() - dialogs_refresh_time >= DIALOGS_REFRESH_INTERVAL:
+                invalidate_dialogs()
+                dialogs_refresh_time = time.time()
+                if args.get_entities:
+                    scrape_entities.scrape(client)
+
+            dialogs: list[DialogSnapshot] = [
+                dialog
+                for dialog in get_dialogs(client)
+                if entity_ids_to_scrape is None
+                or dialog.entity.id in entity_ids_to_scrape
+            ][: args.max_entities]
+
+            # Poll every entity that is due
+            now: float = time.time()
+            due_dialogs: list[DialogSnapshot] = [
+                dialog
+                for dialog in dialogs
+                if poll_schedule.get(dialog.entity.id, [0])[0] <= now
+            ]
+            if len(due_dialogs) > 0:
+                set_output_subdir(time.strftime("%Y-%m-%dT%H-%M-%SZ", time.gmtime()))
+            for dialog in due_dialogs:
+                entity_id: int = dialog.entity.id
+                interval: float = poll_schedule.get(entity_id, [0, min_interval])[1]
+
+                previous_offset_id: int = messages_collection_get_offset_id(entity_id)
+                try:
+                    collect_entity(client, dialog)
+                    entities_collected += 1
+                except Exception as e:
+                    # Keep polling the other entities; this entity is retried next poll
+                    logging.exception(msg=e, exc_info=True)
+
+                # Poll busy entities more often and quiet entities less often
                 if (
-                    entity_ids_to_scrape is None
-                    or dialog.entity.id in entity_ids_to_scrape
-                ) and not (
-                    args.max_entities and entities_collected > args.max_entities
+                    args.get_messages
+                    and messages_collection_get_offset_id(entity_id) > previous_offset_id
                 ):
-                    entities_collected += 1
+                    interval = max(min_interval, interval / 2)
+                else:
+                    interval = min(max_interval, interval * 2)
+                poll_schedule[entity_id] = [time.time() + interval, interval]
+                logging.info(f"Next poll of {entity_id} in {interval} second(s)")
+
+            # Keep the run's metrics report up to date between polls
+            if len(due_dialogs) > 0:
+                write_run_report()
+
+            # Sleep until the next entity is due
+            next_poll_time: float = min(
+                [poll_schedule.get(d.entity.id, [0])[0] for d in dialogs]
+                + [dialogs_refresh_time + DIALOGS_REFRESH_INTERVAL]
+            )
+            sleep_seconds: float = max(0, next_poll_time - time.time())
+            logging.info(f"Waiting {'{:.0f}'.format(sleep_seconds)} second(s) until the next poll")
+            time.sleep(sleep_seconds)
+    except KeyboardInterrupt:
+        logging.info(f"[+] Daemon mode interrupted. Stopping...")
+
+    return entities_collected
+
+
+def run_replay(entity_ids_to_scrape: set[int] | None) -> int:
+    """
+    Re-processes the messages and participants recorded in the local archive of raw API
+    responses (see --record), without connecting to Telegram.
 
-                    entity: Channel | Chat | User = dialog.entity
-                    logging.info(
-                        f"=========================================================================="
-                    )
-                    logging.info(
-                        f"[+] Collection in progress: {get_entity_info(entity)}"
-                    )
+    Args:
+        entity_ids_to_scrape: IDs of the entities to replay, None to replay all entities
 
-                    if args.get_messages:
-                        scrape_messages.scrape(client, entity)
-                    if args.get_participants:
-                        if args.get_messages:
-                            scrape_participants.scrape(client, entity, True)
-                        else:
-                            scrape_participants.scrape(client, entity, False)
+    Returns:
+        The number of entities replayed.
+    """
+    logging.info(f"[+] Replaying recorded API responses from '{archive.ARCHIVE_DIR}'")
+    entity_ids_replayed: set[int] = set()
+
+    if args.get_messages:
+        for entity, messages in archive.replay(
+            scrape_messages.COLLECTION_NAME, entity_ids_to_scrape
+        ):
+            logging.info(
+                f"=========================================================================="
+            )
+            logging.info(f"[+] Replaying {get_entity_info(entity)}")
+            metrics.set_entity(entity.id)
+            try:
+                with profiler.stage("run"):
+                    scrape_messages.replay(entity, messages)
+            finally:
+                profiler.flush(entity.id)
+                metrics.set_entity(None)
+            entity_ids_replayed.add(entity.id)
+
+    if args.get_participants:
+        for entity, participants in archive.replay(
+            scrape_participants.COLLECTION_NAME, entity_ids_to_scrape
+        ):
+            logging.info(
+                f"=========================================================================="
+            )
+            logging.info(f"[+] Replaying {get_entity_info(entity)}")
+            metrics.set_entity(entity.id)
+            try:
+                with profiler.stage("run"):
+                    scrape_participants.replay(entity, participants)
+            finally:
+                profiler.flush(entity.id)
+                metrics.set_entity(None)
+            entity_ids_replayed.add(entity.id)
+
+    return len(entity_ids_replayed)
+
+
+if __name__ == "__main__":
 
-                    # scrape_entities.download_entity(entity)  # NOTE: Uncomment to download this entity's metadata
+    # Setup operations
+    start_time = time.time()  # Start of program execution to measure elapsed time
+    if setup() is not True:
+        raise "[-] Failed to setup the environment. Cannot begin collection."
+    import_profiler.mark("setup")
+
+    try:
+        entities_collected: int = 0  # Number of entities collected
+
+        # Entity IDs from which to scrape, if specified in CLI arguments
+        entity_ids_to_scrape: set[int] | None = (
+            set(args.entities) if args.entities else None
+        )  # None means scrape all entities since no specific list of entities were provided in the CLI arguments
+
+        # Serve the run metrics to Prometheus, if specified
+        if args.metrics_port is not None:
+            metrics.start_server(args.metrics_port)
+
+        # Profile the run outside of entity collections, if specified
+        with profiler.stage("run"):
+            # Re-process recorded API responses without connecting to Telegram, if specified
+            if args.replay:
+                entities_collected = run_replay(entity_ids_to_scrape)
+            else:
+                # Start the Telegram client to iteract with its APIs
+                with TelegramClientContext(SESSION_NAME) as client:
+
+                    # Connect to Telegram
+                    client.start(ACCOUNT)
+                    import_profiler.mark("connecting to Telegram")
+                    import_profiler.log_report()
+
+                    # Channel, Chat, User types explained: https://stackoverflow.com/questions/76683847/telethon-same-entity-type-for-a-group-and-channel-in-telethon
+                    #                                      https://docs.telethon.dev/en/stable/concepts/chats-vs-channels.html
+                    # Channel (Broadcast or Public Group): channel.broadcast == True/False
+                    # Chat    (Private group)            : No chat.username attribute
+                    # User    (User/DM)                  : No user.title attribute
+
+                    # Iterate through all inboxes aka dialogs (DMs, public groups, private groups, broadcast channels)
+                    # https://docs.telethon.dev/en/stable/quick-references/client-reference.html#dialogs
+                    # https://docs.telethon.dev/en/stable/modules/client.html#telethon.client.dialogs.DialogMethods.iter_dialogs
+
+                    if args.get_entities:
+                        logging.info(
+                            f"=========================================================================="
+                        )
+                        logging.info(f"[+] Collecting metadata on all entities")
+                        scrape_entities.scrape(client)
+
+                    # Keep collecting until interrupted, if specified
+                    if args.daemon:
+                        entities_collected = run_daemon(client, entity_ids_to_scrape)
+                    elif args.worker:
+                        entities_collected = run_worker(client, entity_ids_to_scrape)
+                    else:
+                        entities_collected = run_once(client, entity_ids_to_scrape)
+
+                    # Listen for new messages once the history of every entity has been collected
+                    if args.live is not None:
+                        if helper.max_messages is not None:
+                            logging.warning(
+                                f"Messages collection was limited to {helper.max_messages} messages per entity. "
+                                f"Older uncollected messages will be skipped by the next collection"
+                            )
+                        scrape_messages.listen(
+                            client,
+                            [
+                                dialog.entity
+                                for dialog in get_dialogs(client)
+                                if entity_ids_to_scrape is None
+                                or dialog.entity.id in entity_ids_to_scrape
+                            ],
+                            args.live,
+                        )
 
         logging.info(
             f"=========================================================================="
@@ -250,6 +867,8 @@ if __name__ == "__main__":
         logging.info(f"Collection completed!")
         logging.info(f"Entities collected: {entities_collected}")
         logging.info(get_elapsed_time_message(start_time))
+        for rate_limiter_summary in rate_limiter.get_summary():
+            logging.info(rate_limiter_summary)
 
     except Exception as e:
         logging.exception(
@@ -257,3 +876,10 @@ if __name__ == "__main__":
             stack_info=True,
             exc_info=True,
         )
+    finally:
+        proxy_pool.close()
+        columnar.close()
+        scrape_messages.shutdown_executor()
+        profiler.close()
+        metrics.stop_server()
+        write_run_report()
@@ -2,19 +2,24 @@
 Module for scraping entities that a user is in.
 """
 
-import json
+import hashlib
 import logging
 import os
+import time
 
 from telethon import TelegramClient
 from telethon.types import *
 
-from helper import helper
+from helper import helper, logger, output_format, serialization
+from helper.db import entities_metadata_get, entities_metadata_update
+from helper.dialogs import get_dialogs
 from helper.es import index_json_file_to_es
-from helper.helper import JSONEncoder, get_entity_type_name
-from helper.logger import OUTPUT_DIR
+from helper.helper import get_entity_type_name
 
 COLLECTION_NAME: str = "entities"
+# Fields that change without the entity changing (i.e.: a user's last seen online time),
+# ignored when detecting changes
+VOLATILE_FIELDS: tuple[str, ...] = ("status", "stories_max_id")
 
 
 def _collect(client: TelegramClient) -> list[dict]:
@@ -28,7 +33,7 @@ def _collect(client: TelegramClient) -> list[dict]:
     try:
         # Collect data via API
         entities_collected: list[Channel | Chat | User] = []
-        for dialog in client.iter_dialogs():
+        for dialog in get_dialogs(client):
             entity: Channel | Chat | User = dialog.entity
             entities_collected.append(entity)
 
@@ -46,6 +51,74 @@ def _collect(client: TelegramClient) -> list[dict]:
         raise
 
 
+def _detect_changes(
+    entities_list: list[dict], changed_timestamp: int
+) -> tuple[list[dict], list[dict], list[tuple]]:
+    """
+    Compares each collected entity against its metadata from the previous collections
+    to find the entities whose metadata changed (or are new).
+
+    Changes are detected with a SHA256 hash of the entity's metadata, except its
+    `VOLATILE_FIELDS`. The title, username and participants count are also stored so
+    that renames can be tracked. The new metadata must only be recorded in the database
+    (see entities_metadata_update) once the changes are exported, so that changes that
+    failed to be exported are detected again by the next collection.
+
+    Args:
+        entities_list: collected entities converted to dictionaries
+        changed_timestamp: epoch timestamp of the collection
+
+    Return:
+        A tuple of (changed entities, changes, new metadata). Each change describes the
+        previous and current title, username and participants count of a changed entity.
+    """
+    logging.info(f"[+] Detecting changes in {COLLECTION_NAME} metadata")
+    previous_metadata: dict[int, tuple] = entities_metadata_get()
+
+    changed_entities: list[dict] = []
+    changes: list[dict] = []
+    new_metadata: list[tuple] = []
+    for entity_dict in entities_list:
+        content_hash: str = hashlib.sha256(
+            serialization.dumps_canonical(
+                {
+                    key: value
+                    for key, value in entity_dict.items()
+                    if key not in VOLATILE_FIELDS
+                }
+            )
+        ).hexdigest()
+        previous: tuple | None = previous_metadata.get(entity_dict["id"])
+        if previous is not None and previous[0] == content_hash:
+            continue  # Unchanged since the previous collection
+
+        current: tuple = (
+            entity_dict.get("title"),
+            entity_dict.get("username"),
+            entity_dict.get("participants_count"),
+        )
+        new_metadata.append((entity_dict["id"], content_hash, *current))
+        changed_entities.append(entity_dict)
+        changes.append(
+            {
+                "entity_id": entity_dict["id"],
+                "changed_timestamp": changed_timestamp,
+                "previous": (
+                    dict(zip(("title", "username", "participants_count"), previous[1:]))
+                    if previous is not None
+                    else None
+                ),
+                "current": dict(zip(("title", "username", "participants_count"), current)),
+            }
+        )
+
+    logging.info(
+        f"{len(changed_entities)} out of {len(entities_list)} {COLLECTION_NAME} are new or changed since the previous collection"
+    )
+
+    return changed_entities, changes, new_metadata
+
+
 def _download(data: list[dict], data_type: str) -> str:
     """
     Downloads collected entities into JSON files on the disk
@@ -59,15 +132,14 @@ def _download(data: list[dict], data_type: str) -> str:
     """
     logging.info(f"[+] Downloading {COLLECTION_NAME} into JSON")
     try:
-        # Define the JSON file name
-        json_file_name = f"{OUTPUT_DIR}/{data_type}.json"
+        # Define the JSON file name, without extension
+        json_file_name = f"{logger.OUTPUT_DIR}/{data_type}"
 
         # Check if directory exists, create it if necessary
         os.makedirs(os.path.dirname(json_file_name), exist_ok=True)
 
-        # Write data from JSON object to JSON file
-        with open(json_file_name, "w", encoding="utf-8") as json_file:
-            json.dump(data, json_file, cls=JSONEncoder, indent=2)
+        # Write data from JSON object to JSON file, in the output format of this run
+        json_file_name = output_format.write(json_file_name, data)
 
         logging.info(f"{len(data)} {data_type} exported to {json_file_name}")
 
@@ -92,14 +164,19 @@ def download_entity(entity: Channel | Chat | User) -> bool:
         # Define the JSON file name
         data: dict = entity.to_dict()
         data_type: str = "entity_info"
-        json_file_name = f"{OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/{data_type}_{entity.id}.json"
+        json_file_name = f"{logger.OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/{data_type}_{entity.id}"
 
         # Check if directory exists, create it if necessary
         os.makedirs(os.path.dirname(json_file_name), exist_ok=True)
 
         # Write data from JSON object to JSON file
-        with open(json_file_name, "w", encoding="utf-8") as json_file:
-            json.dump(data, json_file, cls=JSONEncoder, indent=2)
+        # The entity is written as a single object in JSON, or as a single record otherwise
+        if helper.output_format == "json":
+            json_file_name += ".json"
+            with open(json_file_name, "w", encoding="utf-8") as json_file:
+                json_file.write(serialization.dumps(data, indent=True))
+        else:
+            json_file_name = output_format.write(json_file_name, [data])
 
         logging.info(f"{data_type} sucessfully exported to {json_file_name}")
 
@@ -136,7 +213,20 @@ def scrape(client: TelegramClient) -> bool:
     if collected_result is None or len(collected_result) == 0:
         raise
 
-    output_path: str = _download(collected_result, "all_entities")
+    # Only download and index the entities whose metadata changed, unless all are requested
+    changed_timestamp: int = int(time.time())
+    changed_result, changes, new_metadata = _detect_changes(
+        collected_result, changed_timestamp
+    )
+    if helper.all_entities:
+        output_path: str = _download(collected_result, "all_entities")
+    elif len(changed_result) > 0:
+        _download(changes, "entities_changes")
+        output_path: str = _download(changed_result, "changed_entities")
+    else:
+        logging.info(f"No {COLLECTION_NAME} changed since the previous collection")
+        logging.info(f"[+] Successfully scraped {COLLECTION_NAME}")
+        return True
 
     if helper.export_to_es:
         index_name: str = "entities_index"
@@ -147,6 +237,8 @@ def scrape(client: TelegramClient) -> bool:
                 f"[+] Indexed {COLLECTION_NAME} to Elasticsearch as: {index_name}"
             )
 
+    # Record the new metadata once the changes are exported
+    entities_metadata_update(new_metadata, changed_timestamp)
     logging.info(f"[+] Successfully scraped {COLLECTION_NAME}")
 
     return True
@@ -2,29 +2,81 @@
 Module for scraping messages in a given entity.
 """
 
-import json
+import asyncio
 import logging
+import math
 import os
 import time
 from concurrent.futures import ProcessPoolExecutor
 
-from telethon import TelegramClient
+from telethon import TelegramClient, events, utils
 from telethon.sync import helpers
 from telethon.types import *
 
-from helper import helper
+from helper import (
+    archive,
+    columnar,
+    dataset,
+    helper,
+    logger,
+    metrics,
+    output_format,
+    profiler,
+    proxy_pool,
+)
+from helper.client_pool import ClientPool
+from helper.logger import SAMPLED, set_output_subdir
 from helper.db import (
     iocs_batch_insert,
     messages_collection_get_offset_id,
     messages_collection_insert_offset_id,
 )
-from helper.es import index_json_file_to_es
-from helper.helper import JSONEncoder, get_entity_type_name, rotate_proxy, throttle
+from helper.es import index_json_files_to_es
+from helper.helper import get_entity_type_name, rotate_proxy, throttle
+from helper.rate_limiter import call_api
+from helper.spill_buffer import SpillBuffer
 from helper.ioc import find_iocs
-from helper.logger import OUTPUT_DIR
-from helper.translate import translate
+from helper.message_record import MessageRecord
+from helper.translate import translate, translate_texts
+from helper.work_queue import LeaseLostError, check_lease
 
 COLLECTION_NAME: str = "messages"
+BACKFILL_CHUNK_SIZE: int = 500  # Number of messages to retrieve per API call when backfilling
+TRANSLATION_CHUNK_SIZE: int = 32  # Number of texts sent to a translation worker at once
+LIVE_FLUSH_MAX_ATTEMPTS: int = 3  # Number of times the messages received in an entity are processed before giving up
+
+# Translation worker processes, shared by every collection in this run
+_executor: ProcessPoolExecutor | None = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    Gets the pool of translation worker processes, starting it on first use.
+
+    The pool is kept alive between collections so that the worker processes only import
+    and load the translation models once per run. Log records of the worker processes are
+    written by the main process (see logger.configure_worker_logging).
+
+    Return:
+        The pool of translation worker processes
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            initializer=logger.configure_worker_logging,
+            initargs=logger.get_worker_initargs(),
+        )
+    return _executor
+
+
+def shutdown_executor():
+    """
+    Stops the pool of translation worker processes, if it was started.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
 
 
 def _translate_message(message: dict):
@@ -41,7 +93,11 @@ def _translate_message(message: dict):
     return None
 
 
-def _collect(client: TelegramClient, entity: Channel | Chat | User) -> bool:
+def _collect(
+    client: TelegramClient,
+    entity: Channel | Chat | User,
+    max_api_calls: int | None = None,
+) -> bool:
     """
     Collects all messages in a given entity via its API and stores the data in-memory.
     An entity can be a Channel (Broadcast Channel or Public Group),
@@ -49,12 +105,15 @@ def _collect(client: TelegramClient, entity: Channel | Chat | User) -> bool:
 
     Args:
         entity: entity of type Channel, Chat or User
+        max_api_calls (optional): max number of API calls to make in this collection
+            (i.e.: budget allocated by the scheduler), default None for no limit
 
     Return:
         True if collection was successful
     """
     # Pre-define minimal variable(s) for emergency data recovery in exception handling
-    messages_collected: helpers.TotalList = None
+    # Collected messages are spilled to disk beyond the memory budget (see --max-buffer-mb)
+    messages_collected = SpillBuffer(helper.max_buffer_mb * 1024 * 1024)
     try:
         logging.info(f"[+] Collecting {COLLECTION_NAME} from Telethon API")
 
@@ -69,18 +128,12 @@ def _collect(client: TelegramClient, entity: Channel | Chat | User) -> bool:
         chunk_size: int = 500  # Number of messages to retrieve per iteration
         # max_messages: int = counter_max * chunk_size
 
-        # Proxy configs
-        counter_rotate_proxy: int = 2  # Number of API calls until proxy rotation
-
         # Tracking offset
         start_offset_id: int = messages_collection_get_offset_id(entity.id)
         offset_id_value: int = start_offset_id
         collection_start_time: int = int(time.time())
         collection_end_time: int = collection_start_time
 
-        # Store collected messages
-        messages_collected: helpers.TotalList = None
-
         # Begin collection
         logging.debug(f"Starting collection at offset value {offset_id_value}")
         logging.info(f"Max number of messages to be collected: {helper.max_messages}")
@@ -89,31 +142,40 @@ def _collect(client: TelegramClient, entity: Channel | Chat | User) -> bool:
 
         # Main collection logic
         while True:
-            # Proxy rotation...
+            # Stop if another worker took over the entity (see helper/work_queue.py)
+            check_lease(renew=False)
+
+            # Proxy rotation, once per batch of API calls
+            if counter % proxy_pool.ROTATE_BATCH_REQUESTS == 0:
+                client = rotate_proxy(client, proxy_pool.ROTATE_BATCH_REQUESTS)
             counter += 1
-            if counter % counter_rotate_proxy == 0:
-                rotate_proxy(client)
 
             # Collect messages (reverse=True means oldest to newest)
             # Start at message with id offset_id, collect the next 'limit' messages
-            chunk: helpers.TotalList = client.get_messages(
-                entity, limit=chunk_size, reverse=True, offset_id=offset_id_value
+            chunk: helpers.TotalList = call_api(
+                client.get_messages,
+                entity,
+                limit=chunk_size,
+                reverse=True,
+                offset_id=offset_id_value,
             )
 
             if len(chunk) > 0:  # Messages were returned
+                if helper.record_responses:
+                    archive.record(
+                        entity, COLLECTION_NAME, chunk, _get_related_entities(chunk)
+                    )
+
                 # Append collected messages to list of all messages collected
-                if messages_collected is None:
-                    messages_collected = chunk  # First chunk
-                else:
-                    messages_collected.extend(chunk)
+                messages_collected.extend(chunk)
 
-                logging.info(f"Collected {len(chunk)} {COLLECTION_NAME}...")
+                logging.info(f"Collected {len(chunk)} {COLLECTION_NAME}...", extra=SAMPLED)
             else:  # No messages returned... All messages have been collected
                 logging.info(f"No new {COLLECTION_NAME} to collect")
                 break
 
             # Next collection will begin with this "latest message collected" offset id
-            offset_id_value = chunk[-1].to_dict()["id"]
+            offset_id_value = chunk[-1].id
 
             if (
                 helper.max_messages is not None
@@ -122,63 +184,33 @@ def _collect(client: TelegramClient, entity: Channel | Chat | User) -> bool:
                 logging.info(f"Reached max number of messages to be collected")
                 break
 
+            if max_api_calls is not None and counter >= max_api_calls:
+                logging.info(f"Reached max number of API calls allocated to this entity")
+                break
+
             # Delay code execution/API calls to prevent bot detection by Telegram
             throttle()
 
         # Post-collection logic
-        if messages_collected is None or len(messages_collected) == 0:
+        if len(messages_collected) == 0:
             logging.info(f"There are no {COLLECTION_NAME} to collect. Skipping...")
-            return True
-        logging.info(f"Number of API calls made: {counter}")
-
-        # Convert the Message object to JSON and extract IOCs
-        all_iocs: list[dict] = []  # extracted IOCs
-        messages_list: list[dict] = []
 
-        # Collecting messages for translation
-        messages_to_translate = [
-            message.to_dict()
-            for message in messages_collected
-            if message.to_dict().get("message")
-        ]
-
-        # Performing the translation in parallel
-        logging.info(f"Translating messages into English (this may take some time)...")
-        with ProcessPoolExecutor() as executor:
-            translated_messages = list(
-                executor.map(_translate_message, messages_to_translate)
+            # Record the empty collection to track the entity's yield
+            check_lease()
+            messages_collection_insert_offset_id(
+                entity.id,
+                start_offset_id,
+                offset_id_value,
+                collection_start_time,
+                int(time.time()),
+                0,
+                0,
             )
+            return True
+        logging.info(f"Number of API calls made: {counter}")
 
-        # Updating messages with translated texts
-        for message_dict, translated in zip(messages_to_translate, translated_messages):
-            if translated:
-                message_dict["message_translated"] = translated
-
-            extracted_iocs = _extract_iocs(message_dict)
-            all_iocs.extend(extracted_iocs)
-            # message_dict["iocs"] = extracted_iocs  # NOTE: Uncomment to insert IOCs directly into the Messages JSON file
-            messages_list.append(message_dict)
-
-        # # Perform a batch database insert of all collected IOCs
-        # if len(all_iocs) > 0:
-        #     iocs_batch_insert(all_iocs)
-
-        # Download data to JSON
-        iocs_output_path: str = _download(all_iocs, entity, "iocs")
-        output_path: str = _download(messages_list, entity)
-
-        # Index data into Elasticsearch
-        if helper.export_to_es:
-            index_name: str = "messages_index"
-            iocs_index: str = "iocs_index"
-
-            logging.info(f"[+] Exporting data to Elasticsearch")
-            if index_json_file_to_es(output_path, index_name):
-                logging.info(
-                    f"[+] Indexed {COLLECTION_NAME} to Elasticsearch as: {index_name}"
-                )
-            if index_json_file_to_es(iocs_output_path, iocs_index):
-                logging.info(f"[+] Indexed IOCs to Elasticsearch as: {iocs_index}")
+        check_lease()
+        messages_count, iocs_count = _process(messages_collected, entity)
 
         logging.info(
             f"[+] Completed the collection, downloading, and exporting of {COLLECTION_NAME}"
@@ -189,14 +221,20 @@ def _collect(client: TelegramClient, entity: Channel | Chat | User) -> bool:
         collection_end_time = int(time.time())
 
         # Insert collection details into DB for tracking purposes
+        check_lease()
         messages_collection_insert_offset_id(
             entity.id,
             start_offset_id,
             offset_id_value,
             collection_start_time,
             collection_end_time,
+            messages_count,
+            iocs_count,
         )
         return True
+    except LeaseLostError:
+        # The entity is collected by another worker, which writes its output
+        raise
     except:
         logging.critical(
             "[-] Failed to collect data from Telegram API for unknown reasons"
@@ -206,14 +244,188 @@ def _collect(client: TelegramClient, entity: Channel | Chat | User) -> bool:
         )
         logging.info(f"This data will be re-collected in the next collection run")
         # -- Download data to JSON
-        # Convert the collected object to JSON
-        messages_list: list[dict] = []
-        for message in messages_collected:
-            message_dict: dict = message.to_dict()
-            messages_list.append(message_dict)
-        _download(messages_list, entity)
+        # Convert the collected objects to JSON one at a time, as they are written
+        _download(messages_collected.to_dicts(), entity)
         logging.info(f"Download complete")
         raise
+    finally:
+        messages_collected.close()
+
+
+def _process(
+    messages: list[Message] | SpillBuffer,
+    entity: Channel | Chat | User,
+    part: int | None = None,
+) -> tuple[int, int]:
+    """
+    Enriches collected messages and exports them.
+
+    Processing has the following phases:
+    - Translation: translates the messages into English in parallel
+    - IOCs extraction: extracts IOCs from the messages
+    - Download: downloads the messages and IOCs into JSON files on the disk, and appends
+      them to the entity's consolidated dataset (see helper/dataset.py) and, if enabled,
+      to the entity's Parquet files (see helper/columnar.py)
+    - Export: indexes the messages and IOCs into Elasticsearch, if enabled
+
+    Messages spilled to disk (see `--max-buffer-mb`) are translated, scanned and
+    downloaded one chunk of at most the memory budget at a time (see
+    SpillBuffer.chunks), so that processing stays within the budget too.
+
+    Args:
+        messages: collected Message objects, in memory or spilled to disk
+        entity: entity of type Channel, Chat or User the messages were collected from
+        part (optional): number of the downloaded part, when processed in several parts
+
+    Return:
+        A tuple of (number of messages processed, number of IOCs extracted)
+    """
+    chunks = messages.chunks() if isinstance(messages, SpillBuffer) else [messages]
+    messages_output: output_format.OutputWriter = _open_download(
+        entity, COLLECTION_NAME, part
+    )
+    iocs_output: output_format.OutputWriter = _open_download(entity, "iocs", part)
+    try:
+        for chunk in chunks:
+            messages_list, chunk_iocs = _enrich(chunk)
+            del chunk  # Only one chunk of Message objects is kept in memory
+
+            # Download data to JSON
+            messages_output.write(messages_list)
+            iocs_output.write(chunk_iocs)
+
+            # Append data to the entity's dataset consolidated across runs
+            dataset.add_segment(entity, COLLECTION_NAME, messages_list)
+            dataset.add_segment(entity, "iocs", chunk_iocs)
+
+            # Append flattened data to the entity's Parquet files, for analytics
+            if helper.export_parquet:
+                columnar.export(entity, COLLECTION_NAME, messages_list)
+                columnar.export(entity, "iocs", chunk_iocs)
+
+            # # Perform a batch database insert of all collected IOCs
+            # if len(chunk_iocs) > 0:
+            #     iocs_batch_insert(chunk_iocs)
+    finally:
+        output_paths: list[str] = _close_download(messages_output, COLLECTION_NAME)
+        iocs_output_paths: list[str] = _close_download(iocs_output, "iocs")
+
+    # Index data into Elasticsearch
+    if helper.export_to_es:
+        index_name: str = "messages_index"
+        iocs_index: str = "iocs_index"
+
+        logging.info(f"[+] Exporting data to Elasticsearch")
+        if index_json_files_to_es(output_paths, index_name):
+            logging.info(
+                f"[+] Indexed {COLLECTION_NAME} to Elasticsearch as: {index_name}"
+            )
+        if index_json_files_to_es(iocs_output_paths, iocs_index):
+            logging.info(f"[+] Indexed IOCs to Elasticsearch as: {iocs_index}")
+
+    return messages_output.count, iocs_output.count
+
+
+def _enrich(messages: list[Message]) -> tuple[list[dict], list[dict]]:
+    """
+    Translates messages and extracts their IOCs (see `_process`).
+
+    Args:
+        messages: collected Message objects
+
+    Return:
+        A tuple of (messages with a text, converted to dictionaries with their
+        translation, IOCs extracted from them)
+    """
+    # Convert the Message object to JSON and extract IOCs
+    all_iocs: list[dict] = []  # extracted IOCs
+    messages_list: list[dict] = []
+
+    # Collecting messages for translation
+    # Only the fields used for enrichment are read from each message (see MessageRecord)
+    records_to_translate: list[MessageRecord] = [
+        record for record in map(MessageRecord.from_message, messages) if record.text
+    ]
+
+    # Performing the translation in parallel
+    # Only texts are sent to the worker processes, in chunks to reduce round trips
+    logging.info(f"Translating messages into English (this may take some time)...")
+    texts: list[str] = [record.text for record in records_to_translate]
+    with metrics.timer("translate"), profiler.stage("translate"):
+        translated_messages: list[str | None] = [
+            translated
+            for translated_chunk in _get_executor().map(
+                profiler.worker_task(translate_texts, "translate"),
+                [
+                    texts[i : i + TRANSLATION_CHUNK_SIZE]
+                    for i in range(0, len(texts), TRANSLATION_CHUNK_SIZE)
+                ],
+            )
+            for translated in translated_chunk
+        ]
+    metrics.count("messages_translated", len(records_to_translate))
+
+    # Updating messages with translated texts
+    for record, translated in zip(records_to_translate, translated_messages):
+        if translated:
+            record.text_translated = translated
+
+    # Extracting IOCs from the original texts
+    with metrics.timer("ioc_scan"), profiler.stage("ioc"):
+        for record in records_to_translate:
+            all_iocs.extend(_extract_record_iocs(record))
+    metrics.count("messages_scanned", len(records_to_translate))
+
+    # Converted to a dictionary once, with its translation
+    with profiler.stage("serialize"):
+        for record in records_to_translate:
+            message_dict: dict = record.to_dict()
+            # message_dict["iocs"] = _extract_record_iocs(record)  # NOTE: Uncomment to insert IOCs directly into the Messages JSON file
+            messages_list.append(message_dict)
+    metrics.count("messages_processed", len(messages_list))
+    metrics.count("iocs_extracted", len(all_iocs))
+
+    return messages_list, all_iocs
+
+
+def _get_related_entities(messages: list[Message]) -> list[Channel | Chat | User]:
+    """
+    Gets the users and chats referenced by messages (i.e.: senders), as returned by the
+    API along with the messages.
+
+    Args:
+        messages: collected Message objects
+
+    Return:
+        The list of unique users and chats
+    """
+    related: dict[tuple, Channel | Chat | User] = {}
+    for message in messages:
+        for related_entity in (message.sender, message.chat):
+            if related_entity is not None:
+                related[(type(related_entity), related_entity.id)] = related_entity
+    return list(related.values())
+
+
+def replay(entity: Channel | Chat | User, messages: list[Message]) -> bool:
+    """
+    Processes messages replayed from the local archive of raw API responses, as if they
+    were just collected (see helper/archive.py). The entity's offset id is not changed.
+
+    Args:
+        entity: entity of type Channel, Chat or User the messages were collected from
+        messages: recorded Message objects, ordered by id
+
+    Return:
+        True if processing was successful
+    """
+    logging.info(
+        "--------------------------------------------------------------------------"
+    )
+    logging.info(f"[+] Replaying {len(messages)} {COLLECTION_NAME} from the archive")
+    messages_count, iocs_count = _process(messages, entity)
+    logging.info(f"Processed {messages_count} {COLLECTION_NAME} and {iocs_count} IOCs")
+    return True
 
 
 def _extract_iocs(message_obj: dict) -> list[dict]:
@@ -235,69 +447,267 @@ def _extract_iocs(message_obj: dict) -> list[dict]:
     Args:
         message_obj: Message object in a dictionary object
 
+    Returns:
+        Returns the list of IOCs present in the message
+    """
+    return _extract_record_iocs(MessageRecord.from_dict(message_obj))
+
+
+def _extract_record_iocs(record: MessageRecord) -> list[dict]:
+    """
+    Extracts IOCs from a message record (see `_extract_iocs`).
+
+    Args:
+        record: the message record
+
     Returns:
         Returns the list of IOCs present in the message
     """
     iocs_list: list[dict] = []
-    iocs = find_iocs(message_obj["message"])
+    iocs = find_iocs(record.text)
 
     for ioc_type, ioc_value in iocs:
         iocs_list.append(
             {
-                "message_id": message_obj["id"],
-                "entity_id": message_obj.get("peer_id", {}).get("channel_id")
-                or message_obj.get("peer_id", {}).get("chat_id")
-                or message_obj.get("peer_id", {}).get("user_id"),
+                "message_id": record.id,
+                "entity_id": record.entity_id,
                 "from_id": {
-                    "user_id": (message_obj.get("from_id") or {}).get("user_id"),
-                    "channel_id": (message_obj.get("from_id") or {}).get("channel_id"),
+                    "user_id": record.sender_user_id,
+                    "channel_id": record.sender_channel_id,
                 },
                 "ioc_type": ioc_type,
                 "ioc_value": ioc_value,
-                "original_message": message_obj.get("message"),
-                "translated_message": message_obj.get("message_translated", None),
+                "original_message": record.text,
+                "translated_message": record.text_translated,
             }
         )
     return iocs_list
 
 
 def _download(
-    data: list[dict], entity: Channel | Chat | User, data_type: str = COLLECTION_NAME
-) -> str:
+    data: list[dict],
+    entity: Channel | Chat | User,
+    data_type: str = COLLECTION_NAME,
+    part: int | None = None,
+) -> list[str]:
     """
     Downloads collected messages into JSON files on the disk
 
+    Messages are split into numbered segments of bounded size if `--segment-messages` or
+    `--segment-mb` is set (see output_format.write_segments).
+
     Args:
         data: list of collected objects (messages, participants...)
         entity: channel (public group or broadcast channel), chat (private group), user (direct message)
         data_type: type of data that is being collected ("messages", "iocs")
+        part (optional): number of the part of the collection, when it is downloaded in
+            several parts (i.e.: backfill segments), default None for a single file
 
     Return:
-        The path of the downloaded JSON file
+        The paths of the downloaded JSON files, one per segment
+    """
+    writer: output_format.OutputWriter = _open_download(entity, data_type, part)
+    try:
+        writer.write(data)
+    finally:
+        json_file_names: list[str] = _close_download(writer, data_type)
+    return json_file_names
+
+
+def _open_download(
+    entity: Channel | Chat | User,
+    data_type: str = COLLECTION_NAME,
+    part: int | None = None,
+) -> output_format.OutputWriter:
+    """
+    Opens the JSON file(s) that collected objects are downloaded into, over one or more
+    writes (see `_download`). Must be closed with `_close_download`.
+
+    Args:
+        entity: channel (public group or broadcast channel), chat (private group), user (direct message)
+        data_type: type of data that is being collected ("messages", "iocs")
+        part (optional): number of the part of the collection, when it is downloaded in
+            several parts (i.e.: backfill segments), default None for a single file
+
+    Return:
+        The writer of the JSON file(s)
     """
     logging.info(f"[+] Downloading {data_type} into JSON: {entity.id}")
     try:
-        # Define the JSON file name
-        json_file_name = f"{OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/{data_type}_{entity.id}.json"
+        # Define the JSON file name, without extension
+        json_file_name = f"{logger.OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/{data_type}_{entity.id}"
+        if part is not None:
+            json_file_name += f"_{part}"
 
         # Check if directory exists, create it if necessary
         os.makedirs(os.path.dirname(json_file_name), exist_ok=True)
 
-        # Write data from JSON object to JSON file
-        with open(json_file_name, "w", encoding="utf-8") as json_file:
-            json.dump(data, json_file, cls=JSONEncoder, indent=2)
+        # Write data from JSON object to JSON file, in the output format of this run
+        if data_type == COLLECTION_NAME and (
+            helper.segment_messages or helper.segment_mb
+        ):
+            return output_format.OutputWriter(
+                json_file_name,
+                segmented=True,
+                max_records=helper.segment_messages,
+                max_bytes=helper.segment_mb * 1024 * 1024,
+            )
+        return output_format.OutputWriter(json_file_name)
+    except:
+        logging.error("[-] Failed to download the collected data into JSON files")
+        raise
+
+
+def _close_download(
+    writer: output_format.OutputWriter, data_type: str = COLLECTION_NAME
+) -> list[str]:
+    """
+    Closes the JSON file(s) opened by `_open_download`.
 
+    Args:
+        writer: the writer of the JSON file(s)
+        data_type: type of data that is being collected ("messages", "iocs")
+
+    Return:
+        The paths of the downloaded JSON files, one per segment
+    """
+    try:
+        json_file_names: list[str] = writer.close()
         logging.info(
-            f"{len(data)} {data_type} successfully exported to {json_file_name}"
+            f"{writer.count} {data_type} successfully exported to {writer.path_without_extension} ({len(json_file_names)} file(s))"
         )
-
-        return json_file_name
+        return json_file_names
     except:
         logging.error("[-] Failed to download the collected data into JSON files")
         raise
 
 
-def scrape(client: TelegramClient, entity: Channel | Chat | User) -> bool:
+def _collect_segment(client: TelegramClient, segment: tuple) -> list[Message]:
+    """
+    Collects all messages within a range of message ids. Function to be executed in
+    parallel by a ClientPool.
+
+    Args:
+        client: connected client of the pool running this collection
+        segment: tuple of (input entity, first message id, last message id) of the range
+
+    Return:
+        The list of collected messages, ordered by id
+    """
+    input_entity, first_id, last_id = segment
+    logging.info(f"Collecting {COLLECTION_NAME} with ids {first_id} to {last_id}...")
+
+    messages: list[Message] = []
+    offset_id_value: int = first_id - 1
+    while True:
+        # Collect messages (reverse=True means oldest to newest), up to the end of the range
+        chunk: helpers.TotalList = call_api(
+            client.get_messages,
+            input_entity,
+            limit=BACKFILL_CHUNK_SIZE,
+            reverse=True,
+            offset_id=offset_id_value,
+            max_id=last_id + 1,
+        )
+        if len(chunk) == 0:
+            break
+        messages.extend(chunk)
+        offset_id_value = chunk[-1].id
+
+        # Delay this client's API calls to prevent bot detection by Telegram
+        throttle()
+
+    logging.info(
+        f"Collected {len(messages)} {COLLECTION_NAME} with ids {first_id} to {last_id}"
+    )
+    return messages
+
+
+def _backfill(client: TelegramClient, entity: Channel, top_message_id: int) -> bool:
+    """
+    Collects the history of a channel by splitting its message ids into segments that are
+    collected in parallel, one client per proxy (see helper/client_pool.py).
+
+    Message ids of a channel are sequential, from 1 to the id of its latest message. The
+    range from the latest offset id to the latest message id is split into
+    `helper.backfill_segments` segments. Segments complete in any order, but they are
+    processed and downloaded in order: each time the next segment is complete, it is
+    processed (see `_process`) into its own numbered file and the offset id is advanced to
+    the end of the segment. This checkpoint lets an interrupted backfill resume from the
+    last processed segment.
+
+    Args:
+        client: the main, authorized Telegram client
+        entity: channel (broadcast channel or public group) to collect from
+        top_message_id: id of the latest message in the channel
+
+    Return:
+        True if collection was successful
+    """
+    start_offset_id: int = messages_collection_get_offset_id(entity.id)
+    segment_size: int = math.ceil(
+        (top_message_id - start_offset_id) / helper.backfill_segments
+    )
+    input_entity = utils.get_input_peer(entity)
+    segments: list[tuple] = [
+        (input_entity, first_id, min(first_id + segment_size - 1, top_message_id))
+        for first_id in range(start_offset_id + 1, top_message_id + 1, segment_size)
+    ]
+    logging.info(
+        f"[+] Backfilling {COLLECTION_NAME} {start_offset_id + 1} to {top_message_id} in {len(segments)} segments"
+    )
+
+    completed_segments: dict[int, list[Message]] = {}  # first message id -> messages
+    next_segment: int = 0  # index of the next segment to process
+    with ClientPool(client) as pool:
+        for segment, messages in pool.imap(_collect_segment, segments):
+            completed_segments[segment[1]] = messages
+            if helper.record_responses:
+                archive.record(
+                    entity, COLLECTION_NAME, messages, _get_related_entities(messages)
+                )
+
+            # Process completed segments in order
+            while (
+                next_segment < len(segments)
+                and segments[next_segment][1] in completed_segments
+            ):
+                _, first_id, last_id = segments[next_segment]
+                collection_start_time: int = int(time.time())
+                messages = completed_segments.pop(first_id)
+                messages_count, iocs_count = 0, 0
+                if len(messages) > 0:
+                    check_lease()
+                    messages_count, iocs_count = _process(messages, entity, next_segment)
+
+                # Checkpoint: the next collection resumes after this segment
+                check_lease()
+                messages_collection_insert_offset_id(
+                    entity.id,
+                    first_id - 1,
+                    last_id,
+                    collection_start_time,
+                    int(time.time()),
+                    messages_count,
+                    iocs_count,
+                )
+                logging.info(
+                    f"Processed segment {next_segment + 1} of {len(segments)}. Updating latest offset id as: {last_id}"
+                )
+                next_segment += 1
+
+    logging.info(
+        f"[+] Completed the backfill, downloading, and exporting of {COLLECTION_NAME}"
+    )
+    return True
+
+
+def scrape(
+    client: TelegramClient,
+    entity: Channel | Chat | User,
+    max_api_calls: int | None = None,
+    top_message_id: int | None = None,
+) -> bool:
     """
     Scrapes messages in a particular entity.
 
@@ -308,8 +718,13 @@ def scrape(client: TelegramClient, entity: Channel | Chat | User) -> bool:
     - Collection: fetches messages from the provider API and stores the data in-memory
     - Download: downloads the messages from memory into disk (JSON file)
 
+    If enabled (--backfill-segments), the history of a channel with many messages left to
+    collect is collected in parallel segments instead (see `_backfill`).
+
     Args:
         entity: entity of type Channel, Chat or User
+        max_api_calls (optional): max number of API calls to make, default None for no limit
+        top_message_id (optional): id of the latest message in the entity, if known
 
     Return:
         True if scrape was successful
@@ -318,9 +733,152 @@ def scrape(client: TelegramClient, entity: Channel | Chat | User) -> bool:
         "--------------------------------------------------------------------------"
     )
     logging.info(f"[+] Begin {COLLECTION_NAME} scraping process")
-    _collect(client, entity)
+    if (
+        helper.backfill_segments > 1
+        and ClientPool.available()
+        and type(entity) is Channel
+        and top_message_id
+        and helper.max_messages is None
+        and max_api_calls is None
+        and top_message_id - messages_collection_get_offset_id(entity.id)
+        >= helper.backfill_segments * BACKFILL_CHUNK_SIZE
+    ):
+        _backfill(client, entity, top_message_id)
+    else:
+        _collect(client, entity, max_api_calls)
     logging.info(
         f"[+] Successfully scraped {COLLECTION_NAME} {get_entity_type_name(entity)}"
     )
 
     return True
+
+
+def listen(
+    client: TelegramClient,
+    entities: list[Channel | Chat | User],
+    flush_interval: int = 5,
+):
+    """
+    Listens for new and edited messages pushed by Telegram in the given entities, rather
+    than polling their history, and processes them in micro-batches.
+
+    Messages are delivered as update events over the already open connection, at no extra
+    API cost. Every `flush_interval` seconds, the buffered messages of each entity go
+    through the same processing as collected messages (see `_process`), downloaded into a
+    new subfolder of the run's output folder. The offset id of each entity is then advanced
+    so that the next history collection does not collect these messages again.
+
+    Messages that fail to be processed stay buffered and are processed again at the next
+    flush, up to `LIVE_FLUSH_MAX_ATTEMPTS` times. They are then dropped, and left to the
+    next history collection of the entity, as its offset id was not advanced.
+
+    The history of the entities should be collected up to their latest message before
+    listening, as the offset id would otherwise skip uncollected messages.
+
+    Runs until it is interrupted (i.e.: Ctrl+C).
+
+    Args:
+        client: the connected Telegram client session
+        entities: entities to listen to, of type Channel, Chat or User
+        flush_interval (optional): seconds between processing of buffered messages
+    """
+    entities_by_id: dict[int, Channel | Chat | User] = {e.id: e for e in entities}
+    buffered_messages: dict[int, dict[int, Message]] = {}  # entity id -> message id -> message
+    failed_flushes: dict[int, int] = {}  # entity id -> failed flushes of its buffered messages
+
+    async def _on_message(event):
+        # Edits replace the buffered version of a message that has not been processed yet
+        entity_id: int = utils.get_peer_id(event.message.peer_id, add_mark=False)
+        buffered_messages.setdefault(entity_id, {})[event.message.id] = event.message
+
+    client.add_event_handler(_on_message, events.NewMessage(chats=entities))
+    client.add_event_handler(_on_message, events.MessageEdited(chats=entities))
+
+    logging.info(
+        "--------------------------------------------------------------------------"
+    )
+    logging.info(
+        f"[+] Listening for new {COLLECTION_NAME} in {len(entities)} entities. Press Ctrl+C to stop"
+    )
+    try:
+        while True:
+            # Let the client receive updates for the duration of the interval
+            client.loop.run_until_complete(asyncio.sleep(flush_interval))
+
+            if len(buffered_messages) == 0:
+                continue
+            set_output_subdir(
+                f"live/{time.strftime('%Y-%m-%dT%H-%M-%SZ', time.gmtime())}"
+            )
+            for entity_id in list(buffered_messages.keys()):
+                # Messages stay buffered until they are processed
+                batch: dict[int, Message] = dict(buffered_messages[entity_id])
+                try:
+                    _flush(
+                        entities_by_id[entity_id],
+                        sorted(batch.values(), key=lambda m: m.id),
+                    )
+                except Exception as e:
+                    failed_flushes[entity_id] = failed_flushes.get(entity_id, 0) + 1
+                    if failed_flushes[entity_id] < LIVE_FLUSH_MAX_ATTEMPTS:
+                        logging.exception(
+                            f"[-] Failed to process the {COLLECTION_NAME} received in {entity_id}: {e}. Retrying at the next flush...",
+                            exc_info=True,
+                        )
+                        continue
+                    logging.exception(
+                        f"[-] Failed to process the {COLLECTION_NAME} received in {entity_id} {LIVE_FLUSH_MAX_ATTEMPTS} times: {e}. Dropping them until the next history collection",
+                        exc_info=True,
+                    )
+                failed_flushes.pop(entity_id, None)
+
+                # Messages received or edited again during the flush stay buffered
+                remaining_messages: dict[int, Message] = buffered_messages[entity_id]
+                for message_id, message in batch.items():
+                    if remaining_messages.get(message_id) is message:
+                        del remaining_messages[message_id]
+                if len(remaining_messages) == 0:
+                    del buffered_messages[entity_id]
+    except KeyboardInterrupt:
+        logging.info(f"[+] Stopped listening for new {COLLECTION_NAME}")
+    finally:
+        client.remove_event_handler(_on_message)
+        set_output_subdir(None)
+
+
+def _flush(entity: Channel | Chat | User, messages: list[Message]):
+    """
+    Processes a micro-batch of messages pushed by Telegram and advances the entity's offset id.
+
+    Args:
+        entity: entity of type Channel, Chat or User the messages were sent in
+        messages: new or edited messages, ordered by id
+    """
+    logging.info(f"[+] Received {len(messages)} {COLLECTION_NAME} in {entity.id}")
+    start_time: int = int(time.time())
+    start_offset_id: int = messages_collection_get_offset_id(entity.id)
+
+    if helper.record_responses:
+        archive.record(entity, COLLECTION_NAME, messages, _get_related_entities(messages))
+    metrics.set_entity(entity.id)
+    try:
+        with metrics.timer("live_flush"), profiler.stage("run"):
+            messages_count, iocs_count = _process(messages, entity)
+    finally:
+        # Make the micro-batch's Parquet files readable while listening
+        columnar.close()
+        profiler.flush(entity.id)
+        metrics.set_entity(None)
+
+    # Edited messages may be older than the offset id, which must never move backwards
+    last_offset_id: int = max(start_offset_id, messages[-1].id)
+    logging.info(f"Updating latest offset id for next collection as: {last_offset_id}")
+    messages_collection_insert_offset_id(
+        entity.id,
+        start_offset_id,
+        last_offset_id,
+        start_time,
+        int(time.time()),
+        messages_count,
+        iocs_count,
+    )
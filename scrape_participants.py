@@ -2,31 +2,36 @@
 Module for scraping participants/users in a given entity.
 """
 
-import ijson
-import json
 import logging
 import os
 import re
+import time
 from helper.es import index_json_file_to_es
-from telethon import TelegramClient
-from telethon.sync import helpers
+from telethon import TelegramClient, utils
 from telethon.tl.functions.channels import GetParticipantsRequest
 from telethon.tl.functions.users import GetUsersRequest
 from telethon.types import *
 
 from helper.helper import (
     EntityName,
-    JSONEncoder,
     get_entity_info,
     get_entity_type_name,
     rotate_proxy,
     throttle,
 )
 
-from helper import helper
-from helper.logger import OUTPUT_DIR
+from helper import archive, columnar, helper, logger, output_format, proxy_pool
+from helper.client_pool import ClientPool
+from helper.db import participants_membership_update, participants_snapshot_get
+from helper.membership import decode_ids, diff_sorted_ids, encode_ids
+from helper.rate_limiter import call_api
+from helper.logger import SAMPLED
+from helper.spill_buffer import SpillBuffer
 
 COLLECTION_NAME: str = "participants"
+# Maximum number of participants returned by Telegram for an entity
+PARTICIPANTS_API_LIMIT: int = 10000
+PARTICIPANTS_PAGE_SIZE: int = 200  # Maximum number of participants per API call
 
 
 def _collect_all_under_10k(
@@ -65,33 +70,99 @@ def _collect_all_under_10k(
         )
         return None
 
-    all_participants: helpers.TotalList = None
-    all_participants = client.get_participants(entity, limit=None)
+    # Collected users are spilled to disk beyond the memory budget (see --max-buffer-mb),
+    # as each page of participants is collected
+    all_participants = SpillBuffer(helper.max_buffer_mb * 1024 * 1024)
+    try:
+        for users in _iter_participant_pages(client, entity):
+            if helper.record_responses and users:
+                archive.record(entity, COLLECTION_NAME, users)
+            all_participants.extend(users)
 
-    if all_participants is None or len(all_participants) == 0:
-        logging.info(f"No public participants were collected. Skipping...")
-        return None
-    else:
-        # Evaluate percentage of participants successfully collected
-        collected_amount: int = len(all_participants)
-        logging.info(
-            f"{collected_amount} participants collected out of {total_participants} total participants"
-        )
-        logging.info(
-            f"Successfully collected {'{:.2f}'.format(collected_amount/total_participants * 100)}% of participants"
-        )
+        if len(all_participants) == 0:
+            logging.info(f"No public participants were collected. Skipping...")
+            return None
+        else:
+            # Evaluate percentage of participants successfully collected
+            collected_amount: int = len(all_participants)
+            logging.info(
+                f"{collected_amount} participants collected out of {total_participants} total participants"
+            )
+            logging.info(
+                f"Successfully collected {'{:.2f}'.format(collected_amount/total_participants * 100)}% of participants"
+            )
 
-    # Convert the Participants object to JSON
-    participants_list: list[dict] = []
-    for participant in all_participants:
-        participant_dict: dict = participant.to_dict()
-        participants_list.append(participant_dict)
+        # Convert the Participants object to JSON, one at a time as they are written
+        participants_list = all_participants.to_dicts()
 
-    _download(participants_list, "participants", entity)
+        if helper.membership_diff:
+            # Participants missing from the collection must not be recorded as leaving,
+            # and entities above the API limit are never fully enumerated
+            complete: bool = (
+                collected_amount >= total_participants
+                or total_participants <= PARTICIPANTS_API_LIMIT
+            )
+            if not complete:
+                logging.info(
+                    f"Participants collection is incomplete. Skipping leave detection..."
+                )
+            participants_list = _diff_membership(
+                entity, list(participants_list), complete
+            )
+
+        _download(participants_list, "participants", entity)
+    finally:
+        all_participants.close()
 
     return True
 
 
+def _iter_participant_pages(client: TelegramClient, entity: Channel | Chat | User):
+    """
+    Collects the participants of an entity one page at a time. The participants of
+    channels are paged through with GetParticipantsRequest, up to PARTICIPANTS_PAGE_SIZE
+    participants per API call, so that a retried API call only collects its own page
+    again. Private groups and direct messages have a single page.
+
+    Args:
+        entity: entity of type Channel, Chat or User
+
+    Return:
+        A generator of lists of users, without duplicates.
+    """
+    if not isinstance(entity, Channel):
+        yield list(call_api(client.get_participants, entity, limit=None) or [])
+        return
+
+    collected_ids: set[int] = set()
+    offset: int = 0
+    while True:
+        participants = call_api(
+            client,
+            GetParticipantsRequest(
+                entity, ChannelParticipantsRecent(), offset, PARTICIPANTS_PAGE_SIZE, hash=0
+            ),
+        )
+        if len(participants.participants) == 0:
+            return
+
+        # The users of a page also include the users referenced by the participants
+        # (i.e.: who invited them), which are not necessarily participants
+        users_by_id: dict[int, User] = {user.id: user for user in participants.users}
+        users: list[User] = []
+        for participant in participants.participants:
+            user_id: int | None = getattr(participant, "user_id", None)
+            if user_id in users_by_id and user_id not in collected_ids:
+                collected_ids.add(user_id)
+                users.append(users_by_id[user_id])
+        yield users
+
+        offset += len(participants.participants)
+        logging.info(f"Collected {len(collected_ids)} participants...", extra=SAMPLED)
+        # Delay code execution/API calls to prevent bot detection by Telegram
+        throttle()
+
+
 def _collect_all_over_10k(
     client, entity: Channel | Chat | User, total_participants: int
 ) -> bool:
@@ -116,7 +187,8 @@ def _collect_all_over_10k(
         True if collection was successful, False if collection failed, None if no users were collected
     """
     # Pre-define minimal variable(s) for emergency data recovery in exception handling
-    all_participants = []
+    # Collected users are spilled to disk beyond the memory budget (see --max-buffer-mb)
+    all_participants = SpillBuffer(helper.max_buffer_mb * 1024 * 1024)
     try:
         # Collect participants https://github.com/LonamiWebs/Telethon/issues/580#issuecomment-362802359
         logging.warning(
@@ -151,46 +223,83 @@ def _collect_all_over_10k(
             "y",
             "z",
         ]
-        all_participants = []
-        proxy_counter: int = 0
-
-        for key in queryKey:
-            offset = 0
-            limit = 200
-            while True:
-                proxy_counter += 1
-                if proxy_counter % 3 == 0:
-                    rotate_proxy(client)
-
-                participants = client(
-                    GetParticipantsRequest(
-                        entity.id, ChannelParticipantsSearch(key), offset, limit, hash=0
-                    )
-                )
-                if not participants.users:
-                    logging.info(
-                        f"Done searching for first names whose first English character is '{key}'"
-                    )
-                    break
-                for user in participants.users:
-                    try:
-                        if re.findall(r"\b[a-zA-Z]", user.first_name)[0].lower() == key:
-                            all_participants.append(user)
 
-                    except:
-                        pass
-
-                offset += len(participants.users)
+        if helper.parallel_participants and ClientPool.available():
+            # Search different first-name keys in parallel, one client per proxy
+            input_channel: InputChannel = utils.get_input_channel(entity)
+            collected_ids: set[int] = set()
+            with ClientPool(client) as pool:
                 logging.info(
-                    f"Collected {len(all_participants)} out of {total_participants} participants... "
-                    f"({'{:.2f}'.format(len(all_participants)/total_participants * 100)}%)"
+                    f"Searching participants in parallel with {pool.size} clients"
                 )
-                # Delay code execution/API calls to prevent bot detection by Telegram
-                throttle()
+                for key, users in pool.imap(
+                    lambda pool_client, search_key: _search_participants(
+                        pool_client, input_channel, search_key
+                    ),
+                    queryKey,
+                ):
+                    if helper.record_responses:
+                        archive.record(entity, COLLECTION_NAME, users)
+
+                    # Merge results, dropping users found by more than one search
+                    new_users: list[User] = []
+                    for user in users:
+                        if user.id not in collected_ids:
+                            collected_ids.add(user.id)
+                            new_users.append(user)
+                    all_participants.extend(new_users)
+                    logging.info(
+                        f"Collected {len(all_participants)} out of {total_participants} participants... "
+                        f"({'{:.2f}'.format(len(all_participants)/total_participants * 100)}%)",
+                        extra=SAMPLED,
+                    )
+        else:
+            api_calls: int = 0
+            for key in queryKey:
+                offset = 0
+                limit = 200
+                while True:
+                    # Proxy rotation, once per batch of API calls
+                    if api_calls % proxy_pool.ROTATE_BATCH_REQUESTS == 0:
+                        client = rotate_proxy(client, proxy_pool.ROTATE_BATCH_REQUESTS)
+                    api_calls += 1
+
+                    participants = call_api(
+                        client,
+                        GetParticipantsRequest(
+                            entity, ChannelParticipantsSearch(key), offset, limit, hash=0
+                        )
+                    )
+                    if helper.record_responses:
+                        archive.record(entity, COLLECTION_NAME, participants.users)
+                    if not participants.users:
+                        logging.info(
+                            f"Done searching for first names whose first English character is '{key}'",
+                            extra=SAMPLED,
+                        )
+                        break
+                    new_users: list[User] = []
+                    for user in participants.users:
+                        try:
+                            if re.findall(r"\b[a-zA-Z]", user.first_name)[0].lower() == key:
+                                new_users.append(user)
+
+                        except:
+                            pass
+                    all_participants.extend(new_users)
+
+                    offset += len(participants.users)
+                    logging.info(
+                        f"Collected {len(all_participants)} out of {total_participants} participants... "
+                        f"({'{:.2f}'.format(len(all_participants)/total_participants * 100)}%)",
+                        extra=SAMPLED,
+                    )
+                    # Delay code execution/API calls to prevent bot detection by Telegram
+                    throttle()
 
         # After collection
 
-        if all_participants is None or len(all_participants) == 0:
+        if len(all_participants) == 0:
             logging.info(f"There are no participants to collect. Skipping...")
             return None
         else:
@@ -202,11 +311,13 @@ def _collect_all_over_10k(
             logging.info(
                 f"Successfully collected {'{:.2f}'.format(collected_amount/total_participants * 100)}% of participants"
             )
-        # Convert the Participants object to JSON
-        participants_list: list[dict] = []
-        for participant in all_participants:
-            participant_dict: dict = participant.to_dict()
-            participants_list.append(participant_dict)
+        # Convert the Participants object to JSON, one at a time as they are written
+        participants_list = all_participants.to_dicts()
+
+        if helper.membership_diff:
+            # Searching by first names cannot enumerate every participant, so users who were
+            # not found in this collection cannot be assumed to have left the entity
+            participants_list = _diff_membership(entity, list(participants_list), False)
 
         _download(participants_list, "participants", entity)
 
@@ -221,14 +332,145 @@ def _collect_all_over_10k(
         )
         logging.info(f"This data will be re-collected in the next collection run")
         # -- Download data to JSON
-        # Convert the collected object to JSON
-        participants_list: list[dict] = []
-        for participant in all_participants:
-            participant_dict: dict = participant.to_dict()
-            participants_list.append(participant_dict)
-        _download(participants_list, "participants", entity)
+        # Convert the collected objects to JSON one at a time, as they are written
+        _download(all_participants.to_dicts(), "participants", entity)
         logging.info(f"Download complete")
         raise
+    finally:
+        all_participants.close()
+
+
+def _search_participants(
+    client: TelegramClient, channel: InputChannel, key: str
+) -> list[User]:
+    """
+    Searches all participants of a channel whose first name starts with the given key.
+    Function to be executed in parallel by a ClientPool.
+
+    Args:
+        client: connected client of the pool running this search
+        channel: input channel of the entity whose participants are searched
+        key: first English character of the first names to search for (i.e.: "a")
+
+    Return:
+        The list of users whose first name's first English character is the key
+    """
+    users_found: list[User] = []
+    offset: int = 0
+    limit: int = 200
+    while True:
+        participants = call_api(
+            client,
+            GetParticipantsRequest(
+                channel, ChannelParticipantsSearch(key), offset, limit, hash=0
+            )
+        )
+        if not participants.users:
+            logging.info(
+                f"Done searching for first names whose first English character is '{key}'",
+                extra=SAMPLED,
+            )
+            break
+        for user in participants.users:
+            try:
+                if re.findall(r"\b[a-zA-Z]", user.first_name)[0].lower() == key:
+                    users_found.append(user)
+            except:
+                pass
+
+        offset += len(participants.users)
+
+        # Delay this client's API calls to prevent bot detection by Telegram
+        throttle()
+
+    return users_found
+
+
+def _get_users(client: TelegramClient, input_users: list[InputUser]) -> list[User]:
+    """
+    Gets the information of a chunk of users. Function to be executed in parallel by a ClientPool.
+
+    Args:
+        client: connected client of the pool running this request
+        input_users: chunk of up to 200 users to get information on
+
+    Return:
+        The list of users
+    """
+    logging.info(f"Getting information on {len(input_users)} users...", extra=SAMPLED)
+    users: list[User] = call_api(client, GetUsersRequest(input_users))
+
+    # Delay this client's API calls to prevent bot detection by Telegram
+    throttle()
+
+    return users
+
+
+def _diff_membership(
+    entity: Channel | Chat | User, participants_list: list[dict], complete: bool
+) -> list[dict]:
+    """
+    Compares the collected participants against the previous participants collection
+    of the entity and records who joined and who left, rather than a full snapshot.
+
+    The previous collection's participant IDs are stored in the database as a sorted
+    array (see helper/membership.py). The first collection of an entity is used as a
+    baseline: its snapshot is stored, and all its participants are returned.
+
+    Args:
+        entity: entity of type Channel, Chat or User
+        participants_list: collected participants converted to dictionaries
+        complete: True if every participant in the entity was enumerated. If False,
+            no leave events are recorded and the new IDs are added to the snapshot.
+
+    Return:
+        The participants who joined since the previous collection, whose user information
+        should be downloaded. All participants if this is the entity's first collection.
+    """
+    logging.info(f"[+] Comparing participants against the previous collection")
+    collection_timestamp: int = int(time.time())
+    previous_snapshot: bytes | None = participants_snapshot_get(entity.id)
+    current_ids = decode_ids(encode_ids(user["id"] for user in participants_list))
+
+    if previous_snapshot is None:
+        logging.info(
+            f"No previous participants collection. Storing {len(current_ids)} participants as the baseline"
+        )
+        participants_membership_update(
+            entity.id, current_ids.tobytes(), [], [], collection_timestamp
+        )
+        return participants_list
+
+    previous_ids = decode_ids(previous_snapshot)
+    joined_ids, left_ids = diff_sorted_ids(previous_ids, current_ids)
+
+    snapshot: bytes = current_ids.tobytes()
+    if not complete:
+        left_ids = []
+        snapshot = encode_ids(list(previous_ids) + list(current_ids))
+
+    participants_membership_update(
+        entity.id, snapshot, joined_ids, left_ids, collection_timestamp
+    )
+    logging.info(
+        f"{len(joined_ids)} participants joined and {len(left_ids)} participants left since the previous collection"
+    )
+
+    # Download the membership events of this collection
+    membership_events: list[dict] = [
+        {
+            "entity_id": entity.id,
+            "user_id": user_id,
+            "event": event,
+            "event_timestamp": collection_timestamp,
+        }
+        for event, user_ids in (("join", joined_ids), ("leave", left_ids))
+        for user_id in user_ids
+    ]
+    _download(membership_events, "membership", entity)
+
+    joined: set[int] = set(joined_ids)
+    return [user for user in participants_list if user["id"] in joined]
 
 
 def _download(data: list[dict], data_type: str, entity: Channel | Chat | User) -> str:
@@ -244,15 +486,14 @@ def _download(data: list[dict], data_type: str, entity: Channel | Chat | User) -
         The path of the downloaded JSON file
     """
     try:
-        # Define the JSON file name
-        json_file_name = f"{OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/{data_type}_{entity.id}.json"
+        # Define the JSON file name, without extension
+        json_file_name = f"{logger.OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/{data_type}_{entity.id}"
 
         # Check if directory exists, create it if necessary
         os.makedirs(os.path.dirname(json_file_name), exist_ok=True)
 
-        # Write data from JSON object to JSON file
-        with open(json_file_name, "w") as json_file:
-            json.dump(data, json_file, cls=JSONEncoder, indent=2)
+        # Write data from JSON object to JSON file, in the output format of this run
+        json_file_name = output_format.write(json_file_name, data)
 
         logging.info(
             f"{len(data)} {data_type} successfully exported to {json_file_name}"
@@ -307,10 +548,16 @@ def scrape_participants_from_messages(
 
         # Extract user IDs from the messages_<entity_id>.json obtained from messages collection
         collected_user_ids: list[int] = []  # List of extracted unique user IDs
-        messages_json_filename = f"{OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/messages_{entity.id}.json"
+        messages_json_filename = f"{logger.OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/messages_{entity.id}"
+
+        # Messages may have been downloaded in several numbered parts (i.e.: backfill segments)
+        messages_json_filenames: list[str] = sorted(
+            output_format.glob(messages_json_filename)
+            + output_format.glob(f"{messages_json_filename}_*")
+        )
 
         # Check if message file exists (valid if it does not exist)
-        if not os.path.exists(messages_json_filename):
+        if len(messages_json_filenames) == 0:
             logging.info(
                 f"No messages were collected in this collection run. The file '{messages_json_filename}' does not exist."
             )
@@ -319,11 +566,9 @@ def scrape_participants_from_messages(
 
         # Reduce RAM usage by storing chunks of JSON in memory, rather than the entire file
         # https://pythonspeed.com/articles/json-memory-streaming/
-        with open(messages_json_filename, "r") as messages_file:
-            message_objs = ijson.items(
-                messages_file, "item"
-            )  # Use ijson to stream JSON
-            for message_obj in message_objs:  # Process each message object
+        for messages_json_filename in messages_json_filenames:
+            # Stream messages, whatever the output format of the file
+            for message_obj in output_format.read(messages_json_filename):
                 curr_user_id: int = (message_obj.get("from_id") or {}).get("user_id")
                 if curr_user_id and curr_user_id not in collected_user_ids:
                     collected_user_ids.append(curr_user_id)
@@ -339,14 +584,52 @@ def scrape_participants_from_messages(
         # Chunk size for each API request
         chunk_size: int = 200
 
+        if helper.parallel_participants and ClientPool.available():
+            # Resolve users found in the local session cache in parallel, one client per proxy
+            # The remaining users are resolved serially by the main client below
+            input_users: list[InputUser] = []
+            unresolved_user_ids: list[int] = []
+            for user_id in collected_user_ids:
+                try:
+                    input_users.append(
+                        utils.get_input_user(client.session.get_input_entity(user_id))
+                    )
+                except (ValueError, TypeError):
+                    unresolved_user_ids.append(user_id)
+
+            collected_ids: set[int] = set()
+            with ClientPool(client) as pool:
+                logging.info(
+                    f"Getting information on {len(input_users)} users in parallel with {pool.size} clients"
+                )
+                for _, users in pool.imap(
+                    _get_users,
+                    [
+                        input_users[i : i + chunk_size]
+                        for i in range(0, len(input_users), chunk_size)
+                    ],
+                ):
+                    if helper.record_responses:
+                        archive.record(entity, COLLECTION_NAME, users)
+
+                    # Merge results, dropping duplicate users
+                    for user in users:
+                        if user.id not in collected_ids:
+                            collected_ids.add(user.id)
+                            collected_participants.append(user)
+            collected_user_ids = unresolved_user_ids
+
         # Iterate over the list of collected user IDs in chunks
         for i in range(0, len(collected_user_ids), chunk_size):
             # Get the chunk of user IDs
             chunk = collected_user_ids[i : i + chunk_size]
-            logging.info(f"Getting information on {len(chunk)} users...")
+            logging.info(f"Getting information on {len(chunk)} users...", extra=SAMPLED)
 
             # Use the GetUsersRequest API to get user info for the chunk
-            collected_participants.extend(client(GetUsersRequest(chunk)))
+            users: list[User] = call_api(client, GetUsersRequest(chunk))
+            if helper.record_responses:
+                archive.record(entity, COLLECTION_NAME, users)
+            collected_participants.extend(users)
 
             # Delay code execution/API calls to prevent bot detection by Telegram
             throttle()
@@ -368,17 +651,18 @@ def scrape_participants_from_messages(
             )
 
         # Download the collected data to JSON, or append to existing JSON
-        participants_json_filename: str = (
-            f"{OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/participants_{entity.id}.json"
+        participants_json_filename: str | None = output_format.find(
+            f"{logger.OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/participants_{entity.id}"
         )
 
-        if os.path.exists(participants_json_filename):
+        if participants_json_filename is not None:
             # Participants JSON file exists; Append unique participants info to it
             logging.info(
                 f"Downloading participants data to existing participants JSON file: {participants_json_filename}"
             )
-            with open(participants_json_filename, "r") as file:
-                existing_participants_json = json.load(file)
+            existing_participants_json: list[dict] = list(
+                output_format.read(participants_json_filename)
+            )
 
             existing_ids: set[int] = {user["id"] for user in existing_participants_json}
             unique_users: list[dict] = [
@@ -386,8 +670,9 @@ def scrape_participants_from_messages(
             ]
             updated_participants_json = existing_participants_json + unique_users
 
-            with open(participants_json_filename, "w") as file:
-                json.dump(updated_participants_json, file, cls=JSONEncoder, indent=2)
+            # Rewritten in the output format of this run
+            os.remove(participants_json_filename)
+            _download(updated_participants_json, "participants", entity)
         else:
             # Participants JSON does not exist; Download new Participants JSON file as usual
             logging.info(
@@ -415,6 +700,43 @@ def scrape_participants_from_messages(
         raise
 
 
+def replay(entity: Channel | Chat | User, participants: list[User]) -> bool:
+    """
+    Downloads participants replayed from the local archive of raw API responses, as if
+    they were just collected (see helper/archive.py).
+
+    The membership history is not updated, as replayed participants are not a snapshot
+    of the entity at the time of the replay.
+
+    Args:
+        entity: entity of type Channel, Chat or User the participants were collected from
+        participants: recorded User objects, ordered by id
+
+    Return:
+        True if the replay was successful
+    """
+    logging.info(
+        "--------------------------------------------------------------------------"
+    )
+    logging.info(
+        f"[+] Replaying {len(participants)} {COLLECTION_NAME} from the archive"
+    )
+    participants_list: list[dict] = [participant.to_dict() for participant in participants]
+    output_path: str = _download(participants_list, "participants", entity)
+    if helper.export_parquet:
+        columnar.export(entity, COLLECTION_NAME, participants_list)
+
+    # Index data into Elasticsearch
+    if helper.export_to_es:
+        index_name: str = "users_index"
+
+        if index_json_file_to_es(output_path, index_name):
+            logging.info(
+                f"[+] Indexed {COLLECTION_NAME} to Elasticsearch as: {index_name}"
+            )
+    return True
+
+
 def scrape(
     client: TelegramClient, entity: Channel | Chat | User, collected_message: bool
 ) -> bool:
@@ -474,10 +796,15 @@ def scrape(
     if participants_found is not True:
         return None
 
-    # Index data into Elasticsearch
-    output_path: str = (
-        f"{OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/participants_{entity.id}.json"
+    output_path: str = output_format.find(
+        f"{logger.OUTPUT_DIR}/{get_entity_type_name(entity)}_{entity.id}/participants_{entity.id}"
     )
+
+    # Export flattened data to Parquet, once participants from every source are downloaded
+    if helper.export_parquet:
+        columnar.export(entity, COLLECTION_NAME, output_format.read(output_path))
+
+    # Index data into Elasticsearch
     if helper.export_to_es:
         index_name: str = "users_index"
 
@@ -0,0 +1,35 @@
+"""
+Shared fixtures of the test suite.
+
+Tests run without a Telegram account: the example configurations are used when no
+configs.py is present, and every test that writes to disk runs in its own folder.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import configs  # noqa: F401
+except ImportError:
+    import example_configs
+
+    sys.modules["configs"] = example_configs
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs a test in an empty folder, with its own database and output folders.
+    """
+    from helper import db, logger
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(logger, "OUTPUT_DIR", str(tmp_path / "output"))
+    monkeypatch.setattr(logger, "OUTPUT_NDJSON", str(tmp_path / "output_ndjson"))
+    monkeypatch.setattr(db, "sqlite_db_name", str(tmp_path / "app.db"))
+    db.start_database()
+    return tmp_path
@@ -0,0 +1,72 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from telethon.sessions import StringSession
+
+from helper import client_pool
+from helper.client_pool import ClientPool
+
+release = threading.Event()
+
+
+class _Client:
+    """
+    Client connecting instantly, except through the proxies named "fail" and "slow".
+    """
+
+    def __init__(self, session, api_id, api_hash, proxy=None, **kwargs):
+        self.proxy = proxy
+
+    def connect(self):
+        if self.proxy["addr"] == "fail":
+            raise RuntimeError("Unexpected error")
+        if self.proxy["addr"] == "slow":
+            release.wait(5)
+
+    def disconnect(self):
+        pass
+
+
+def _proxy(addr: str) -> dict:
+    return {"proxy_type": "socks5", "addr": addr, "port": 1080}
+
+
+@pytest.fixture(autouse=True)
+def fake_client(monkeypatch):
+    monkeypatch.setattr(client_pool, "TelegramClient", _Client)
+    monkeypatch.setattr(client_pool, "CONNECT_TIMEOUT", 0.5)
+    release.clear()
+    yield
+    release.set()
+
+
+def _pool(*addrs: str) -> ClientPool:
+    return ClientPool(
+        SimpleNamespace(session=StringSession()), [_proxy(addr) for addr in addrs]
+    )
+
+
+def test_pool_runs_tasks():
+    with _pool("a", "b") as pool:
+        assert pool.size == 2
+        results = dict(pool.imap(lambda client, item: item * 2, [1, 2, 3]))
+    assert results == {1: 2, 2: 4, 3: 6}
+
+
+def test_unexpected_connection_error_is_reported():
+    with _pool("a", "fail") as pool:
+        assert pool.size == 1
+
+
+def test_every_client_failing_raises():
+    with pytest.raises(Exception, match="could connect"):
+        with _pool("fail"):
+            pass
+
+
+def test_slow_client_does_not_block_the_pool():
+    with _pool("a", "slow") as pool:
+        assert pool.size == 1
+        release.set()  # The slow client disconnects rather than joining the pool
+        assert dict(pool.imap(lambda client, item: item, [1, 2])) == {1: 1, 2: 2}
@@ -0,0 +1,46 @@
+import re
+import sys
+import time
+
+import pytest
+from telethon.types import User
+
+from helper import logger
+from helper.dialogs import DialogSnapshot
+
+
+@pytest.fixture
+def scrape(workdir, monkeypatch):
+    """
+    The scrape.py module, as run with `--get-messages --daemon`.
+    """
+    monkeypatch.setattr(sys, "argv", ["scrape.py", "--get-messages", "--daemon"])
+    sys.modules.pop("scrape", None)
+    import scrape
+
+    yield scrape
+    sys.modules.pop("scrape", None)
+
+
+def test_polling_cycle_is_written_into_a_timestamped_subfolder(scrape, monkeypatch):
+    output_dirs: list[str] = []
+    monkeypatch.setattr(
+        scrape, "get_dialogs", lambda client: [DialogSnapshot(User(id=1), 0, 0, 0)]
+    )
+    monkeypatch.setattr(
+        scrape,
+        "collect_entity",
+        lambda client, dialog: output_dirs.append(logger.OUTPUT_DIR),
+    )
+    monkeypatch.setattr(scrape, "write_run_report", lambda: None)
+
+    def _interrupt(seconds: float):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(time, "sleep", _interrupt)
+
+    assert scrape.run_daemon(None, None) == 1
+    assert re.fullmatch(
+        re.escape(logger.RUN_OUTPUT_DIR) + r"/\d{4}-\d{2}-\d{2}T\d{2}-\d{2}-\d{2}Z",
+        output_dirs[0],
+    )
@@ -0,0 +1,108 @@
+import os
+import re
+from datetime import datetime, timezone
+
+import pytest
+from telethon.types import Channel
+
+from helper import dataset
+
+
+@pytest.fixture
+def entity(workdir):
+    return Channel(
+        id=7,
+        title="Channel",
+        photo=None,
+        date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        broadcast=True,
+    )
+
+
+def _messages(*message_ids: int, text: str = "") -> list[dict]:
+    return [
+        {"id": message_id, "message": f"{text}{message_id}"} for message_id in message_ids
+    ]
+
+
+def _segments(entity) -> list[dict]:
+    return dataset.read_manifest(dataset.get_data_dir(entity, "messages"))["segments"]
+
+
+def _read(entity) -> list[dict]:
+    return list(dataset.read(dataset.get_data_dir(entity, "messages"), "messages"))
+
+
+def test_segment_is_added_to_the_manifest(entity):
+    dataset.add_segment(entity, "messages", _messages(3, 1, 2))
+
+    segments = _segments(entity)
+    assert len(segments) == 1
+    assert segments[0]["first_id"] == 1
+    assert segments[0]["last_id"] == 3
+    assert segments[0]["count"] == 3
+    assert re.fullmatch(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z", segments[0]["created"])
+    assert [message["id"] for message in _read(entity)] == [1, 2, 3]
+
+
+def test_read_keeps_the_most_recent_copy(entity):
+    dataset.add_segment(entity, "messages", _messages(1, 2))
+    dataset.add_segment(entity, "messages", _messages(2, 3, text="edited "))
+
+    assert _read(entity) == [
+        {"id": 1, "message": "1"},
+        {"id": 2, "message": "edited 2"},
+        {"id": 3, "message": "edited 3"},
+    ]
+
+
+def test_segments_of_a_size_tier_are_compacted(entity):
+    for message_id in range(1, dataset.COMPACT_THRESHOLD + 1):
+        dataset.add_segment(entity, "messages", _messages(message_id))
+
+    segments = _segments(entity)
+    assert len(segments) == 1
+    assert segments[0]["count"] == dataset.COMPACT_THRESHOLD
+    assert len(os.listdir(dataset.get_data_dir(entity, "messages"))) == 2  # With the manifest
+
+
+def test_compaction_does_not_rewrite_larger_segments(entity):
+    large: list[dict] = _messages(*range(1, 101))
+    dataset.add_segment(entity, "messages", large)
+    large_file: str = _segments(entity)[0]["file"]
+
+    for message_id in range(101, 101 + dataset.COMPACT_THRESHOLD):
+        dataset.add_segment(entity, "messages", _messages(message_id, text="new "))
+
+    segments = _segments(entity)
+    assert [segment["file"] for segment in segments][0] == large_file
+    assert [segment["count"] for segment in segments] == [100, dataset.COMPACT_THRESHOLD]
+    assert len(_read(entity)) == 100 + dataset.COMPACT_THRESHOLD
+
+
+def test_compaction_keeps_the_most_recent_copy(entity):
+    dataset.add_segment(entity, "messages", _messages(1, 2))
+    for _ in range(dataset.COMPACT_THRESHOLD - 1):
+        dataset.add_segment(entity, "messages", _messages(2, text="edited "))
+
+    assert len(_segments(entity)) == 1
+    assert _read(entity) == [{"id": 1, "message": "1"}, {"id": 2, "message": "edited 2"}]
+
+
+def test_corrupted_segment_is_marked_and_skipped(entity):
+    dataset.add_segment(entity, "messages", _messages(1))
+    data_dir: str = dataset.get_data_dir(entity, "messages")
+    with open(os.path.join(data_dir, _segments(entity)[0]["file"]), "a") as file:
+        file.write(" ")
+
+    for message_id in range(2, 2 + dataset.COMPACT_THRESHOLD):
+        dataset.add_segment(entity, "messages", _messages(message_id))
+
+    segments = _segments(entity)
+    assert segments[0]["corrupted"] is True
+    # The segments added after the corrupted segment are compacted without it
+    assert [segment["count"] for segment in segments] == [1, dataset.COMPACT_THRESHOLD]
+    assert [message["id"] for message in _read(entity)] == list(
+        range(2, 2 + dataset.COMPACT_THRESHOLD)
+    )
+
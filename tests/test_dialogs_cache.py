@@ -0,0 +1,77 @@
+import sqlite3
+import time
+
+from telethon.types import InputPeerUser, User
+
+from helper import db, dialogs, helper
+
+
+class _Client:
+    """
+    Client of an account, which only enumerates its dialogs.
+    """
+
+    def __init__(self, user_id: int, entity_ids: list[int]):
+        self.user_id = user_id
+        self.entity_ids = entity_ids
+        self.enumerations = 0
+
+    def get_me(self, input_peer: bool = False):
+        return InputPeerUser(self.user_id, 0)
+
+    def get_dialogs(self, limit=None):
+        self.enumerations += 1
+        return [_Dialog(User(id=entity_id)) for entity_id in self.entity_ids]
+
+
+class _Dialog:
+    def __init__(self, entity: User):
+        self.entity = entity
+        self.unread_count = 0
+        self.message = None
+        self.date = None
+
+
+def _get_dialogs(client: _Client) -> list[int]:
+    dialogs.invalidate()
+    return [dialog.entity.id for dialog in dialogs.get_dialogs(client)]
+
+
+def test_dialogs_are_cached_per_account(workdir, monkeypatch):
+    monkeypatch.setattr(helper, "dialogs_ttl", 3600)
+    account_a = _Client(100, [1, 2])
+    account_b = _Client(200, [3])
+
+    assert _get_dialogs(account_a) == [1, 2]
+    assert _get_dialogs(account_b) == [3]
+    assert _get_dialogs(account_a) == [1, 2]
+    assert _get_dialogs(account_b) == [3]
+
+    assert account_a.enumerations == 1
+    assert account_b.enumerations == 1
+
+
+def test_caching_an_account_keeps_other_accounts(workdir):
+    now = int(time.time())
+    db.dialogs_cache_insert(100, [(b"a", 0, 0, 0)], now - 100)
+    db.dialogs_cache_insert(200, [(b"b", 0, 0, 0)], now)
+
+    assert db.dialogs_cache_get(100, now - 200) == [(b"a", 0, 0, 0)]
+    assert db.dialogs_cache_get(100, now - 50) is None
+    assert db.dialogs_cache_get(200, now - 50) == [(b"b", 0, 0, 0)]
+    assert db.dialogs_cache_get(300, now - 200) is None
+
+
+def test_cache_without_accounts_is_dropped(workdir):
+    conn = sqlite3.connect(db.sqlite_db_name)
+    conn.execute("DROP TABLE Dialogs_cache;")
+    conn.execute(
+        "CREATE TABLE Dialogs_cache (position INTEGER PRIMARY KEY, entity BLOB, unread_count INTEGER, top_message_id INTEGER, date INTEGER, cached_timestamp INTEGER);"
+    )
+    conn.execute("INSERT INTO Dialogs_cache VALUES (0, x'00', 0, 0, 0, 0);")
+    conn.commit()
+    conn.close()
+
+    db.start_database()
+
+    assert db.dialogs_cache_get(100, 0) is None
@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+
+from telethon.types import Channel, User, UserStatusOffline
+
+import pytest
+
+import scrape_entities
+from helper.db import entities_metadata_get, entities_metadata_update
+
+
+def _user(was_online: int, first_name: str = "Alice") -> dict:
+    return User(
+        id=1,
+        first_name=first_name,
+        username="alice",
+        status=UserStatusOffline(datetime.fromtimestamp(was_online, timezone.utc)),
+    ).to_dict()
+
+
+def _channel(title: str) -> dict:
+    return Channel(
+        id=2,
+        title=title,
+        photo=None,
+        date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        username="news",
+        participants_count=10,
+    ).to_dict()
+
+
+def _detect_changes(entities: list[dict]) -> tuple[list[dict], list[dict]]:
+    """
+    Detects changes and records the new metadata, as after a successful export.
+    """
+    changed, changes, new_metadata = scrape_entities._detect_changes(entities, 1000)
+    entities_metadata_update(new_metadata, 1000)
+    return changed, changes
+
+
+def test_new_entities_are_changed(workdir):
+    changed, changes = _detect_changes([_user(1000), _channel("News")])
+
+    assert [entity["id"] for entity in changed] == [1, 2]
+    assert all(change["previous"] is None for change in changes)
+
+
+def test_user_status_is_not_a_change(workdir):
+    _detect_changes([_user(1000)])
+
+    changed, _ = _detect_changes([_user(2000)])
+
+    assert changed == []
+
+
+def test_metadata_change_is_detected(workdir):
+    _detect_changes([_user(1000), _channel("News")])
+
+    changed, changes = _detect_changes(
+        [_user(2000, "Alicia"), _channel("Breaking News")]
+    )
+
+    assert [entity["id"] for entity in changed] == [1, 2]
+    assert changes[1]["previous"]["title"] == "News"
+    assert changes[1]["current"]["title"] == "Breaking News"
+
+
+def test_changes_are_detected_again_if_their_export_fails(workdir, monkeypatch):
+    def _download(data: list[dict], data_type: str) -> str:
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(scrape_entities, "_collect", lambda client: [_user(1000)])
+    monkeypatch.setattr(scrape_entities, "_download", _download)
+
+    with pytest.raises(OSError):
+        scrape_entities.scrape(None)
+
+    assert entities_metadata_get() == {}
+    changed, _ = _detect_changes([_user(1000)])
+    assert [entity["id"] for entity in changed] == [1]
@@ -0,0 +1,99 @@
+import asyncio
+import glob
+from types import SimpleNamespace
+
+import pytest
+from telethon.types import PeerChannel
+
+import scrape_messages
+from helper import columnar
+
+
+class _Client:
+    """
+    Client delivering a list of messages per flush interval, then interrupted.
+    """
+
+    def __init__(self, intervals: list[list[int]]):
+        self.intervals = intervals
+        self.handlers = []
+        self.loop = SimpleNamespace(run_until_complete=self._run_interval)
+
+    def add_event_handler(self, handler, event):
+        if handler not in self.handlers:
+            self.handlers.append(handler)
+
+    def remove_event_handler(self, handler):
+        self.handlers.remove(handler)
+
+    def _run_interval(self, coroutine):
+        coroutine.close()
+        if len(self.intervals) == 0:
+            raise KeyboardInterrupt
+        for message_id in self.intervals.pop(0):
+            message = SimpleNamespace(id=message_id, peer_id=PeerChannel(5))
+            for handler in self.handlers:
+                asyncio.run(handler(SimpleNamespace(message=message)))
+
+
+@pytest.fixture
+def flushes(workdir, monkeypatch):
+    """
+    Batches of message ids flushed, failing the first flush of each batch listed in
+    `fail`.
+    """
+    flushes = SimpleNamespace(done=[], fail=[])
+
+    def _flush(entity, messages):
+        message_ids = [message.id for message in messages]
+        if message_ids in flushes.fail:
+            flushes.fail.remove(message_ids)
+            raise RuntimeError("Elasticsearch is down")
+        flushes.done.append(message_ids)
+
+    monkeypatch.setattr(scrape_messages, "_flush", _flush)
+    return flushes
+
+
+@pytest.fixture
+def entity():
+    return SimpleNamespace(id=5)
+
+
+def test_messages_are_flushed_in_batches(flushes, entity):
+    scrape_messages.listen(_Client([[1, 2], [], [3]]), [entity], flush_interval=0)
+
+    assert flushes.done == [[1, 2], [3]]
+
+
+def test_failed_flush_keeps_the_messages_buffered(flushes, entity):
+    flushes.fail.append([1, 2])
+
+    scrape_messages.listen(_Client([[1, 2], [3]]), [entity], flush_interval=0)
+
+    assert flushes.done == [[1, 2, 3]]
+
+
+def test_messages_are_dropped_after_repeated_failures(flushes, entity, monkeypatch):
+    monkeypatch.setattr(scrape_messages, "LIVE_FLUSH_MAX_ATTEMPTS", 2)
+    flushes.fail.extend([[1], [1, 2]])
+
+    scrape_messages.listen(_Client([[1], [2], [3]]), [entity], flush_interval=0)
+
+    assert flushes.done == [[3]]
+
+
+def test_parquet_files_are_readable_after_each_flush(workdir, entity, monkeypatch):
+    def _process(messages, entity):
+        iocs = [{"message_id": message.id} for message in messages]
+        columnar.export(entity, "iocs", iocs)
+        return len(messages), len(messages)
+
+    monkeypatch.setattr(scrape_messages, "_process", _process)
+    messages = [SimpleNamespace(id=1), SimpleNamespace(id=2)]
+
+    scrape_messages._flush(entity, messages)
+
+    paths = glob.glob(f"{columnar.PARQUET_DIR}/**/*", recursive=True)
+    assert [path for path in paths if path.endswith(".tmp")] == []
+    assert len([path for path in paths if path.endswith(".parquet")]) == 1
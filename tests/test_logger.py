@@ -0,0 +1,55 @@
+import json
+import logging
+import os
+import re
+
+import pytest
+
+from helper import logger
+
+
+@pytest.fixture
+def log_dir(workdir, monkeypatch):
+    """
+    Configures logging into the test's output folder, instead of pytest's handlers.
+    """
+    monkeypatch.setattr(logging.root, "handlers", [])
+    monkeypatch.setattr(logging.root, "level", logging.root.level)
+    os.makedirs(logger.OUTPUT_DIR)
+    logger.configure_logging()
+    yield logger.OUTPUT_DIR
+    logger.stop_logging()
+
+
+def _read_logs(log_dir: str) -> tuple[list[str], list[dict]]:
+    logger.stop_logging()
+    with open(os.path.join(log_dir, logger.LOG_FILE_NAME), encoding="utf-8") as file:
+        lines: list[str] = file.read().splitlines()
+    with open(os.path.join(log_dir, logger.JSON_LOG_FILE_NAME), encoding="utf-8") as file:
+        records: list[dict] = [json.loads(line) for line in file]
+    return lines, records
+
+
+def test_logs_are_written_as_text_and_json_lines(log_dir):
+    logging.info("Привет")
+
+    lines, records = _read_logs(log_dir)
+
+    # Same text format as before the JSON log file was added
+    assert re.fullmatch(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2} INFO Привет", lines[-1])
+    assert records[-1]["message"] == "Привет"
+    assert records[-1]["level"] == "INFO"
+    assert len(lines) == len(records)
+
+
+def test_repetitive_messages_are_sampled(log_dir):
+    for i in range(logger.SAMPLED_MAX_RECORDS + 5):
+        logging.info(f"Collected chunk {i}", extra=logger.SAMPLED)
+    logging.warning("Not sampled")
+
+    lines, _ = _read_logs(log_dir)
+
+    assert len([line for line in lines if "Collected chunk" in line]) == (
+        logger.SAMPLED_MAX_RECORDS
+    )
+    assert lines[-1].endswith("WARNING Not sampled")
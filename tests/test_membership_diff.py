@@ -0,0 +1,122 @@
+from types import SimpleNamespace
+
+import pytest
+from telethon.types import User
+
+import scrape_participants
+from helper import output_format
+from helper.db import participants_snapshot_get
+from helper.membership import decode_ids, diff_sorted_ids, encode_ids
+
+
+@pytest.fixture
+def entity():
+    return SimpleNamespace(id=42)
+
+
+@pytest.fixture(autouse=True)
+def entity_type(monkeypatch):
+    monkeypatch.setattr(
+        scrape_participants, "get_entity_type_name", lambda entity: "Public Group"
+    )
+
+
+def _users(*user_ids: int) -> list[dict]:
+    return [{"id": user_id, "username": f"user{user_id}"} for user_id in user_ids]
+
+
+def _events(entity) -> list[dict]:
+    path = output_format.find(
+        f"{scrape_participants.logger.OUTPUT_DIR}/Public Group_{entity.id}/membership_{entity.id}"
+    )
+    return list(output_format.read(path))
+
+
+def test_diff_sorted_ids():
+    assert diff_sorted_ids([1, 2, 3], [2, 3, 4]) == ([4], [1])
+    assert diff_sorted_ids([], [1, 2]) == ([1, 2], [])
+    assert diff_sorted_ids([1, 2], []) == ([], [1, 2])
+
+
+def test_encode_ids_sorts_and_removes_duplicates():
+    assert list(decode_ids(encode_ids([3, 1, 3, 2]))) == [1, 2, 3]
+    assert list(decode_ids(None)) == []
+
+
+def test_first_collection_is_the_baseline(workdir, entity):
+    participants = _users(1, 2, 3)
+
+    assert scrape_participants._diff_membership(entity, participants, True) == participants
+    assert list(decode_ids(participants_snapshot_get(entity.id))) == [1, 2, 3]
+
+
+def test_complete_collection_records_joins_and_leaves(workdir, entity):
+    scrape_participants._diff_membership(entity, _users(1, 2, 3), True)
+
+    joined = scrape_participants._diff_membership(entity, _users(2, 3, 4), True)
+
+    assert [user["id"] for user in joined] == [4]
+    assert sorted((event["event"], event["user_id"]) for event in _events(entity)) == [
+        ("join", 4),
+        ("leave", 1),
+    ]
+    assert list(decode_ids(participants_snapshot_get(entity.id))) == [2, 3, 4]
+
+
+def test_incomplete_collection_records_no_leaves(workdir, entity):
+    scrape_participants._diff_membership(entity, _users(1, 2, 3), True)
+
+    joined = scrape_participants._diff_membership(entity, _users(3, 4), False)
+
+    assert [user["id"] for user in joined] == [4]
+    assert [(event["event"], event["user_id"]) for event in _events(entity)] == [
+        ("join", 4)
+    ]
+    # Participants who were not enumerated are kept in the snapshot
+    assert list(decode_ids(participants_snapshot_get(entity.id))) == [1, 2, 3, 4]
+
+
+class _Client:
+    """
+    Client returning a fixed list of participants.
+    """
+
+    def __init__(self, user_ids):
+        self.users = [User(id=user_id, username=f"user{user_id}") for user_id in user_ids]
+
+    def get_participants(self, entity, limit=None):
+        return list(self.users)
+
+    def iter_participants(self, entity, limit=None):
+        return iter(self.users)
+
+
+@pytest.fixture
+def collection(workdir, monkeypatch):
+    monkeypatch.setattr(
+        scrape_participants, "call_api", lambda func, *args, **kwargs: func(*args, **kwargs)
+    )
+    monkeypatch.setattr(scrape_participants.helper, "membership_diff", True)
+    monkeypatch.setattr(scrape_participants.helper, "record_responses", False)
+    monkeypatch.setattr(scrape_participants, "PARTICIPANTS_API_LIMIT", 3)
+
+
+def test_partial_collection_above_the_api_limit_records_no_leaves(collection, entity):
+    scrape_participants._collect_all_under_10k(_Client([1, 2, 3, 4]), entity, 4)
+
+    # Telegram only returns up to the API limit: participant 4 is missing, not gone
+    scrape_participants._collect_all_under_10k(_Client([1, 2, 3]), entity, 4)
+
+    assert _events(entity) == []
+    assert list(decode_ids(participants_snapshot_get(entity.id))) == [1, 2, 3, 4]
+
+
+def test_full_collection_above_the_api_limit_records_leaves(collection, entity):
+    scrape_participants._collect_all_under_10k(_Client([1, 2, 3, 4]), entity, 4)
+
+    scrape_participants._collect_all_under_10k(_Client([2, 3, 4, 5]), entity, 4)
+
+    assert sorted((event["event"], event["user_id"]) for event in _events(entity)) == [
+        ("join", 5),
+        ("leave", 1),
+    ]
@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+
+from telethon.types import Message, PeerChannel, PeerUser
+
+from helper.message_record import MessageRecord
+
+
+def _message() -> Message:
+    return Message(
+        id=10,
+        peer_id=PeerChannel(7),
+        date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        message="Bonjour",
+        from_id=PeerUser(3),
+    )
+
+
+def test_record_from_message():
+    record = MessageRecord.from_message(_message())
+
+    assert (record.id, record.entity_id, record.sender_user_id) == (10, 7, 3)
+    assert record.sender_channel_id is None
+    assert record.text == "Bonjour"
+
+
+def test_to_dict_is_the_full_message_with_its_translation():
+    record = MessageRecord.from_message(_message())
+    record.text_translated = "Hello"
+
+    message_dict = record.to_dict()
+
+    assert message_dict == {**_message().to_dict(), "message_translated": "Hello"}
+
+
+def test_record_from_dict_shares_the_dictionary():
+    message_dict = _message().to_dict()
+    record = MessageRecord.from_dict(message_dict)
+
+    assert (record.id, record.entity_id, record.sender_user_id) == (10, 7, 3)
+    assert record.to_dict() is message_dict
@@ -0,0 +1,53 @@
+import logging
+import os
+import runpy
+import sys
+
+import pytest
+
+from helper import logger
+
+ROOT_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def run_tool(workdir, monkeypatch):
+    """
+    Runs an offline tool as a script from the repository (i.e.: to read the IOC
+    patterns), restoring the logging configuration afterwards.
+    """
+    monkeypatch.setattr(logging.root, "handlers", [])
+    monkeypatch.setattr(logging.root, "level", logging.root.level)
+    monkeypatch.setattr(logger, "RUN_OUTPUT_DIR", logger.RUN_OUTPUT_DIR)
+
+    def _run(script_name: str, *argv: str):
+        monkeypatch.setattr(sys, "argv", [script_name, *argv])
+        monkeypatch.chdir(ROOT_DIR)
+        try:
+            runpy.run_path(os.path.join(ROOT_DIR, script_name), run_name="__main__")
+        finally:
+            logger.stop_logging()
+
+    return _run
+
+
+@pytest.mark.parametrize(
+    "script_name, output_dir",
+    [("reprocess.py", "output_reprocessed"), ("convert_ndjson.py", "output_ndjson")],
+)
+def test_logs_are_not_written_into_the_input_folder(
+    workdir, run_tool, script_name, output_dir
+):
+    input_dir: str = str(workdir / "output")
+    output_dir = str(workdir / output_dir)
+    os.makedirs(f"{input_dir}/2024-03-18T04-21-06Z")
+
+    run_tool(
+        script_name, "--input-dir", input_dir, "--output-dir", output_dir, "--workers", "1"
+    )
+
+    assert os.listdir(input_dir) == ["2024-03-18T04-21-06Z"]
+    logs_dir: str = f"{output_dir}/logs/{logger.DATETIME_CODE_EXECUTED}"
+    assert sorted(os.listdir(logs_dir)) == sorted(
+        [logger.LOG_FILE_NAME, logger.JSON_LOG_FILE_NAME]
+    )
@@ -0,0 +1,97 @@
+import json
+import os
+
+import pytest
+
+from helper import output_format
+
+RECORDS: list[dict] = [
+    {"id": 1, "date": "2024-01-01T00:00:00+00:00", "message": "Привет"},
+    {"id": 2, "date": "2024-01-02T00:00:00+00:00", "message": "hello"},
+    {"id": 3, "date": "2024-01-03T00:00:00+00:00", "message": "日本語"},
+]
+
+FORMATS: list[str] = [
+    format_name
+    for format_name in output_format.FORMATS
+    if format_name != "ndjson-zstd" or output_format.zstd_available()
+]
+
+
+@pytest.mark.parametrize("format_name", FORMATS)
+def test_records_are_read_back(workdir, format_name):
+    path = output_format.write(str(workdir / "messages"), RECORDS, format_name)
+
+    assert path.endswith(output_format.FORMATS[format_name])
+    assert list(output_format.read(path)) == RECORDS
+    assert output_format.find(str(workdir / "messages")) == path
+    assert output_format.strip_extension(path) == str(workdir / "messages")
+
+
+@pytest.mark.parametrize("format_name", FORMATS)
+def test_no_records_are_read_back(workdir, format_name):
+    path = output_format.write(str(workdir / "messages"), [], format_name)
+
+    assert list(output_format.read(path)) == []
+
+
+def test_json_is_a_pretty_printed_list(workdir):
+    path = output_format.write(str(workdir / "messages"), RECORDS, "json")
+
+    with open(path, encoding="utf-8") as file:
+        assert json.load(file) == RECORDS
+
+
+def test_json_object_is_read_as_one_record(workdir):
+    with open(workdir / "entity.json", "w", encoding="utf-8") as file:
+        json.dump(RECORDS[0], file)
+
+    assert list(output_format.read(str(workdir / "entity.json"))) == [RECORDS[0]]
+
+
+def test_writer_counts_bytes_not_characters(workdir):
+    writer = output_format._Writer(str(workdir / "messages.ndjson"))
+    for record in RECORDS:
+        writer.write(record)
+    writer.close()
+
+    assert writer.count == len(RECORDS)
+    assert writer.bytes == os.path.getsize(writer.path)
+
+
+def test_segments_roll_over_by_bytes(workdir, monkeypatch):
+    monkeypatch.setattr(output_format.helper, "output_format", "ndjson")
+    path_without_extension = str(workdir / "messages")
+    # The first record has more bytes than characters
+    first_line: str = output_format.serialization.dumps(RECORDS[0]) + "\n"
+
+    paths = output_format.write_segments(
+        path_without_extension, RECORDS, max_bytes=len(first_line.encode("utf-8"))
+    )
+
+    segments = output_format.read_segment_index(path_without_extension)
+    assert [(segment["first_id"], segment["last_id"]) for segment in segments] == [
+        (1, 1),
+        (2, 3),
+    ]
+    assert [segment["bytes"] for segment in segments] == [
+        os.path.getsize(path) for path in paths
+    ]
+    assert output_format.find_segments(path_without_extension, first_id=3) == [paths[1]]
+    assert [record for path in paths for record in output_format.read(path)] == RECORDS
+
+
+def test_glob_matches_every_format_but_segment_indexes(workdir, monkeypatch):
+    monkeypatch.setattr(output_format.helper, "output_format", "ndjson")
+    output_format.write(str(workdir / "messages_1"), RECORDS, "json")
+    output_format.write(str(workdir / "messages_2"), RECORDS, "ndjson-gzip")
+    output_format.write_segments(str(workdir / "messages_3"), RECORDS, max_records=2)
+
+    paths = output_format.glob(str(workdir / "messages_*"))
+
+    assert [os.path.basename(path) for path in paths] == [
+        "messages_1.json",
+        "messages_2.ndjson.gz",
+        "messages_3_seg0001.ndjson",
+        "messages_3_seg0002.ndjson",
+    ]
@@ -0,0 +1,86 @@
+from datetime import datetime, timezone
+
+import pytest
+from telethon.tl.types.channels import ChannelParticipants
+from telethon.types import Channel, ChannelParticipant, User
+
+import scrape_participants
+
+
+class _Client:
+    """
+    Client returning the participants of a channel, one page per GetParticipantsRequest.
+    """
+
+    def __init__(self, pages: list[list[int]]):
+        self.pages = pages
+        self.offsets: list[int] = []
+
+    def __call__(self, request):
+        self.offsets.append(request.offset)
+        user_ids = self.pages.pop(0) if self.pages else []
+        return ChannelParticipants(
+            count=0,
+            participants=[
+                ChannelParticipant(user_id=user_id, date=datetime(2024, 1, 1))
+                for user_id in user_ids
+            ],
+            chats=[],
+            # Users referenced by participants are not necessarily participants
+            users=[User(id=user_id) for user_id in user_ids] + [User(id=999)],
+        )
+
+
+@pytest.fixture
+def channel(monkeypatch):
+    monkeypatch.setattr(
+        scrape_participants, "call_api", lambda func, *args, **kwargs: func(*args, **kwargs)
+    )
+    monkeypatch.setattr(scrape_participants, "throttle", lambda: None)
+    return Channel(
+        id=7,
+        title="Group",
+        photo=None,
+        date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        megagroup=True,
+    )
+
+
+def test_channel_participants_are_collected_page_by_page(channel):
+    client = _Client([[1, 2], [2, 3]])
+
+    pages = [
+        [user.id for user in users]
+        for users in scrape_participants._iter_participant_pages(client, channel)
+    ]
+
+    assert pages == [[1, 2], [3]]  # Without duplicates nor referenced users
+    assert client.offsets == [0, 2, 4]
+
+
+def test_buffer_is_closed_when_collection_fails(channel, monkeypatch):
+    buffers = []
+
+    class _SpillBuffer(scrape_participants.SpillBuffer):
+        __slots__ = ("closed",)
+
+        def __init__(self, max_bytes: int = 0):
+            super().__init__(max_bytes)
+            self.closed = False
+            buffers.append(self)
+
+        def close(self):
+            super().close()
+            self.closed = True
+
+    def _pages(client, entity):
+        yield [User(id=1)]
+        raise ConnectionError("Connection to Telegram failed")
+
+    monkeypatch.setattr(scrape_participants, "SpillBuffer", _SpillBuffer)
+    monkeypatch.setattr(scrape_participants, "_iter_participant_pages", _pages)
+
+    with pytest.raises(ConnectionError):
+        scrape_participants._collect_all_under_10k(None, channel, 2)
+
+    assert [buffer.closed for buffer in buffers] == [True]
@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+
+import pytest
+from telethon.types import Channel, Message, PeerChannel
+
+import scrape_messages
+from helper import dataset, output_format
+from helper.spill_buffer import SpillBuffer
+
+
+def _messages(count: int) -> list[Message]:
+    return [
+        Message(
+            id=message_id,
+            peer_id=PeerChannel(7),
+            date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            message=f"Message {message_id} from https://example.com/{message_id}",
+        )
+        for message_id in range(1, count + 1)
+    ]
+
+
+@pytest.fixture
+def entity():
+    return Channel(
+        id=7,
+        title="News",
+        photo=None,
+        date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        broadcast=True,
+    )
+
+
+@pytest.fixture
+def chunks(workdir, monkeypatch):
+    """
+    Number of messages of each chunk enriched, without translation workers.
+    """
+    chunks: list[int] = []
+    enrich = scrape_messages._enrich
+
+    def _enrich(messages):
+        chunks.append(len(messages))
+        return enrich(messages)
+
+    monkeypatch.setattr(scrape_messages, "_enrich", _enrich)
+    monkeypatch.setattr(scrape_messages, "_get_executor", lambda: _Executor())
+    monkeypatch.setattr(
+        scrape_messages, "translate_texts", lambda texts: [None] * len(texts)
+    )
+    return chunks
+
+
+class _Executor:
+    def map(self, func, iterable):
+        return map(func, iterable)
+
+
+def _output(entity: Channel, data_type: str) -> list[dict]:
+    path: str = output_format.find(
+        f"{scrape_messages.logger.OUTPUT_DIR}/broadcast_channel_{entity.id}/{data_type}_{entity.id}"
+    )
+    return list(output_format.read(path))
+
+
+def test_spilled_messages_are_processed_in_chunks(chunks, entity):
+    buffer = SpillBuffer(max_bytes=2000)
+    try:
+        for first_id in range(0, 100, 10):
+            buffer.extend(_messages(100)[first_id : first_id + 10])
+
+        assert scrape_messages._process(buffer, entity) == (100, 200)
+    finally:
+        buffer.close()
+
+    assert len(chunks) > 1
+    assert sum(chunks) == 100
+    assert [message["id"] for message in _output(entity, "messages")] == list(
+        range(1, 101)
+    )
+    assert len(_output(entity, "iocs")) == 200  # URL and domain
+    data_dir: str = dataset.get_data_dir(entity, "messages")
+    assert [message["id"] for message in dataset.read(data_dir, "messages")] == list(
+        range(1, 101)
+    )
+
+
+def test_messages_in_memory_are_processed_at_once(chunks, entity):
+    assert scrape_messages._process(_messages(10), entity) == (10, 20)
+
+    assert chunks == [10]
+    assert len(_output(entity, "messages")) == 10
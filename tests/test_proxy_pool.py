@@ -0,0 +1,80 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telethon.sessions import StringSession
+
+from helper import proxy_pool
+from helper.proxy_pool import ProxyPool
+
+
+class _Client:
+    """
+    Client connecting instantly, except through the proxy named "fail".
+    """
+
+    def __init__(self, session, api_id, api_hash, proxy=None, **kwargs):
+        self.proxy = proxy
+        self.connected = False
+
+    async def connect(self):
+        if self.proxy["addr"] == "fail":
+            raise RuntimeError("Unexpected error")
+        self.connected = True
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def disconnect(self):
+        self.connected = False
+
+
+@pytest.fixture
+def main_client(monkeypatch):
+    monkeypatch.setattr(proxy_pool, "TelegramClient", _Client)
+    loop = asyncio.new_event_loop()
+    yield SimpleNamespace(session=StringSession(), loop=loop)
+    loop.run_until_complete(asyncio.sleep(0))  # Connections started in the background
+    loop.close()
+
+
+def _pool(main_client, *addrs: str, rotate_requests: int = 20) -> ProxyPool:
+    return ProxyPool(
+        main_client,
+        [{"proxy_type": "socks5", "addr": addr, "port": 1080} for addr in addrs],
+        rotate_requests=rotate_requests,
+    )
+
+
+def _warm_up(pool: ProxyPool, main_client):
+    pool._warm_up()
+    main_client.loop.run_until_complete(asyncio.sleep(0))
+
+
+def test_rotates_once_the_budget_is_used_up(main_client):
+    pool = _pool(main_client, "a", "b", rotate_requests=20)
+    _warm_up(pool, main_client)
+
+    clients = [pool.rotate(main_client, 5)]
+    for _ in range(4):
+        clients.append(pool.rotate(clients[-1], 5))
+
+    assert clients[0] is not main_client
+    assert clients[1:4] == [clients[0]] * 3  # 20 API calls with the same client
+    assert clients[4] is not clients[0]
+
+
+def test_keeps_the_client_while_no_proxy_is_ready(main_client):
+    pool = _pool(main_client, "a")
+
+    assert pool.rotate(main_client, 5) is main_client
+
+
+def test_unexpected_connection_error_quarantines_the_proxy(main_client):
+    pool = _pool(main_client, "fail")
+    _warm_up(pool, main_client)
+
+    proxy = pool._proxies[0]
+    assert not proxy.warming
+    assert proxy.failures == 1
+    assert not proxy.ready
@@ -0,0 +1,104 @@
+import logging
+from datetime import timedelta
+
+import pytest
+from telethon import errors
+
+from helper import rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def limiters(monkeypatch):
+    slept: list[float] = []
+    monkeypatch.setattr(rate_limiter.time, "sleep", slept.append)
+    rate_limiter.configure(1, 10)
+    return slept
+
+
+def _flood_wait(seconds: int) -> errors.FloodWaitError:
+    return errors.FloodWaitError(request=None, capture=seconds)
+
+
+def test_flood_wait_is_retried_and_slows_down_calls(limiters):
+    responses = [_flood_wait(120), "result"]
+
+    def _call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    initial_rate: float = rate_limiter.get_limiter(rate_limiter.ACCOUNT_KEY).rate
+
+    assert rate_limiter.call_api(_call) == "result"
+    account = rate_limiter.get_limiter(rate_limiter.ACCOUNT_KEY)
+    assert account.flood_waits == 1
+    assert account.rate < initial_rate
+    assert limiters[0] >= 120  # Waited for the requested time before retrying
+
+
+def test_repeated_flood_waits_are_raised(limiters):
+    def _call():
+        raise _flood_wait(120)
+
+    with pytest.raises(errors.FloodWaitError):
+        rate_limiter.call_api(_call)
+    assert len(limiters) == rate_limiter.MAX_FLOOD_WAIT_RETRIES
+
+
+def test_slow_response_slows_down_calls():
+    limiter = rate_limiter.RateLimiter("test", rate=1, max_rate=2)
+    limiter.on_success(1)
+    limiter.on_success(1)
+    rate: float = limiter.rate
+
+    # i.e.: an overloaded proxy
+    limiter.on_success(30)
+
+    assert limiter.rate < rate
+
+
+def _telethon_flood_sleep(seconds: int, early: bool = False):
+    """
+    Logs the message of Telethon sleeping on a FloodWait, as in TelegramClient._call.
+    """
+    logging.getLogger(rate_limiter.TELETHON_FLOOD_LOGGER).info(
+        rate_limiter.TELETHON_FLOOD_MESSAGE,
+        " early" if early else "",
+        seconds,
+        timedelta(seconds=seconds),
+        "GetHistoryRequest",
+    )
+
+
+def test_flood_wait_slept_by_telethon_slows_down_calls(caplog):
+    caplog.set_level(logging.INFO)
+    account = rate_limiter.get_limiter(rate_limiter.ACCOUNT_KEY)
+    initial_rate: float = account.rate
+
+    def _call():
+        _telethon_flood_sleep(30)
+        _telethon_flood_sleep(10, early=True)  # Same FloodWait, already recorded
+        return "result"
+
+    assert rate_limiter.call_api(_call) == "result"
+    assert (account.flood_waits, account.flood_wait_seconds) == (1, 30)
+    assert account.calls == 1
+    assert account.rate < initial_rate
+    assert "1 FloodWaits (30 second(s))" in rate_limiter.get_summary()[0]
+
+
+def test_flood_wait_slept_by_telethon_is_not_a_slow_response(caplog, monkeypatch):
+    caplog.set_level(logging.INFO)
+    clock: list[float] = [0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: clock[0])
+    account = rate_limiter.get_limiter(rate_limiter.ACCOUNT_KEY)
+
+    def _call():
+        _telethon_flood_sleep(30)
+        clock[0] += 31
+        return "result"
+
+    rate_limiter.call_api(_call)
+
+    assert account.latency == 1
@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+
+from telethon.types import Channel, Chat, User
+
+from helper.db import messages_collection_insert_offset_id
+from helper.dialogs import DialogSnapshot
+from helper.scheduler import CHUNK_SIZE, Scheduler
+
+
+def _channel(entity_id: int, top_message_id: int) -> DialogSnapshot:
+    entity = Channel(
+        id=entity_id,
+        title="Channel",
+        photo=None,
+        date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    )
+    return DialogSnapshot(entity, 0, top_message_id, 0)
+
+
+def _chat(entity_id: int, unread_count: int) -> DialogSnapshot:
+    entity = Chat(
+        id=entity_id,
+        title="Chat",
+        photo=None,
+        participants_count=3,
+        date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        version=1,
+    )
+    return DialogSnapshot(entity, unread_count, 100, 0)
+
+
+def _user(entity_id: int, unread_count: int) -> DialogSnapshot:
+    return DialogSnapshot(User(id=entity_id), unread_count, 100, 0)
+
+
+def test_dialogs_are_ranked_by_expected_messages(workdir):
+    scheduler = Scheduler([_channel(1, 10), _channel(2, 5000), _chat(3, 50)])
+
+    assert [s.dialog.entity.id for s in scheduler.ranked] == [2, 3, 1]
+    assert [s.expected_messages for s in scheduler.ranked] == [5000, 50, 10]
+
+
+def test_no_budget_does_not_limit_api_calls(workdir):
+    dialogs = [_channel(1, 5000), _chat(2, 3), _user(3, 1)]
+    scheduler = Scheduler(dialogs)
+
+    assert [scheduler.allocate(dialog) for dialog in dialogs] == [None, None, None]
+
+
+def test_channel_without_new_messages_is_skipped(workdir):
+    messages_collection_insert_offset_id(1, 1, 200, 0, 0, 10, 0)
+    dialog = _channel(1, 200)
+    scheduler = Scheduler([dialog])
+
+    assert scheduler.allocate(dialog) == 0
+
+
+def test_budget_is_shared_by_expected_yield(workdir):
+    busy, quiet = _channel(1, 3000 * CHUNK_SIZE), _channel(2, 1000 * CHUNK_SIZE)
+    scheduler = Scheduler([busy, quiet], api_budget=100)
+
+    assert scheduler.allocate(busy) == 75
+    assert scheduler.allocate(quiet) == 25
+    assert scheduler.exhausted()
+
+
+def test_budget_caps_channels_to_the_calls_they_need(workdir):
+    dialog = _channel(1, 2 * CHUNK_SIZE)
+    scheduler = Scheduler([dialog], api_budget=100)
+
+    assert scheduler.allocate(dialog) == 3
+    assert scheduler.api_budget == 97
+
+
+def test_budget_does_not_cap_chats_to_their_unread_messages(workdir):
+    # The unread messages count is only a lower bound of the new messages of a chat
+    dialog = _chat(1, 1)
+    scheduler = Scheduler([dialog], api_budget=100)
+
+    assert scheduler.allocate(dialog) == 100
@@ -0,0 +1,83 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from helper import helper, serialization
+
+RECORD: dict = {
+    "id": 1,
+    "date": datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc),
+    "message": "Привет",
+    "media": {"bytes": b"\x00\xff"},
+}
+
+
+@pytest.fixture(params=serialization.available_backends())
+def backend(request, monkeypatch):
+    monkeypatch.setattr(serialization, "backend", request.param)
+    return request.param
+
+
+def test_backends_encode_datetimes_and_bytes(backend, monkeypatch):
+    monkeypatch.setattr(helper, "binary_encoding", "base64")
+
+    assert json.loads(serialization.dumps(RECORD)) == {
+        "id": 1,
+        "date": "2024-01-01T12:30:00+00:00",
+        "message": "Привет",
+        "media": {"bytes": "AP8="},
+    }
+
+
+@pytest.mark.parametrize(
+    "binary_encoding,encoded",
+    [
+        ("repr", "b'\\x00\\xff'"),
+        ("base64", "AP8="),
+        ("sha256", hashlib.sha256(b"\x00\xff").hexdigest()),
+    ],
+)
+def test_binary_encoding(backend, monkeypatch, binary_encoding, encoded):
+    monkeypatch.setattr(helper, "binary_encoding", binary_encoding)
+
+    line: str = serialization.dumps({"bytes": b"\x00\xff"})
+
+    assert json.loads(line)["bytes"] == encoded
+
+
+def test_integers_over_64_bits_fall_back_to_the_standard_library(backend):
+    assert serialization.dumps({"id": 2**70}) == '{"id":%d}' % 2**70
+
+
+def test_indent_matches_the_standard_library(backend):
+    record: dict = {"id": 1, "nested": {"list": [1, 2]}}
+
+    assert serialization.dumps(record, indent=True) == json.dumps(record, indent=2)
+
+
+def test_loads_reads_back_dumps(backend):
+    line: str = serialization.dumps({"id": 1, "message": "日本語"})
+
+    assert serialization.loads(line) == {"id": 1, "message": "日本語"}
+    assert serialization.loads(line.encode("utf-8")) == {"id": 1, "message": "日本語"}
+
+
+def test_canonical_encoding_does_not_depend_on_the_backend(monkeypatch):
+    hashes: set[bytes] = set()
+    for name in serialization.available_backends():
+        monkeypatch.setattr(serialization, "backend", name)
+        hashes.add(serialization.dumps_canonical({"b": 1, "a": RECORD["date"]}))
+
+    assert hashes == {b'{"a": "2024-01-01T12:30:00+00:00", "b": 1}'}
+
+
+def test_unsupported_backend_is_rejected():
+    with pytest.raises(Exception, match="Unsupported"):
+        serialization.set_backend("pickle")
+
+
+def test_unserializable_object_raises(backend):
+    with pytest.raises(TypeError):
+        serialization.dumps({"value": object()})
@@ -0,0 +1,77 @@
+from telethon.types import User
+
+from helper import spill_buffer
+from helper.spill_buffer import SpillBuffer
+
+
+def _users(first_id: int, count: int) -> list[User]:
+    return [
+        User(id=user_id, first_name="Привет" * 10, username=f"user{user_id}")
+        for user_id in range(first_id, first_id + count)
+    ]
+
+
+def test_without_budget_objects_stay_in_memory():
+    buffer = SpillBuffer()
+    buffer.extend(_users(1, 100))
+
+    assert len(buffer) == 100
+    assert buffer._file is None
+    assert [user.id for user in buffer] == list(range(1, 101))
+
+
+def test_objects_are_spilled_beyond_the_budget_and_read_back_in_order():
+    buffer = SpillBuffer(max_bytes=2000)
+    try:
+        for first_id in range(1, 101, 10):
+            buffer.extend(_users(first_id, 10))
+
+        assert buffer._file is not None
+        assert len(buffer) == 100
+        assert [user.id for user in buffer] == list(range(1, 101))
+        assert [user["username"] for user in buffer.to_dicts()][:2] == ["user1", "user2"]
+        assert len(buffer.to_dicts()) == 100
+    finally:
+        buffer.close()
+    assert len(buffer) == 0
+
+
+def test_size_is_estimated_from_a_sample(monkeypatch):
+    users: list[User] = _users(1, 100)
+    serialized: list[int] = []
+    original_bytes = User.__bytes__
+
+    def _bytes(user):
+        serialized.append(user.id)
+        return original_bytes(user)
+
+    monkeypatch.setattr(User, "__bytes__", _bytes)
+    buffer = SpillBuffer(max_bytes=10**9)
+    buffer.extend(users)
+
+    assert len(serialized) == 100 // spill_buffer.SIZE_SAMPLE_INTERVAL
+    actual_bytes: int = sum(len(original_bytes(user)) for user in users)
+    assert abs(buffer._memory_bytes - actual_bytes) <= actual_bytes * 0.1
+
+
+def test_chunks_are_bounded_by_the_budget():
+    buffer = SpillBuffer(max_bytes=2000)
+    try:
+        for first_id in range(1, 101, 10):
+            buffer.extend(_users(first_id, 10))
+
+        chunks: list[list[User]] = list(buffer.chunks())
+
+        assert len(chunks) > 1
+        assert [user.id for chunk in chunks for user in chunk] == list(range(1, 101))
+        for chunk in chunks:
+            assert sum(len(bytes(user)) for user in chunk) <= 2000
+    finally:
+        buffer.close()
+
+
+def test_without_budget_objects_are_in_a_single_chunk():
+    buffer = SpillBuffer()
+    buffer.extend(_users(1, 100))
+
+    assert [len(chunk) for chunk in buffer.chunks()] == [100]
@@ -0,0 +1,134 @@
+import sqlite3
+import time
+
+import pytest
+
+from helper import db, work_queue
+from helper.work_queue import EntityLease, LeaseLostError, check_lease
+
+
+def _expire(entity_id: int):
+    """
+    Expires the lease on an entity, as if its worker stopped renewing it.
+    """
+    conn = sqlite3.connect(db.sqlite_db_name)
+    conn.execute(
+        "UPDATE Work_queue SET lease_expires_timestamp = ? WHERE entity_id = ?",
+        (int(time.time()) - 1, entity_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_claimed_entity_is_not_claimed_by_other_workers(workdir):
+    db.work_queue_enqueue([1, 2])
+
+    assert db.work_queue_claim("a", [1, 2], 0, 300) == 1
+    assert db.work_queue_claim("b", [1, 2], 0, 300) == 2
+    assert db.work_queue_claim("c", [1, 2], 0, 300) is None
+
+
+def test_workers_only_claim_their_entities(workdir):
+    db.work_queue_enqueue([1, 2])
+
+    assert db.work_queue_claim("a", [2], 0, 300) == 2
+    assert db.work_queue_claim("a", [2], 0, 300) is None
+
+
+def test_expired_lease_is_claimed_again(workdir):
+    db.work_queue_enqueue([1])
+    db.work_queue_claim("a", [1], 0, 300)
+
+    _expire(1)
+
+    assert db.work_queue_claim("b", [1], 0, 300) == 1
+    assert db.work_queue_renew("a", 1, 300) is False
+    assert db.work_queue_renew("b", 1, 300) is True
+
+
+def test_completed_entity_is_not_claimed_again(workdir):
+    start_time: int = int(time.time())
+    db.work_queue_enqueue([1, 2])
+    db.work_queue_claim("a", [1, 2], start_time, 300)
+    db.work_queue_release("a", 1, True)
+
+    assert db.work_queue_claim("a", [1], start_time, 300) is None
+    assert db.work_queue_claim("a", [1], start_time + 1, 300) == 1
+
+
+def test_failed_entity_is_released_for_other_workers(workdir):
+    db.work_queue_enqueue([1])
+    db.work_queue_claim("a", [1], 0, 300)
+
+    db.work_queue_release("a", 1, False)
+
+    assert db.work_queue_claim("b", [1], 0, 300) == 1
+
+
+def test_release_by_another_worker_is_ignored(workdir):
+    db.work_queue_enqueue([1])
+    db.work_queue_claim("a", [1], 0, 300)
+
+    db.work_queue_release("b", 1, True)
+
+    assert db.work_queue_claim("b", [1], 0, 300) is None
+
+
+def test_lease_is_checked_only_in_worker_mode(workdir):
+    check_lease()
+
+    db.work_queue_enqueue([1])
+    db.work_queue_claim("a", [1], 0, 300)
+    with EntityLease("a", 1):
+        check_lease()
+    assert work_queue._current_lease is None
+
+
+def test_lost_lease_aborts_the_entity(workdir):
+    db.work_queue_enqueue([1])
+    db.work_queue_claim("a", [1], 0, 300)
+
+    with pytest.raises(LeaseLostError):
+        with EntityLease("a", 1):
+            _expire(1)
+            db.work_queue_claim("b", [1], 0, 300)
+            check_lease(renew=False)  # Not renewed yet
+            check_lease()
+
+    # The lease of the other worker is kept
+    assert db.work_queue_renew("b", 1, 300) is True
+
+
+def test_heartbeat_detects_lost_lease(workdir):
+    db.work_queue_enqueue([1])
+    db.work_queue_claim("a", [1], 0, 3)
+
+    with EntityLease("a", 1, lease_seconds=3) as lease:
+        db.work_queue_release("a", 1, False)
+        db.work_queue_claim("b", [1], 0, 300)
+        lease._heartbeat.join(timeout=5)
+
+        with pytest.raises(LeaseLostError):
+            check_lease(renew=False)
+
+
+def test_heartbeat_survives_database_errors(workdir, monkeypatch):
+    def renew(worker_id: str, entity_id: int, lease_seconds: int) -> bool:
+        raise Exception("Database error: database is locked")
+
+    monkeypatch.setattr(work_queue, "work_queue_renew", renew)
+    db.work_queue_enqueue([1])
+    db.work_queue_claim("a", [1], 0, 3)
+
+    with EntityLease("a", 1, lease_seconds=3) as lease:
+        assert lease._stopped.wait(1.5) is False
+        assert lease._heartbeat.is_alive()
+        check_lease(renew=False)  # Renewed less than a lease period ago
+
+        # Not renewed for a whole lease period
+        lease._heartbeat.join(timeout=5)
+        with pytest.raises(LeaseLostError):
+            check_lease(renew=False)
+
+    # Released for other workers, without being completed
+    assert db.work_queue_claim("b", [1], 0, 300) == 1